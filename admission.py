@@ -0,0 +1,212 @@
+"""Decide, before parsing, whether an upload fits in memory and how to load it if it doesn't.
+
+The footprint is estimated from a parsed sample scaled up to the whole file.
+When it doesn't fit the session's or the process's budget, the load falls back
+to compacted dtypes, then to a memory-mapped file on disk, then to the first
+rows only, instead of risking an out-of-memory kill of every session on the host.
+"""
+
+import io
+import os
+import posixpath
+import zipfile
+from collections import namedtuple
+from xml.etree import ElementTree
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+from caching import ByteLRU, format_bytes, frame_nbytes
+from ingest import SNIFF_BYTES, sniff_delimited, source_size
+from loaders import DISK_BACKED_FORMATS
+from metrics import current_rss_bytes
+from optimize import compact_dtypes
+from workbooks import open_workbook
+
+# Bytes of text, or rows of Parquet and workbooks, parsed for the estimate
+ESTIMATE_SAMPLE_BYTES = 1024 * 1024
+ESTIMATE_SAMPLE_ROWS = 10_000
+# Only this share of the free budget is handed out, as the estimate is rough
+BUDGET_HEADROOM = 0.8
+# Rows of a disk-backed frame put in the grid, which copies whatever it is given
+DISK_GRID_ROWS = 10_000
+
+
+def _memory_limit_bytes():
+    """The container's memory limit (cgroup v2 or v1), else the machine's RAM."""
+    for path in ('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory/memory.limit_in_bytes'):
+        try:
+            with open(path, 'r') as f:
+                value = f.read().strip()
+        except OSError:
+            continue
+        # cgroup v1 reports "unlimited" as a huge number
+        if value.isdigit() and int(value) < 1 << 60:
+            return int(value)
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def _budget_from_env(name, default_bytes):
+    value = os.getenv(name)
+    return int(float(value) * 1024 * 1024) if value else default_bytes
+
+
+_limit = _memory_limit_bytes()
+# Memory the whole process may use, and the frames a single session may load per rerun
+GLOBAL_BUDGET_BYTES = _budget_from_env('MEMORY_BUDGET_GLOBAL_MB', int(_limit * 0.75) if _limit else None)
+SESSION_BUDGET_BYTES = _budget_from_env('MEMORY_BUDGET_SESSION_MB', 1024 * 1024 * 1024)
+
+# Estimated in-memory size of a file as loaded, and as loaded with compacted dtypes
+Estimate = namedtuple('Estimate', ['bytes', 'compact_bytes', 'rows'])
+
+# How to load a file. ``strategy`` is one of 'full', 'compact', 'disk' or
+# 'sample'; ``message`` explains a fallback to the user
+Admission = namedtuple('Admission', ['strategy', 'compact', 'disk_backed', 'max_rows', 'estimate', 'available', 'message'])
+
+_estimates = ByteLRU(1024, sizeof=lambda estimate: 1)
+
+_SPREADSHEET_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+_RELATIONSHIP_NS = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+
+
+def _sample_delimited(source, sep):
+    fmt = sniff_delimited(source, sep)
+    sample = source.read(max(ESTIMATE_SAMPLE_BYTES, SNIFF_BYTES))
+    source.seek(0)
+    size = source_size(source)
+    if len(sample) < size and b'\n' in sample:
+        sample = sample[:sample.rindex(b'\n') + 1]
+    df = pd.read_csv(io.BytesIO(sample), sep=fmt.sep, quotechar=fmt.quotechar, header=0 if fmt.header else None)
+    rows = len(df) if len(sample) >= size else int(len(df) * size / max(len(sample), 1))
+    return df, rows
+
+
+def _sample_parquet(source):
+    source.seek(0)
+    parquet_file = pq.ParquetFile(source)
+    batch = next(parquet_file.iter_batches(batch_size=ESTIMATE_SAMPLE_ROWS), None)
+    source.seek(0)
+    df = batch.to_pandas() if batch is not None else parquet_file.schema_arrow.empty_table().to_pandas()
+    return df, parquet_file.metadata.num_rows
+
+
+def _sheet_xml_bytes(source, sheet):
+    """Uncompressed size of a sheet's XML, a stand-in for its row count.
+
+    The sheet's part is found through workbook.xml and its relationships, as
+    the sheetN.xml file names needn't follow the workbook's sheet order.
+    """
+    source.seek(0)
+    try:
+        with zipfile.ZipFile(source) as archive:
+            workbook = ElementTree.fromstring(archive.read('xl/workbook.xml'))
+            relationships = ElementTree.fromstring(archive.read('xl/_rels/workbook.xml.rels'))
+            targets = {relationship.get('Id'): relationship.get('Target') for relationship in relationships}
+            for element in workbook.iter(f'{_SPREADSHEET_NS}sheet'):
+                if element.get('name') != sheet:
+                    continue
+                target = targets.get(element.get(f'{_RELATIONSHIP_NS}id'))
+                if target is None:
+                    return None
+                # Targets are relative to xl/ unless they start at the package root
+                part = target.lstrip('/') if target.startswith('/') else posixpath.normpath(posixpath.join('xl', target))
+                return archive.getinfo(part).file_size
+            return None
+    except (zipfile.BadZipFile, ElementTree.ParseError, KeyError, OSError):
+        return None
+    finally:
+        source.seek(0)
+
+
+def _sample_workbook(source, sheet):
+    workbook = open_workbook(source)
+    sheet = sheet if sheet is not None else workbook.sheet_names[0]
+    df = workbook.read_sheet(sheet, max_rows=ESTIMATE_SAMPLE_ROWS)
+    if len(df) < ESTIMATE_SAMPLE_ROWS:
+        return df, len(df)
+    # The sample's share of the sheet XML scales it up to the whole sheet
+    sample_xml = len(df.to_csv(index=False)) * 4
+    total_xml = _sheet_xml_bytes(source, sheet)
+    return df, int(len(df) * max(total_xml / sample_xml, 1)) if total_xml else len(df)
+
+
+def admitted_key(key, strategy=None, max_rows=None):
+    """``key`` for a file loaded by ``strategy``. Fallback loads don't share the full frame's key."""
+    if strategy in (None, 'full'):
+        return key
+    return key + ((strategy, max_rows),)
+
+
+def estimate_footprint(source, file_type, sep=None, sheet=None, columns=None, key=None):
+    """Estimate the memory ``source`` will take once parsed, from a sample. ``key`` caches the answer."""
+    if key is not None:
+        estimate = _estimates.get(key)
+        if estimate is not None:
+            return estimate
+
+    if file_type in ('csv', 'txt'):
+        sample, rows = _sample_delimited(source, sep)
+    elif file_type == 'parquet':
+        sample, rows = _sample_parquet(source)
+    elif file_type == 'xlsx':
+        sample, rows = _sample_workbook(source, sheet)
+    else:
+        raise ValueError(f"Can't estimate '.{file_type}' files")
+
+    if columns is not None:
+        sample = sample[[column for column in columns if column in sample.columns]]
+    if len(sample):
+        per_row = frame_nbytes(sample) / len(sample)
+        compact_per_row = frame_nbytes(compact_dtypes(sample)[0]) / len(sample)
+    else:
+        per_row = compact_per_row = 0
+    estimate = Estimate(int(per_row * rows), int(compact_per_row * rows), rows)
+    if key is not None:
+        _estimates.put(key, estimate)
+    return estimate
+
+
+def available_bytes(session_used):
+    """Memory a new frame may take, given the bytes this session has already loaded."""
+    available = SESSION_BUDGET_BYTES - session_used
+    rss = current_rss_bytes()
+    if GLOBAL_BUDGET_BYTES is not None and rss is not None:
+        available = min(available, GLOBAL_BUDGET_BYTES - rss)
+    return max(int(available * BUDGET_HEADROOM), 0)
+
+
+def _round_rows(rows):
+    # Down to two significant figures, so small changes in free memory between
+    # reruns keep the same row limit and with it the cached sample
+    scale = 10 ** max(len(str(rows)) - 2, 0)
+    return rows // scale * scale
+
+
+def admit(estimate, available, file_type, sep=None, compact=False):
+    """Pick the cheapest way to load a file whose footprint is ``estimate``, given ``available`` bytes."""
+    needed = estimate.compact_bytes if compact else estimate.bytes
+    if needed <= available:
+        return Admission('full', compact, False, None, estimate, available, None)
+
+    over = f"needs about {format_bytes(needed)} in memory but only {format_bytes(available)} is free"
+    if not compact and estimate.compact_bytes <= available:
+        return Admission('compact', True, False, None, estimate, available,
+                         f"{over}, so it is loaded with compacted dtypes.")
+    # Arrow's block reader, which writes the file out, only splits on one character
+    # Compacting would copy the mapped columns back onto the heap, so disk-backed loads skip it
+    if file_type in DISK_BACKED_FORMATS and (sep is None or len(sep) == 1):
+        return Admission('disk', False, True, None, estimate, available,
+                         f"{over}, so it is kept in a memory-mapped file on disk and the grid shows its first "
+                         f"{DISK_GRID_ROWS:,} rows. **Apply to full data** runs the code on every row; "
+                         f"operations on it may be slower.")
+
+    per_row = (estimate.compact_bytes if compact or estimate.compact_bytes < estimate.bytes else estimate.bytes) / max(estimate.rows, 1)
+    max_rows = _round_rows(int(available / per_row)) if per_row else estimate.rows
+    if max_rows < 1:
+        return Admission('refuse', compact, False, 0, estimate, available,
+                         f"{over}.")
+    return Admission('sample', True, False, max_rows, estimate, available,
+                     f"{over}, so only its first {max_rows:,} rows are loaded.")
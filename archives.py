@@ -0,0 +1,220 @@
+"""Compressed (.gz, .zst, .bz2) and zipped uploads, read as the files inside them.
+
+A compressed file is decompressed while the parser reads it, so its content
+never sits in memory at full size. Readers that jump around in the file, like
+Parquet's footer lookup, get a copy inflated once into a temporary file on disk.
+"""
+
+import bz2
+import gzip
+import io
+import os
+import shutil
+import struct
+import tempfile
+import zipfile
+from functools import partial
+
+from caching import ByteLRU, upload_hash
+from ingest import read_all
+
+try:
+    import zstandard
+except ImportError:  # optional: only needed for .zst uploads
+    zstandard = None
+
+# Single compressed files, and archives holding several files
+COMPRESSIONS = ('gz', 'zst', 'bz2')
+ARCHIVES = ('zip',)
+
+# Decompressed bytes read to estimate the size of a stream that doesn't record it
+SIZE_SAMPLE_BYTES = 4 * 1024 * 1024
+COPY_CHUNK_BYTES = 1024 * 1024
+
+_sizes = ByteLRU(4096, sizeof=lambda size: 1)
+
+# What a corrupt compressed file raises
+_DECOMPRESS_ERRORS = (OSError, EOFError) + ((zstandard.ZstdError,) if zstandard is not None else ())
+
+
+def compression_of(file_name):
+    """'gz', 'zst', 'bz2' or 'zip' from the last extension, else None."""
+    extension = file_name.rsplit('.', 1)[-1].lower() if '.' in file_name else ''
+    return extension if extension in COMPRESSIONS + ARCHIVES else None
+
+
+def inner_name(file_name):
+    """The name of the compressed file: ``jan.csv.gz`` -> ``jan.csv``."""
+    return file_name.rsplit('.', 1)[0] if compression_of(file_name) in COMPRESSIONS else file_name
+
+
+class DecompressedFile(io.RawIOBase):
+    """The decompressed bytes of a compressed file, or of one file in a zip.
+
+    Reading decompresses as it goes. Seeking back to the start reopens the
+    decompressor and seeking forward skips ahead, which is all the text readers
+    need (a sniff of the first bytes, then one pass); any other seek inflates
+    the file into a temporary file on disk first. ``parent`` is the upload it
+    came from, and ``size`` the decompressed size, estimated if not recorded.
+    """
+
+    def __init__(self, open_stream, name, parent, size):
+        super().__init__()
+        self.name = name
+        self.parent = parent
+        self.size = size
+        self._open_stream = open_stream
+        self._stream = None
+        self._position = 0
+        self._spill = None
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def read(self, size=-1):
+        if self._spill is not None:
+            return self._spill.read(size)
+        if self._stream is None:
+            self._stream = self._open_stream()
+        chunk = self._stream.read(-1 if size is None or size < 0 else size)
+        self._position += len(chunk)
+        return chunk
+
+    def readinto(self, buffer):
+        chunk = self.read(len(buffer))
+        buffer[:len(chunk)] = chunk
+        return len(chunk)
+
+    def tell(self):
+        return self._spill.tell() if self._spill is not None else self._position
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if self._spill is None:
+            if whence == os.SEEK_CUR:
+                offset, whence = self._position + offset, os.SEEK_SET
+            if whence == os.SEEK_SET and offset == 0:
+                if self._position:
+                    self._stream.close()
+                    self._stream, self._position = None, 0
+                return 0
+            if whence == os.SEEK_SET and offset >= self._position:
+                while self._position < offset and self.read(min(COPY_CHUNK_BYTES, offset - self._position)):
+                    pass
+                return self._position
+            self._inflate_to_disk()
+        return self._spill.seek(offset, whence)
+
+    def _inflate_to_disk(self):
+        position = self._position
+        spill = tempfile.TemporaryFile(prefix='mito-upload-')
+        with self._open_stream() as stream:
+            shutil.copyfileobj(stream, spill, COPY_CHUNK_BYTES)
+        self.size = spill.tell()
+        if self._stream is not None:
+            self._stream.close()
+            self._stream = None
+        spill.seek(position)
+        self._spill = spill
+
+    def close(self):
+        if self._stream is not None:
+            self._stream.close()
+            self._stream = None
+        if self._spill is not None:
+            # The temporary file is deleted as it closes
+            self._spill.close()
+            self._spill = None
+        super().close()
+
+
+def _decompressor(compression, raw):
+    if compression == 'gz':
+        return gzip.GzipFile(fileobj=raw, mode='rb')
+    if compression == 'bz2':
+        return bz2.BZ2File(raw, mode='rb')
+    return zstandard.ZstdDecompressor().stream_reader(raw, read_across_frames=True)
+
+
+def _decompress(compression, data):
+    return _decompressor(compression, io.BytesIO(data))
+
+
+def _open_member(data, member):
+    return zipfile.ZipFile(io.BytesIO(data)).open(member)
+
+
+def _recorded_size(compression, data):
+    """The decompressed size if the format stores it, else None."""
+    if compression == 'gz' and 18 <= len(data) < 2 ** 32:
+        # The trailer holds the size modulo 4 GB; text never shrinks below that
+        size = struct.unpack('<I', data[-4:])[0]
+        return size if size >= len(data) else None
+    if compression == 'zst':
+        size = zstandard.frame_content_size(data[:18])
+        return size if size >= 0 else None
+    return None
+
+
+def _estimated_size(compression, data):
+    """The compressed size scaled by how far the first few MB decompress."""
+    raw = io.BytesIO(data)
+    with _decompressor(compression, raw) as stream:
+        sampled = 0
+        while sampled < SIZE_SAMPLE_BYTES:
+            chunk = stream.read(COPY_CHUNK_BYTES)
+            if not chunk:
+                # The whole file was in the sample
+                return sampled
+            sampled += len(chunk)
+        consumed = raw.tell()
+    return int(len(data) * sampled / max(consumed, 1))
+
+
+def _hidden(path):
+    # Folders and files zip tools add on the side, e.g. __MACOSX/ or .DS_Store
+    return any(part.startswith(('.', '__MACOSX')) for part in path.split('/'))
+
+
+def expand_upload(upload):
+    """The files an upload holds: the upload itself, its decompressed content, or each file in a zip.
+
+    Nothing is decompressed here beyond a sample for estimating sizes. Raises
+    ``ValueError`` for a broken archive or a format that needs a missing package.
+    """
+    compression = compression_of(upload.name)
+    if compression is None:
+        return [upload]
+
+    data = read_all(upload)
+    if compression in COMPRESSIONS:
+        if compression == 'zst' and zstandard is None:
+            raise ValueError(f"{upload.name} needs the 'zstandard' package to be read")
+        size = _recorded_size(compression, data)
+        if size is None:
+            key = upload_hash(upload)
+            size = _sizes.get(key)
+            if size is None:
+                try:
+                    size = _estimated_size(compression, data)
+                except _DECOMPRESS_ERRORS as e:
+                    raise ValueError(f"{upload.name} is not a valid .{compression} file: {e}") from None
+                _sizes.put(key, size)
+        return [DecompressedFile(partial(_decompress, compression, data), inner_name(upload.name), upload, size)]
+
+    try:
+        with zipfile.ZipFile(io.BytesIO(data)) as archive:
+            members = [info for info in archive.infolist() if not info.is_dir() and not _hidden(info.filename)]
+    except zipfile.BadZipFile as e:
+        raise ValueError(f"{upload.name} is not a valid zip archive: {e}") from None
+    # Files are named without their folder, unless two in different folders share a name
+    names = [os.path.basename(info.filename) for info in members]
+    return [
+        DecompressedFile(
+            partial(_open_member, data, info.filename), name if names.count(name) == 1 else info.filename,
+            upload, info.file_size,
+        )
+        for info, name in zip(members, names)
+    ]
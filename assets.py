@@ -0,0 +1,23 @@
+"""Static files the page is built from, read from disk once per process."""
+
+import os
+from functools import lru_cache
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+@lru_cache(maxsize=32)
+def _read(path, mtime):
+    with open(path, 'r', encoding='utf-8') as f:
+        return f.read()
+
+
+def read_asset(name):
+    """Contents of a file next to the app. An edited file is read again; otherwise it's only a stat."""
+    path = os.path.join(APP_DIR, name)
+    return _read(path, os.path.getmtime(path))
+
+
+def page_styles(*names):
+    """The stylesheets as ``<style>`` tags, one per file so each keeps its own ``@import``."""
+    return ''.join(f'<style>{read_asset(name)}</style>' for name in names)
@@ -0,0 +1,427 @@
+"""Benchmarks for the ingest, transform and export hot paths.
+
+    python -m bench --scales 10KB,1MB,10MB --output results.json
+    python -m bench --output new.json --baseline results.json
+
+Synthetic files shaped like ``sample_files/`` (pipe-delimited, wide, with
+repetitive text columns) are generated once per scale. Each case runs in a
+fresh process, so its peak memory isn't hidden by an earlier case.
+"""
+
+import argparse
+import ast
+import datetime
+import importlib.metadata
+import io
+import json
+import multiprocessing
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import types
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
+
+from metrics import peak_rss_bytes, reset_peak_rss
+
+SCALES = {
+    '10KB': 10 * 1024,
+    '100KB': 100 * 1024,
+    '1MB': 1024 ** 2,
+    '10MB': 10 * 1024 ** 2,
+    '100MB': 100 * 1024 ** 2,
+    '1GB': 1024 ** 3,
+}
+DEFAULT_SCALES = ['10KB', '1MB', '10MB']
+LOAD_FORMATS = ['txt', 'csv', 'parquet', 'xlsx']
+EXPORT_FORMATS = ['csv', 'csv.gz', 'parquet', 'feather']
+
+# Workbooks bigger than this aren't generated; openpyxl would take minutes
+XLSX_MAX_ROWS = 150_000
+XLSX_SHEETS = 3
+GENERATE_CHUNK_ROWS = 250_000
+CLEAN_NAME_CALLS = 10_000
+
+# Slowdowns smaller than these are treated as noise when comparing runs
+MIN_SECONDS_DELTA = 0.005
+MIN_MEMORY_DELTA_MB = 5.0
+
+CATEGORIES = ['Public Sector Banks', 'Private Sector Banks', 'Foreign Banks', 'Payments Banks', 'Small Finance Banks']
+BANKS = [f'BANK {i:03d}' for i in range(120)]
+MONTH_ENDS = [str(day.date()) for day in pd.date_range('2024-01-31', periods=12, freq='ME')]
+METRICS = [
+    'ATM_CRM_ONSITE', 'ATM_CRM_OFFSITE', 'POS', 'MICRO_ATM', 'CREDIT_CARD_POS_TXN', 'CREDIT_CARD_ECOM',
+    'CREDIT_CARD_OTHERS', 'DEBIT_CARD_POS_TXN', 'DEBIT_CARD_ECOM', 'DEBIT_CARD_OTHERS',
+    'CASH_WITHDRAWAL_ATM', 'CASH_WITHDRAWAL_POS', 'UPI_QR_CODES',
+]
+
+# One measurement. ``fmt`` is the input or output format; ``path`` the generated input
+Case = namedtuple('Case', ['name', 'kind', 'fmt', 'scale', 'path'])
+
+
+def synthetic_frame(rows, seed=0):
+    """A frame shaped like the RBI card files: three repetitive text columns, then count/amount pairs."""
+    rng = np.random.default_rng(seed)
+    data = {
+        'CATEGORY': rng.choice(CATEGORIES, rows),
+        'DATE': rng.choice(MONTH_ENDS, rows),
+        'BANK_NAME': rng.choice(BANKS, rows),
+    }
+    for metric in METRICS:
+        data[f'{metric}_VOLUME_NOS'] = rng.integers(0, 10_000_000, rows)
+        data[f'{metric}_VALUE_AMT'] = np.round(rng.random(rows) * 1e7, 3)
+    return pd.DataFrame(data)
+
+
+def _chunks(rows):
+    for start in range(0, rows, GENERATE_CHUNK_ROWS):
+        yield pa.Table.from_pandas(synthetic_frame(min(GENERATE_CHUNK_ROWS, rows - start), seed=start), preserve_index=False)
+
+
+def rows_for_size(size_bytes):
+    """Rows of the pipe-delimited file that comes closest to ``size_bytes``."""
+    sample = io.BytesIO()
+    pacsv.write_csv(next(_chunks(1000)), sample, write_options=pacsv.WriteOptions(delimiter='|', quoting_style='none'))
+    return max(10, int(size_bytes / (sample.tell() / 1000)))
+
+
+def _write_text(path, rows, delimiter):
+    schema = next(_chunks(1)).schema
+    options = pacsv.WriteOptions(delimiter=delimiter, quoting_style='none')
+    with pacsv.CSVWriter(path, schema, write_options=options) as writer:
+        for table in _chunks(rows):
+            writer.write_table(table)
+
+
+def _write_parquet(path, rows):
+    schema = next(_chunks(1)).schema
+    with pq.ParquetWriter(path, schema) as writer:
+        for table in _chunks(rows):
+            writer.write_table(table)
+
+
+def _write_xlsx(path, rows):
+    import openpyxl
+
+    workbook = openpyxl.Workbook(write_only=True)
+    df = synthetic_frame(rows)
+    for number, sheet_rows in enumerate(np.array_split(np.arange(rows), XLSX_SHEETS), start=1):
+        sheet = workbook.create_sheet(f'Sheet{number}')
+        sheet.append(list(df.columns))
+        for row in df.iloc[sheet_rows].itertuples(index=False):
+            sheet.append(list(row))
+    workbook.save(path)
+
+
+def generate(fmt, scale, data_dir):
+    """Path of the synthetic ``fmt`` file for ``scale``, written on first use. None if the scale is too big for the format."""
+    rows = rows_for_size(SCALES[scale])
+    if fmt == 'xlsx' and rows > XLSX_MAX_ROWS:
+        return None
+    path = os.path.join(data_dir, f'bench_{scale}.{fmt}')
+    if os.path.exists(path):
+        return path
+
+    os.makedirs(data_dir, exist_ok=True)
+    temp_path = f'{path}.tmp'
+    if fmt == 'txt':
+        _write_text(temp_path, rows, '|')
+    elif fmt == 'csv':
+        _write_text(temp_path, rows, ',')
+    elif fmt == 'parquet':
+        _write_parquet(temp_path, rows)
+    elif fmt == 'xlsx':
+        _write_xlsx(temp_path, rows)
+    else:
+        raise ValueError(f"Can't generate '.{fmt}' files")
+    os.replace(temp_path, path)
+    return path
+
+
+def _upload(path):
+    from loaders import NamedBytesIO
+
+    with open(path, 'rb') as f:
+        upload = NamedBytesIO(f.read(), os.path.basename(path))
+    upload.file_id = upload.name
+    return upload
+
+
+def _prepare_load(case):
+    from loaders import file_format, parse_source
+    from workbooks import open_workbook
+
+    upload = _upload(case.path)
+    file_type = file_format(upload.name)
+
+    def run():
+        if file_type == 'xlsx':
+            workbook = open_workbook(upload)
+            frames = [parse_source(upload, file_type, sheet=sheet)[0] for sheet in workbook.sheet_names]
+            return sum(len(df) for df in frames)
+        return len(parse_source(upload, file_type)[0])
+    return run, {'bytes': upload.size}
+
+
+def _prepare_export(case):
+    from export import build_export
+    from loaders import parse_source
+
+    df = parse_source(_upload(case.path), 'txt')[0]
+
+    def run():
+        build_export(df, 'bench', case.fmt)
+        return len(df)
+    return run, {}
+
+
+def _prepare_clean_name(case):
+    from loaders import clean_name
+
+    names = [f'{i} sales report (Q{i % 4 + 1}) 2024-v{i % 7}' for i in range(CLEAN_NAME_CALLS)]
+
+    def run():
+        for name in names:
+            clean_name(name)
+        return len(names)
+    return run, {'calls': len(names)}
+
+
+def app_imports():
+    """Modules ``main.py`` imports at the top, i.e. what every cold start pays for before the first paint."""
+    app_dir = os.path.dirname(os.path.abspath(__file__))
+    with open(os.path.join(app_dir, 'main.py'), 'r', encoding='utf-8') as f:
+        tree = ast.parse(f.read())
+    modules = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            modules += [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.level == 0:
+            modules.append(node.module)
+    return list(dict.fromkeys(modules))
+
+
+def _prepare_startup(case):
+    app_dir = os.path.dirname(os.path.abspath(__file__))
+    modules = app_imports()
+    # Each run is a new interpreter, so nothing is already imported
+    command = [sys.executable, '-c', f"import {', '.join(modules)}"]
+
+    def run():
+        subprocess.run(command, cwd=app_dir, check=True)
+        return None
+    return run, {'modules': len(modules)}
+
+
+def _install_spreadsheet_stub():
+    """Stand in for Mito's grid: hand the frames straight back with no generated code."""
+    def spreadsheet(*dfs, import_folder=None, **kwargs):
+        return {getattr(df, 'name', f'df{i}'): df for i, df in enumerate(dfs, start=1)}, ''
+
+    for name in ('mitosheet', 'mitosheet.streamlit', 'mitosheet.streamlit.v1'):
+        sys.modules[name] = types.ModuleType(name)
+    sys.modules['mitosheet.streamlit.v1'].spreadsheet = spreadsheet
+
+
+def _prepare_app(case):
+    import streamlit as st
+    from streamlit.testing.v1 import AppTest
+
+    # Keep the run's on-disk store away from the real one
+    os.environ['APP_CACHE_DIR'] = tempfile.mkdtemp(prefix='bench-cache-')
+    _install_spreadsheet_stub()
+    upload = _upload(case.path)
+    st.file_uploader = lambda *args, **kwargs: [upload]
+    app_dir = os.path.dirname(os.path.abspath(__file__))
+    os.chdir(app_dir)
+    timings = {}
+
+    def run():
+        app = AppTest.from_file(os.path.join(app_dir, 'main.py'), default_timeout=600)
+        start = time.perf_counter()
+        app.run()
+        timings['first_run_seconds'] = time.perf_counter() - start
+        if app.exception:
+            raise RuntimeError(app.exception[0].value)
+        start = time.perf_counter()
+        app.run()
+        timings['rerun_seconds'] = time.perf_counter() - start
+    return run, timings
+
+
+_PREPARE = {
+    'load': _prepare_load,
+    'export': _prepare_export,
+    'clean_name': _prepare_clean_name,
+    'startup': _prepare_startup,
+    'app': _prepare_app,
+}
+
+
+def measure(case, repeat):
+    """Time ``repeat`` runs of ``case`` and record the peak memory they added. Runs in a worker process."""
+    run, info = _PREPARE[case.kind](case)
+    rss_before = reset_peak_rss()
+    times = []
+    rows = None
+    # The app case is one cold run plus a rerun; repeating it would only time the caches
+    for _ in range(1 if case.kind == 'app' else repeat):
+        start = time.perf_counter()
+        rows = run()
+        times.append(time.perf_counter() - start)
+    result = {
+        'seconds': statistics.median(times),
+        'min_seconds': min(times),
+        'runs': len(times),
+        **info,
+    }
+    if rows is not None:
+        result['rows'] = rows
+    if rss_before is not None:
+        result['peak_mb'] = (peak_rss_bytes() - rss_before) / 1024 ** 2
+    return result
+
+
+def plan_cases(scales, formats, data_dir, include_app=True):
+    cases = [Case('clean_name', 'clean_name', None, None, None)]
+    if include_app:
+        cases.append(Case('startup', 'startup', None, None, None))
+    for scale in scales:
+        for fmt in formats:
+            path = generate(fmt, scale, data_dir)
+            if path is not None:
+                cases.append(Case(f'load:{fmt}:{scale}', 'load', fmt, scale, path))
+        text_path = generate('txt', scale, data_dir)
+        for fmt in EXPORT_FORMATS:
+            cases.append(Case(f'export:{fmt}:{scale}', 'export', fmt, scale, text_path))
+        if include_app:
+            cases.append(Case(f'app:txt:{scale}', 'app', 'txt', scale, text_path))
+    return cases
+
+
+def run_cases(cases, repeat):
+    results = {}
+    context = multiprocessing.get_context('spawn')
+    for case in cases:
+        print(f'{case.name} ...', end=' ', flush=True, file=sys.stderr)
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as worker:
+            try:
+                results[case.name] = worker.submit(measure, case, repeat).result()
+            except Exception as e:
+                results[case.name] = {'error': f'{type(e).__name__}: {e}'}
+        result = results[case.name]
+        print(result.get('error') or f"{result['seconds']:.3f}s", file=sys.stderr)
+    return results
+
+
+def _version(package):
+    try:
+        return importlib.metadata.version(package)
+    except importlib.metadata.PackageNotFoundError:
+        return None
+
+
+def environment():
+    return {
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'packages': {
+            package: _version(package)
+            for package in ('pandas', 'pyarrow', 'numpy', 'streamlit', 'mitosheet', 'openpyxl')
+        },
+    }
+
+
+def compare(current, baseline, threshold):
+    """Lines describing each case against the baseline, and the names of the regressed cases."""
+    lines = []
+    regressed = []
+    for name, result in current['results'].items():
+        base = baseline['results'].get(name)
+        if base is None or 'error' in result or 'error' in base:
+            continue
+        notes = []
+        for metric, floor, unit in (
+            ('seconds', MIN_SECONDS_DELTA, 's'),
+            ('first_run_seconds', MIN_SECONDS_DELTA, 's'),
+            ('rerun_seconds', MIN_SECONDS_DELTA, 's'),
+            ('peak_mb', MIN_MEMORY_DELTA_MB, ' MB'),
+        ):
+            if metric not in result or metric not in base:
+                continue
+            change = result[metric] - base[metric]
+            ratio = result[metric] / base[metric] if base[metric] > 0 else 1.0
+            flag = ''
+            if ratio > 1 + threshold and change > floor:
+                flag = ' REGRESSION'
+                regressed.append(name)
+            notes.append(f'{metric} {base[metric]:.3f}{unit} -> {result[metric]:.3f}{unit} ({ratio:.2f}x){flag}')
+        lines.append(f"{name}: {'; '.join(notes)}")
+    changed = {
+        package: (baseline.get('environment', {}).get('packages', {}).get(package), version)
+        for package, version in current['environment']['packages'].items()
+        if baseline.get('environment', {}).get('packages', {}).get(package) != version
+    }
+    if changed:
+        lines.insert(0, 'Package changes: ' + ', '.join(f'{p} {old} -> {new}' for p, (old, new) in changed.items()))
+    return lines, sorted(set(regressed))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m bench', description=__doc__.split('\n')[0])
+    parser.add_argument('--scales', default=','.join(DEFAULT_SCALES),
+                        help=f"Comma-separated sizes from {', '.join(SCALES)}, or 'all'")
+    parser.add_argument('--formats', default=','.join(LOAD_FORMATS), help='Input formats to load')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per case; the median is reported')
+    parser.add_argument('--skip-app', action='store_true', help="Skip the end-to-end runs of main.py")
+    parser.add_argument('--data-dir', help='Where generated inputs are kept (default: APP_CACHE_DIR/bench)')
+    parser.add_argument('--output', help='Write the results to this JSON file')
+    parser.add_argument('--baseline', help='Compare against results saved by an earlier run')
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help='Relative slowdown or memory growth counted as a regression')
+    args = parser.parse_args(argv)
+    # Imported here, not at the top, so worker processes can still point the
+    # app's cache folder somewhere else before anything reads it
+    from caching import CACHE_DIR
+    data_dir = args.data_dir or os.path.join(CACHE_DIR, 'bench')
+
+    scales = list(SCALES) if args.scales == 'all' else [scale.strip() for scale in args.scales.split(',')]
+    unknown = [scale for scale in scales if scale not in SCALES]
+    if unknown:
+        parser.error(f"Unknown scales: {', '.join(unknown)}")
+    formats = [fmt.strip() for fmt in args.formats.split(',')]
+
+    cases = plan_cases(scales, formats, data_dir, include_app=not args.skip_app)
+    current = {'environment': environment(), 'results': run_cases(cases, args.repeat)}
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(current, f, indent=2)
+    else:
+        json.dump(current, sys.stdout, indent=2)
+        print()
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        lines, regressed = compare(current, baseline, args.threshold)
+        print('\n'.join(lines), file=sys.stderr)
+        if regressed:
+            print(f"{len(regressed)} regressed: {', '.join(regressed)}", file=sys.stderr)
+            return 1
+    return 1 if any('error' in result for result in current['results'].values()) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,145 @@
+"""In-process caches shared by every Streamlit session of the app.
+
+Streamlit re-executes ``main.py`` on every interaction, but imported modules
+stay loaded, so anything kept here survives reruns for the life of the process.
+"""
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+HASH_CHUNK_SIZE = 8 * 1024 * 1024
+
+# Where the app keeps files that should outlive the process
+CACHE_DIR = os.getenv('APP_CACHE_DIR', '.cache')
+
+# Upload hashes are memoised by Streamlit's per-upload file_id so a large file
+# is only hashed once, not on every rerun
+_upload_hashes = OrderedDict()
+_upload_hashes_lock = threading.Lock()
+_MAX_MEMOISED_HASHES = 512
+
+
+def content_hash(source):
+    """Return a hex digest of the bytes of ``source`` (bytes or a file-like)."""
+    hasher = hashlib.blake2b(digest_size=16)
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        hasher.update(source)
+        return hasher.hexdigest()
+
+    if hasattr(source, 'getbuffer'):
+        hasher.update(source.getbuffer())
+        return hasher.hexdigest()
+
+    position = source.tell()
+    source.seek(0)
+    for chunk in iter(lambda: source.read(HASH_CHUNK_SIZE), b''):
+        hasher.update(chunk)
+    source.seek(position)
+    return hasher.hexdigest()
+
+
+def upload_hash(uploaded_file):
+    """Content hash of a Streamlit ``UploadedFile``, memoised per upload."""
+    parent = getattr(uploaded_file, 'parent', None)
+    if parent is not None:
+        # A file inside a compressed upload: the upload's bytes and the file's name identify it
+        return content_hash(f'{upload_hash(parent)}/{uploaded_file.name}'.encode())
+    memo_key = (getattr(uploaded_file, 'file_id', None), uploaded_file.name, getattr(uploaded_file, 'size', None))
+    if memo_key[0] is not None:
+        with _upload_hashes_lock:
+            if memo_key in _upload_hashes:
+                _upload_hashes.move_to_end(memo_key)
+                return _upload_hashes[memo_key]
+
+    digest = content_hash(uploaded_file)
+
+    if memo_key[0] is not None:
+        with _upload_hashes_lock:
+            _upload_hashes[memo_key] = digest
+            while len(_upload_hashes) > _MAX_MEMOISED_HASHES:
+                _upload_hashes.popitem(last=False)
+    return digest
+
+
+def upload_key(file_hash, file_type, sep=None, sheet=None, compact=False, columns=None, filters=()):
+    """``parse_cache`` key of an upload parsed with these options, shared by the grid and the SQL stage."""
+    return (file_hash, file_type, sep, sheet, compact, columns, filters)
+
+
+def frame_nbytes(df):
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+def format_bytes(num_bytes):
+    for unit in ('B', 'KB', 'MB'):
+        if num_bytes < 1024:
+            return f"{num_bytes:,.1f} {unit}" if unit != 'B' else f"{num_bytes:,} B"
+        num_bytes /= 1024
+    return f"{num_bytes:,.2f} GB"
+
+
+class ByteLRU:
+    """Thread-safe LRU cache bounded by the total size of its values."""
+
+    def __init__(self, max_bytes, sizeof=frame_nbytes):
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        size = self.sizeof(value)
+        # Never let a single oversized value flush the whole cache
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.total_bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (value, size)
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.total_bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.total_bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self.total_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+# Parsed uploads, keyed by (content hash, format, parse options)
+parse_cache = ByteLRU(int(float(os.getenv('PARSE_CACHE_MAX_MB', '1024')) * 1024 * 1024))
+
+# Schemas scanned before loading, keyed by (content hash, format, separator); tiny, so bounded by count
+scan_cache = ByteLRU(512, sizeof=lambda schema: 1)
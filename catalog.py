@@ -0,0 +1,171 @@
+"""Index of the files in ``sample_files/`` for the Sample Files tab.
+
+Sizes, row counts, columns and previews are computed once per file and kept
+in a small JSON manifest, refreshed only for files whose size or mtime changed.
+"""
+
+import json
+import os
+import threading
+
+from caching import CACHE_DIR
+from ingest import sniff_delimited
+from loaders import file_format, parse_source
+
+SAMPLE_DIR = 'sample_files'
+MANIFEST_PATH = os.path.join(CACHE_DIR, 'sample_catalog.json')
+PREVIEW_LINES = 5
+COUNT_CHUNK_SIZE = 1024 * 1024
+
+# Display names and descriptions for the files we ship; anything else dropped
+# into the folder is listed under its file name
+KNOWN_FILES = {
+    'ICICI_BLUECHIP_SEP_DEC_2024.txt': {
+        'name': 'ICICI Bluechip Fund (Sep-Dec 2024)',
+        'description': """Mutual fund performance data for ICICI Bluechip Fund comparing two quarters (September and December 2024).
+Contains NAV values and fund metrics.""",
+    },
+    'RBI_CARDS_ATM_POS_DEC2024.txt': {
+        'name': 'RBI Cards Data (December 2024)',
+        'description': """Monthly RBI data on credit/debit card transactions and ATM/POS usage for December 2024.
+Includes transaction volumes and values across different channels.""",
+    },
+    'RBI_CARDS_ATM_POS_2024_FULL_YEAR_MONTHLY.txt': {
+        'name': 'RBI Cards Data (Full Year 2024)',
+        'description': """Comprehensive yearly RBI data on credit/debit card transactions and ATM/POS usage for the entire year 2024.
+Monthly breakdown of transaction metrics.""",
+    },
+}
+
+_memo = {}
+_memo_lock = threading.Lock()
+
+
+def count_lines(path):
+    """Number of lines in a file, counted over raw byte chunks instead of decoded lines."""
+    lines = 0
+    last = b''
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(COUNT_CHUNK_SIZE), b''):
+            lines += chunk.count(b'\n')
+            last = chunk[-1:]
+    # A last line without a trailing newline still counts
+    if last and last != b'\n':
+        lines += 1
+    return lines
+
+
+def describe_file(path):
+    stat = os.stat(path)
+    with open(path, 'rb') as f:
+        fmt = sniff_delimited(f)
+        f.seek(0)
+        preview = []
+        for _ in range(PREVIEW_LINES):
+            line = f.readline()
+            if not line:
+                break
+            preview.append(line.decode('utf-8', errors='replace'))
+
+    header = preview[0].rstrip('\r\n').split(fmt.sep) if preview and fmt.header else []
+    return {
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'rows': count_lines(path),
+        'sep': fmt.sep,
+        'columns': header,
+        'preview': ''.join(preview),
+    }
+
+
+def _load_manifest(manifest_path):
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_manifest(manifest_path, manifest):
+    os.makedirs(os.path.dirname(manifest_path) or '.', exist_ok=True)
+    temp_path = f'{manifest_path}.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+    os.replace(temp_path, manifest_path)
+
+
+def load_catalog(directory=SAMPLE_DIR, manifest_path=MANIFEST_PATH):
+    """Catalog entries for every file in ``directory``.
+
+    A rerun with an unchanged folder costs one directory listing.
+    """
+    try:
+        listing = sorted(
+            (entry.name, entry.stat().st_size, entry.stat().st_mtime_ns)
+            for entry in os.scandir(directory)
+            if entry.is_file() and not entry.name.startswith('.')
+        )
+    except FileNotFoundError:
+        return []
+
+    signature = (directory, tuple(listing))
+    with _memo_lock:
+        if signature in _memo:
+            return _memo[signature]
+
+    manifest = _load_manifest(manifest_path)
+    changed = False
+    entries = []
+    for file_name, size, mtime_ns in listing:
+        info = manifest.get(file_name)
+        if info is None or info['size'] != size or info['mtime_ns'] != mtime_ns:
+            info = manifest[file_name] = describe_file(os.path.join(directory, file_name))
+            changed = True
+        known = KNOWN_FILES.get(file_name, {})
+        entries.append({
+            'file_name': file_name,
+            'file_path': os.path.join(directory, file_name),
+            'name': known.get('name', file_name),
+            'description': known.get('description', f"{len(info['columns'])} columns: {', '.join(info['columns'][:8])}"
+                                     + ('...' if len(info['columns']) > 8 else '')),
+            **info,
+        })
+
+    # Forget files that were removed from the folder
+    for file_name in set(manifest) - {name for name, _, _ in listing}:
+        del manifest[file_name]
+        changed = True
+    if changed:
+        try:
+            _save_manifest(manifest_path, manifest)
+        except OSError:
+            # A read-only deployment still works, it just rescans after a restart
+            pass
+
+    # Shipped files first, in the order above, then everything else by name
+    known_order = list(KNOWN_FILES)
+    entries.sort(key=lambda entry: (
+        known_order.index(entry['file_name']) if entry['file_name'] in known_order else len(known_order),
+        entry['file_name'],
+    ))
+
+    with _memo_lock:
+        _memo.clear()
+        _memo[signature] = entries
+    return entries
+
+
+def sample_key(file):
+    """Parse cache key for a catalog entry; it changes when the file does."""
+    return ('sample', file['file_name'], file['size'], file['mtime_ns'])
+
+
+def open_sample(file):
+    """Parse a sample file into a DataFrame.
+
+    The frame is shared by every session that opens the file, so callers take
+    a shallow copy before naming or editing it.
+    """
+    with open(file['file_path'], 'rb') as f:
+        df, _ = parse_source(f, file_format(file['file_name']))
+    return df
@@ -0,0 +1,138 @@
+"""Stack uploads with the same columns, such as monthly extracts of one report, into one frame."""
+
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from pandas.api.types import union_categoricals
+
+from ingest import dedupe_columns
+
+SOURCE_COLUMN = 'SOURCE_FILE'
+
+
+# Integers up to this size survive being upcast to float64
+_EXACT_IN_FLOAT = 2 ** 53
+
+
+def _is_text(dtype):
+    # Text is object in pandas 2, ``str`` (a StringDtype) in pandas 3, and an
+    # Arrow string from the streaming reader
+    if isinstance(dtype, pd.ArrowDtype):
+        return pa.types.is_string(dtype.pyarrow_dtype) or pa.types.is_large_string(dtype.pyarrow_dtype)
+    return isinstance(dtype, pd.StringDtype) or dtype == object
+
+
+def _numpy_dtype(dtype):
+    """The numpy dtype an Arrow-backed column stands for.
+
+    Files over the streaming threshold are read into ``ArrowDtype`` columns and
+    smaller ones into numpy columns, so one report's months can come back as
+    either.
+    """
+    if not isinstance(dtype, pd.ArrowDtype):
+        return dtype
+    arrow_type = dtype.pyarrow_dtype
+    if pa.types.is_timestamp(arrow_type):
+        return dtype if arrow_type.tz is not None else dtype.numpy_dtype
+    if pa.types.is_integer(arrow_type) or pa.types.is_floating(arrow_type) or pa.types.is_boolean(arrow_type):
+        return dtype.numpy_dtype
+    return dtype
+
+
+def _column_kind(dtype):
+    # Numbers and dates of different widths share a column, upcast as pandas would;
+    # ``compatible_groups`` then keeps out the upcasts that would change a value
+    if _is_text(dtype):
+        return 'text'
+    dtype = _numpy_dtype(dtype)
+    if isinstance(dtype, np.dtype) and dtype.kind in 'iuf':
+        return 'number'
+    if isinstance(dtype, np.dtype) and dtype.kind == 'M':
+        return 'datetime'
+    if isinstance(dtype, pd.CategoricalDtype):
+        return f'category[{dtype.categories.dtype}]'
+    return str(dtype)
+
+
+def schema_signature(df):
+    """Column names in order, with the kind of data each holds."""
+    return tuple((column, _column_kind(dtype)) for column, dtype in df.dtypes.items())
+
+
+def _stacks_exactly(frames):
+    """Whether concatenating ``frames`` keeps every number as it is.
+
+    Integers are upcast to float64 next to floats, and next to uint64 when they
+    are signed; 64-bit IDs past 2**53 would then lose their last digits.
+    """
+    for column in frames[0].columns:
+        dtypes = [_numpy_dtype(df[column].dtype) for df in frames]
+        kinds = {dtype.kind for dtype in dtypes if isinstance(dtype, np.dtype)}
+        unsigned_64 = any(isinstance(dtype, np.dtype) and dtype == np.uint64 for dtype in dtypes)
+        if 'f' not in kinds and not ('i' in kinds and unsigned_64):
+            continue
+        for df, dtype in zip(frames, dtypes):
+            # Narrower integers always fit in a float64
+            if isinstance(dtype, np.dtype) and dtype.kind in 'iu' and dtype.itemsize == 8:
+                values = df[column].dropna()
+                if len(values) and (values.min() < -_EXACT_IN_FLOAT or values.max() > _EXACT_IN_FLOAT):
+                    return False
+    return True
+
+
+def compatible_groups(frames):
+    """Positions of the frames that can be stacked, grouped by schema; only groups of two or more."""
+    groups = {}
+    for position, df in enumerate(frames):
+        # Repeated names were already given ``.1`` suffixes when the file was read
+        if len(df.columns) and df.columns.is_unique:
+            groups.setdefault(schema_signature(df), []).append(position)
+    stackable = []
+    for positions in groups.values():
+        if len(positions) > 1 and not _stacks_exactly([frames[position] for position in positions]):
+            # Frames with the very same dtypes still stack without an upcast
+            exact = {}
+            for position in positions:
+                dtypes = tuple(_column_kind(dtype) if _is_text(dtype) else str(_numpy_dtype(dtype))
+                               for dtype in frames[position].dtypes)
+                exact.setdefault(dtypes, []).append(position)
+            stackable.extend(exact.values())
+        else:
+            stackable.append(positions)
+    return [positions for positions in stackable if len(positions) > 1]
+
+
+def combined_name(names):
+    """The names' common prefix, e.g. ``RBI_CARDS_ATM_POS`` for a year of monthly files."""
+    prefix = os.path.commonprefix(list(names)).rstrip('_ .-')
+    return prefix or 'combined'
+
+
+def combine_frames(frames, sources, source_column=SOURCE_COLUMN):
+    """``frames`` one after another, with each row's entry of ``sources`` in a categorical ``source_column``.
+
+    All frames go through one ``concat``, which sizes every combined column
+    once (Arrow-backed columns are joined as Arrow chunks, without a copy)
+    instead of growing it with repeated appends.
+    """
+    columns = list(frames[0].columns)
+    # A file that already has the column keeps it; ours gets a ``.1`` suffix
+    source_column = dedupe_columns([str(column) for column in columns] + [source_column])[-1]
+
+    # Categoricals only stay categorical through a concat if their categories match
+    frames = [df.copy(deep=False) for df in frames]
+    for column in columns:
+        if isinstance(frames[0][column].dtype, pd.CategoricalDtype):
+            categories = union_categoricals([df[column] for df in frames]).categories
+            for df in frames:
+                df[column] = df[column].cat.set_categories(categories)
+
+    df = pd.concat(frames, ignore_index=True)
+    # Unique, in upload order, so files with the same name share a category
+    categories = list(dict.fromkeys(str(source) for source in sources))
+    positions = np.array([categories.index(str(source)) for source in sources], dtype=np.int32)
+    codes = np.repeat(positions, [len(frame) for frame in frames])
+    df[source_column] = pd.Categorical.from_codes(codes, categories)
+    return df
@@ -0,0 +1,259 @@
+"""Check the Polars replay engine against pandas on Mito-style scripts.
+
+    python -m engine_diff                          # built-in scripts on synthetic data
+    python -m engine_diff --rows 1000000 --seeds 50
+    python -m engine_diff transform.py --input RBI_CARDS_ATM_POS_DEC2024=jan.txt
+
+Each script is replayed by both engines, and the outputs are compared frame by
+frame: names, columns, dtypes, index and values, with floats compared to
+``FLOAT_RTOL``. Every line also says how many statements ran in Polars. A
+script that fails on both engines compares nothing and is reported as
+skipped, not as a match. The exit status is 1 if any script differs.
+"""
+
+import argparse
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from bench import BANKS, synthetic_frame
+from polars_engine import LazyReplay, outputs_match, polars_available
+from replay import replay_code
+
+# Scripts written the way Mito writes them, over ``cards`` (shaped like the
+# sample files) and ``banks`` (a lookup table with repeated keys)
+CASES = {
+    'filters': """
+import pandas as pd
+# Filtered CATEGORY, POS_VALUE_AMT
+cards = cards[(cards['CATEGORY'] == 'Private Sector Banks') & (cards['POS_VALUE_AMT'] > 5000000)]
+""",
+    'text and missing-value filters': """
+cards = cards[(cards['BANK_NAME'].str.contains('01', na=False, regex=False)) | (cards['POS_VALUE_AMT'].isna())]
+cards = cards[~cards['BANK_NAME'].str.startswith('BANK 1', na=False)]
+cards = cards[cards['MICRO_ATM_VALUE_AMT'] != 100.0]
+cards = cards[cards['CATEGORY'].notnull()]
+""",
+    'date filter': """
+import pandas as pd
+cards['DATE'] = pd.to_datetime(cards['DATE'])
+cards = cards[cards['DATE'] >= pd.to_datetime('2024-06-30')]
+""",
+    'column edits': """
+cards.insert(3, 'TOTAL_CARD_VOLUME', 0)
+cards['TOTAL_CARD_VOLUME'] = cards['CREDIT_CARD_POS_TXN_VOLUME_NOS'] + cards['DEBIT_CARD_POS_TXN_VOLUME_NOS']
+cards['AVG_POS_TICKET'] = cards['POS_VALUE_AMT'] / cards['POS_VOLUME_NOS']
+cards.rename(columns={'BANK_NAME': 'BANK'}, inplace=True)
+cards.drop(['MICRO_ATM_VOLUME_NOS', 'MICRO_ATM_VALUE_AMT'], axis=1, inplace=True)
+cards = cards[cards['AVG_POS_TICKET'].notnull()]
+""",
+    'dedupe': """
+cards = cards.drop_duplicates(subset=['BANK_NAME', 'DATE'], keep='last')
+""",
+    'concatenate': """
+import pandas as pd
+cards_concat = pd.concat([cards, cards], join='inner', ignore_index=True)
+cards_stack = pd.concat([cards, cards], join='outer', ignore_index=False)
+""",
+    'lookup merge': """
+temp_df = banks.drop_duplicates(subset=['BANK_NAME']) # Remove duplicates so lookup merge only returns first match
+df_merge = cards.merge(temp_df, left_on=['BANK_NAME'], right_on=['BANK_NAME'], how='left', suffixes=['_cards', '_banks'])
+""",
+    'inner merge': """
+cards_tmp = cards.drop(['DATE'], axis=1)
+df_merge = cards_tmp.merge(banks, left_on=['BANK_NAME'], right_on=['BANK_NAME'], how='inner', suffixes=['_cards', '_banks'])
+""",
+    'pivot': """
+from mitosheet.public.v3 import *
+tmp_df = cards[['BANK_NAME', 'CATEGORY', 'POS_VALUE_AMT', 'POS_VOLUME_NOS']].copy()
+pivot_table = tmp_df.pivot_table(
+    index=['CATEGORY', 'BANK_NAME'],
+    values=['POS_VALUE_AMT', 'POS_VOLUME_NOS'],
+    aggfunc={'POS_VALUE_AMT': ['sum', 'mean'], 'POS_VOLUME_NOS': ['count', 'max']}
+)
+pivot_table = pivot_table.set_axis([flatten_column_header(col) for col in pivot_table.keys()], axis=1)
+cards_pivot = pivot_table.reset_index()
+""",
+    'sort between filters': """
+cards = cards[cards['POS_VOLUME_NOS'] > 1000000]
+cards = cards.sort_values(by='POS_VALUE_AMT', ascending=False, na_position='last')
+cards = cards[cards['CATEGORY'] != 'Payments Banks']
+""",
+    'untranslatable step': """
+cards = cards[cards['POS_VOLUME_NOS'].apply(lambda val: any(val > n for n in [1000000, 2000000]))]
+cards['POS_SHARE'] = cards['POS_VALUE_AMT'] / cards['POS_VALUE_AMT'].sum()
+cards = cards.drop_duplicates(keep='first')
+""",
+}
+
+REGIONS = ['North', 'South', 'East', 'West', None]
+
+
+def make_inputs(rows, seed=0):
+    """``cards`` with some missing values and repeated keys, and the ``banks`` lookup table."""
+    rng = np.random.default_rng(seed)
+    cards = synthetic_frame(rows, seed)
+    for column in ('POS_VALUE_AMT', 'MICRO_ATM_VALUE_AMT', 'UPI_QR_CODES_VALUE_AMT'):
+        cards.loc[rng.random(rows) < 0.05, column] = np.nan
+    cards.loc[rng.random(rows) < 0.02, 'CATEGORY'] = np.nan
+    cards.loc[rng.random(rows) < 0.1, 'MICRO_ATM_VALUE_AMT'] = 100.0
+    # Only some banks are in the lookup, some of them twice
+    names = list(rng.choice(BANKS, 90, replace=False)) + list(rng.choice(BANKS, 15))
+    banks = pd.DataFrame({
+        'BANK_NAME': names,
+        'REGION': rng.choice(np.array(REGIONS, dtype=object), len(names)),
+        'POS_VALUE_AMT': np.round(rng.random(len(names)) * 1e6, 2),
+    })
+    banks['REGION'] = banks['REGION'].astype('str')
+    banks.loc[banks['REGION'] == 'None', 'REGION'] = np.nan
+    return {'cards': cards, 'banks': banks}
+
+
+def random_script(seed, columns):
+    """A random chain of the translatable step kinds over ``cards``."""
+    rng = np.random.default_rng(seed)
+    amounts = [column for column in columns if column.endswith('_VALUE_AMT')]
+    volumes = [column for column in columns if column.endswith('_VOLUME_NOS')]
+    lines = ['import pandas as pd']
+    for step in rng.choice(['filter', 'formula', 'insert', 'rename', 'drop', 'dedupe', 'concat', 'merge'], 6):
+        if step == 'filter':
+            column = rng.choice(amounts + volumes)
+            op = rng.choice(['==', '!=', '>', '>=', '<', '<='])
+            value = int(rng.integers(0, 10_000_000))
+            negate = '~' if rng.random() < 0.3 else ''
+            lines.append(f"cards = cards[{negate}(cards['{column}'] {op} {value}) | (cards['CATEGORY'] == 'Foreign Banks')]")
+        elif step == 'formula':
+            left, right = rng.choice(amounts + volumes, 2)
+            op = rng.choice(['+', '-', '*', '/'])
+            name = f'F{len(lines)}'
+            lines.append(f"cards['{name}'] = cards['{left}'] {op} cards['{right}']")
+            amounts.append(name)
+        elif step == 'insert':
+            name = f'C{len(lines)}'
+            lines.append(f"cards.insert({int(rng.integers(0, 4))}, '{name}', 0)")
+            volumes.append(name)
+        elif step == 'rename' and amounts:
+            old = amounts.pop(int(rng.integers(len(amounts))))
+            lines.append(f"cards.rename(columns={{'{old}': '{old}_RENAMED'}}, inplace=True)")
+            amounts.append(f'{old}_RENAMED')
+        elif step == 'drop' and len(volumes) > 2:
+            column = volumes.pop(int(rng.integers(len(volumes))))
+            lines.append(f"cards.drop(['{column}'], axis=1, inplace=True)")
+        elif step == 'dedupe':
+            keep = rng.choice(["'first'", "'last'", 'False'])
+            lines.append(f"cards = cards.drop_duplicates(subset=['BANK_NAME', 'CATEGORY'], keep={keep})")
+        elif step == 'concat':
+            lines.append(f"cards = pd.concat([cards, cards], join='inner', ignore_index={bool(rng.random() < 0.5)})")
+        elif step == 'merge' and 'POS_VALUE_AMT' in amounts:
+            # A second merge would repeat the suffixed columns, which pandas refuses
+            how = rng.choice(['left', 'inner'])
+            lines.append(
+                f"cards = cards.merge(banks.drop_duplicates(subset=['BANK_NAME']), left_on=['BANK_NAME'], "
+                f"right_on=['BANK_NAME'], how='{how}', suffixes=['_cards', '_banks'])"
+            )
+            amounts = [column + '_cards' if column == 'POS_VALUE_AMT' else column for column in amounts]
+            lines.append("cards.drop(['REGION'], axis=1, inplace=True)")
+    return '\n'.join(lines) + '\n'
+
+
+def check(name, code, inputs):
+    """Replay ``code`` on both engines and return ``(status, line to print)``.
+
+    ``status`` is 'ok' when the outputs match, 'MISMATCH' when they differ or only
+    one engine fails, and 'SKIPPED' when both fail, as a pivot does without
+    mitosheet installed.
+    """
+    start = time.perf_counter()
+    try:
+        expected = replay_code(code, inputs)
+    except Exception as e:
+        expected = e
+    pandas_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    try:
+        replay = LazyReplay(code, inputs).run()
+        actual = replay.outputs()
+    except Exception as e:
+        replay, actual = None, e
+    polars_seconds = time.perf_counter() - start
+
+    detail = ''
+    if isinstance(expected, Exception) and isinstance(actual, Exception):
+        # Nothing was compared, however alike the errors are
+        status = 'SKIPPED'
+        detail = f'pandas: {expected!r}; polars: {actual!r}'
+    elif isinstance(expected, Exception) or isinstance(actual, Exception):
+        status = 'MISMATCH'
+        detail = f'pandas: {expected!r}; polars: {actual!r}'
+    else:
+        status = 'ok' if outputs_match(expected, actual) else 'MISMATCH'
+        if status == 'MISMATCH':
+            for frame, df in expected.items():
+                try:
+                    pd.testing.assert_frame_equal(df, actual.get(frame), check_exact=False, rtol=1e-9, atol=0)
+                except AssertionError as e:
+                    detail = f'{frame}: {str(e).splitlines()[0]}'
+                    break
+            else:
+                detail = f'outputs {list(expected)} vs {list(actual)}'
+    translated = sum(engine == 'polars' for engine, _ in replay.steps) if replay is not None else 0
+    total = len(replay.steps) if replay is not None else 0
+    line = (
+        f'{name}: {status} ({translated}/{total} statements in Polars; '
+        f'pandas {pandas_seconds:.3f}s, polars {polars_seconds:.3f}s)'
+    )
+    return status, line + (f'\n    {detail}' if detail and status != 'ok' else '')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m engine_diff', description=__doc__.split('\n')[0])
+    parser.add_argument('script', nargs='?', help='A generated script to check instead of the built-in ones')
+    parser.add_argument('--input', action='append', default=[], metavar='[NAME=]PATH',
+                        help='Input file for the script, as in python -m replay')
+    parser.add_argument('--sep', help='Separator for CSV/TXT inputs (default: detected)')
+    parser.add_argument('--sheet', help='Sheet to read from XLSX inputs')
+    parser.add_argument('--rows', type=int, default=100_000, help='Rows of synthetic data for the built-in scripts')
+    parser.add_argument('--seeds', type=int, default=10, help='Random scripts to generate besides the built-in ones')
+    args = parser.parse_args(argv)
+    if not polars_available():
+        parser.error("the Polars engine needs the 'polars' package")
+
+    if args.script:
+        from replay import _input_names, _load_inputs, _split_input, script_inputs
+
+        if not args.input:
+            parser.error('a script needs at least one --input')
+        with open(args.script, 'r', encoding='utf-8') as f:
+            cases = {args.script: f.read()}
+        specs = [_split_input(spec) for spec in args.input]
+        try:
+            names = _input_names(specs, script_inputs(cases[args.script]))
+        except ValueError as e:
+            parser.error(str(e))
+        paths = [path for _, path in specs]
+        inputs = dict(zip(names, _load_inputs(paths, args.sep, args.sheet, workers=len(paths))))
+    else:
+        inputs = make_inputs(args.rows)
+        cases = dict(CASES)
+        for seed in range(args.seeds):
+            cases[f'random #{seed}'] = random_script(seed, list(inputs['cards'].columns))
+
+    statuses = []
+    for name, code in cases.items():
+        status, line = check(name, code, inputs)
+        statuses.append(status)
+        print(line)
+    skipped = statuses.count('SKIPPED')
+    print(
+        f"{statuses.count('ok')} of {len(cases)} scripts matched"
+        + (f', {skipped} skipped because both engines failed' if skipped else ''),
+        file=sys.stderr,
+    )
+    return 1 if 'MISMATCH' in statuses else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
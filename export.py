@@ -0,0 +1,272 @@
+"""Write DataFrames out in row chunks so a large frame is never serialised in one piece."""
+
+import gzip
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+import zipfile
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from caching import ByteLRU
+from metrics import timed_import
+
+try:
+    import zstandard
+except ImportError:  # optional: only needed for .csv.zst exports
+    zstandard = None
+
+CHUNK_ROWS = 100_000
+
+# Exports stay in memory up to this size, then spill to a temporary file while being written
+SPOOL_MAX_BYTES = int(float(os.getenv('EXPORT_SPOOL_MAX_MB', '64')) * 1024 * 1024)
+SPOOL_COPY_BYTES = 1024 * 1024
+
+# Budget for the finished exports kept ready for download, shared by all sessions
+EXPORT_CACHE_MAX_BYTES = int(float(os.getenv('EXPORT_CACHE_MAX_MB', '512')) * 1024 * 1024)
+
+# Finished exports. The key fixes the content, so every session asking for the
+# same output of the same inputs downloads one copy
+export_cache = ByteLRU(EXPORT_CACHE_MAX_BYTES, sizeof=lambda export: len(export.data))
+
+# Frames smaller than this in memory are exported straight away; larger ones wait for a click
+EAGER_EXPORT_MAX_BYTES = 32 * 1024 * 1024
+
+# Output formats by the file suffix that selects them
+FORMATS = {
+    '.csv': 'csv',
+    '.txt': 'csv',
+    '.csv.gz': 'csv.gz',
+    '.csv.zst': 'csv.zst',
+    '.parquet': 'parquet',
+    '.feather': 'feather',
+}
+
+EXTENSIONS = {
+    'csv': '.csv',
+    'csv.gz': '.csv.gz',
+    'csv.zst': '.csv.zst',
+    'parquet': '.parquet',
+    'feather': '.feather',
+}
+
+MIME_TYPES = {
+    'csv': 'text/csv',
+    'csv.gz': 'application/gzip',
+    'csv.zst': 'application/zstd',
+    'parquet': 'application/vnd.apache.parquet',
+    'feather': 'application/vnd.apache.arrow.file',
+}
+
+FORMAT_LABELS = {
+    'csv': 'CSV',
+    'csv.gz': 'CSV (gzip)',
+    'csv.zst': 'CSV (zstd)',
+    'parquet': 'Parquet',
+    'feather': 'Feather',
+}
+
+# Bundles of every output frame: one workbook with a sheet per frame, or a zip
+# with a file per frame in one of ``EXTENSIONS``. Both carry the generated code
+BUNDLE_LABELS = {
+    'xlsx': 'Excel workbook, one sheet per frame',
+    **{f'zip/{fmt}': f'Zip of {label} files' for fmt, label in FORMAT_LABELS.items()},
+}
+
+# Excel's limits, and the characters it doesn't allow in sheet names
+XLSX_MAX_ROWS = 1_048_576
+XLSX_MAX_COLUMNS = 16_384
+_SHEET_NAME_CHARS = re.compile(r'[\\/*?:\[\]]')
+
+# Members that are already compressed are stored in the zip as they are
+_COMPRESSED_FORMATS = ('csv.gz', 'csv.zst', 'parquet', 'feather')
+
+# A finished export, ready to hand to st.download_button
+Export = namedtuple('Export', ['data', 'file_name', 'mime'])
+
+
+def available_formats():
+    return [fmt for fmt in EXTENSIONS if fmt != 'csv.zst' or zstandard is not None]
+
+
+def format_for_path(path):
+    name = str(path).lower()
+    for suffix in sorted(FORMATS, key=len, reverse=True):
+        if name.endswith(suffix):
+            return FORMATS[suffix]
+    raise ValueError(f"Can't tell the output format of '{path}'. Use one of: {', '.join(FORMATS)}")
+
+
+def frame_hash(df):
+    """Identity for a frame: its shape, columns and dtypes plus one vectorised hash of every value.
+
+    Unlike a sample, any edited cell changes it.
+    """
+    hasher = hashlib.blake2b(digest_size=16)
+    hasher.update(repr((df.shape, list(map(str, df.columns)), list(map(str, df.dtypes)))).encode())
+    try:
+        hasher.update(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+    except TypeError:
+        # Unhashable cells (lists, dicts) fall back to their text form
+        hasher.update(pd.util.hash_pandas_object(df.astype(str), index=True).to_numpy().tobytes())
+    return hasher.hexdigest()
+
+
+def _write_csv(df, stream, chunk_rows):
+    for start in range(0, max(len(df), 1), chunk_rows):
+        chunk = df.iloc[start:start + chunk_rows]
+        stream.write(chunk.to_csv(index=False, header=start == 0).encode('utf-8'))
+
+
+def _write_parquet(df, stream, chunk_rows):
+    # Typed from the whole frame, so an object column that is empty in the first chunk still gets its type
+    schema = pa.Schema.from_pandas(df, preserve_index=False)
+    with pq.ParquetWriter(stream, schema) as writer:
+        for start in range(0, len(df), chunk_rows):
+            chunk = pa.Table.from_pandas(df.iloc[start:start + chunk_rows], schema=schema, preserve_index=False)
+            writer.write_table(chunk)
+
+
+def _write_feather(df, stream, chunk_rows):
+    schema = pa.Schema.from_pandas(df, preserve_index=False)
+    options = pa.ipc.IpcWriteOptions(compression='zstd')
+    with pa.ipc.new_file(stream, schema, options=options) as writer:
+        for start in range(0, len(df), chunk_rows):
+            chunk = pa.Table.from_pandas(df.iloc[start:start + chunk_rows], schema=schema, preserve_index=False)
+            writer.write_table(chunk)
+
+
+def write_frame(df, stream, fmt, chunk_rows=CHUNK_ROWS):
+    """Write ``df`` to the binary ``stream`` in ``fmt`` (a value of ``FORMATS``)."""
+    if fmt == 'csv':
+        _write_csv(df, stream, chunk_rows)
+    elif fmt == 'csv.gz':
+        with gzip.GzipFile(fileobj=stream, mode='wb', compresslevel=6) as compressed:
+            _write_csv(df, compressed, chunk_rows)
+    elif fmt == 'csv.zst':
+        if zstandard is None:
+            raise ValueError("Zstandard exports need the 'zstandard' package")
+        with zstandard.ZstdCompressor(threads=-1).stream_writer(stream, closefd=False) as compressed:
+            _write_csv(df, compressed, chunk_rows)
+    elif fmt == 'parquet':
+        _write_parquet(df, stream, chunk_rows)
+    elif fmt == 'feather':
+        _write_feather(df, stream, chunk_rows)
+    else:
+        raise ValueError(f"Unsupported export format '{fmt}'")
+
+
+def write_frame_to_path(df, path, fmt=None, chunk_rows=CHUNK_ROWS):
+    with open(path, 'wb') as stream:
+        write_frame(df, stream, fmt or format_for_path(path), chunk_rows)
+
+
+def build_export(df, name, fmt):
+    """Serialise ``df`` through a spooled temporary file and return an ``Export``.
+
+    Only the finished file is read back into memory, never an intermediate
+    text copy of the whole frame.
+    """
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES) as spool:
+        write_frame(df, spool, fmt)
+        spool.seek(0)
+        data = spool.read()
+    return Export(data, f'{name}{EXTENSIONS[fmt]}', MIME_TYPES[fmt])
+
+
+def bundle_formats():
+    return ['xlsx'] + [f'zip/{fmt}' for fmt in available_formats()]
+
+
+def _sheet_name(name, taken):
+    name = _SHEET_NAME_CHARS.sub('_', str(name))[:31] or 'Sheet'
+    candidate, n = name, 1
+    while candidate.lower() in taken:
+        suffix = f'_{n}'
+        candidate, n = name[:31 - len(suffix)] + suffix, n + 1
+    taken.add(candidate.lower())
+    return candidate
+
+
+def _excel_rows(df, chunk_rows):
+    # Excel has no time zones, and openpyxl wants None for missing values
+    for column in df.columns[[isinstance(dtype, pd.DatetimeTZDtype) for dtype in df.dtypes]]:
+        df = df.assign(**{column: df[column].dt.tz_localize(None)})
+    for start in range(0, len(df), chunk_rows):
+        chunk = df.iloc[start:start + chunk_rows].astype(object)
+        yield from chunk.where(chunk.notna(), None).itertuples(index=False, name=None)
+
+
+def _write_xlsx(frames, code, stream, chunk_rows):
+    for name, df in frames.items():
+        if len(df) >= XLSX_MAX_ROWS or len(df.columns) > XLSX_MAX_COLUMNS:
+            raise ValueError(
+                f"{name} has {len(df):,} rows × {len(df.columns):,} columns, more than an Excel sheet holds. "
+                "Download a zip instead."
+            )
+    openpyxl = timed_import('openpyxl')
+    # Write-only mode streams rows to the file instead of keeping every cell in memory
+    workbook = openpyxl.Workbook(write_only=True)
+    taken = set()
+    for name, df in frames.items():
+        sheet = workbook.create_sheet(_sheet_name(name, taken))
+        sheet.append([str(column) for column in df.columns])
+        for row in _excel_rows(df, chunk_rows):
+            sheet.append(row)
+    # A workbook can't carry a .py file, so the code goes on a sheet of its own, a line per row
+    sheet = workbook.create_sheet(_sheet_name('code', taken))
+    for line in (code or '').splitlines():
+        sheet.append([line])
+    workbook.save(stream)
+
+
+def _spooled(df, fmt):
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+    write_frame(df, spool, fmt)
+    spool.seek(0)
+    return spool
+
+
+def _write_zip(frames, code, stream, fmt):
+    # The members are serialised side by side (Arrow and the compressors release
+    # the GIL), then copied into the archive one after another
+    workers = max(1, min(len(frames), os.cpu_count() or 1))
+    with ThreadPoolExecutor(max_workers=workers) as threads:
+        spools = list(threads.map(lambda df: _spooled(df, fmt), frames.values()))
+    compression = zipfile.ZIP_STORED if fmt in _COMPRESSED_FORMATS else zipfile.ZIP_DEFLATED
+    try:
+        with zipfile.ZipFile(stream, 'w', compression=compression) as archive:
+            for name, spool in zip(frames, spools):
+                with archive.open(f'{name}{EXTENSIONS[fmt]}', 'w', force_zip64=True) as member:
+                    shutil.copyfileobj(spool, member, SPOOL_COPY_BYTES)
+            archive.writestr('code.py', code or '', compress_type=zipfile.ZIP_DEFLATED)
+    finally:
+        for spool in spools:
+            spool.close()
+
+
+def build_bundle(frames, code, bundle_format, name='outputs'):
+    """Write every frame of ``frames`` (name -> DataFrame) and ``code`` into one ``Export``.
+
+    ``bundle_format`` is a key of ``BUNDLE_LABELS``. Each frame is serialised
+    once, in row chunks, and the bundle goes through a spooled temporary file
+    like ``build_export``.
+    """
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES) as spool:
+        if bundle_format == 'xlsx':
+            _write_xlsx(frames, code, spool, CHUNK_ROWS)
+            extension, mime = '.xlsx', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        elif bundle_format.startswith('zip/') and bundle_format[4:] in EXTENSIONS:
+            _write_zip(frames, code, spool, bundle_format[4:])
+            extension, mime = '.zip', 'application/zip'
+        else:
+            raise ValueError(f"Unsupported bundle format '{bundle_format}'")
+        spool.seek(0)
+        data = spool.read()
+    return Export(data, f'{name}{extension}', mime)
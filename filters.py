@@ -0,0 +1,86 @@
+"""Simple row filters pushed down into the readers.
+
+A filter is a ``(column, op, value)`` tuple, with ``value`` as typed by the
+user; it is converted to the column's type when the filter is applied.
+Several filters are combined with AND.
+"""
+
+import datetime
+import operator
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+FILTER_OPS = ['==', '!=', '>', '>=', '<', '<=']
+
+_OPERATORS = {
+    '==': operator.eq,
+    '!=': operator.ne,
+    '>': operator.gt,
+    '>=': operator.ge,
+    '<': operator.lt,
+    '<=': operator.le,
+}
+
+
+def coerce_arrow_value(value, arrow_type):
+    """Convert the text of a filter value to a Python value of ``arrow_type``."""
+    if pa.types.is_integer(arrow_type):
+        number = float(value)
+        return int(number) if number.is_integer() else number
+    if pa.types.is_floating(arrow_type) or pa.types.is_decimal(arrow_type):
+        return float(value)
+    if pa.types.is_boolean(arrow_type):
+        return str(value).strip().lower() in ('true', '1', 'yes')
+    if pa.types.is_timestamp(arrow_type):
+        return pd.Timestamp(value).to_pydatetime()
+    if pa.types.is_date(arrow_type):
+        return datetime.date.fromisoformat(str(value).strip())
+    return str(value)
+
+
+def _bad_value(column, value, error):
+    return ValueError(f"Filter value '{value}' doesn't fit column '{column}': {error}")
+
+
+def filter_mask(df, filters):
+    """Boolean mask of the rows of ``df`` that pass every filter.
+
+    Missing values never pass, whatever the operator, as in ``filter_expression``.
+    """
+    mask = pd.Series(True, index=df.index)
+    for column, op, value in filters:
+        series = df[column]
+        mask &= series.notna()
+        try:
+            if pd.api.types.is_bool_dtype(series.dtype):
+                value = str(value).strip().lower() in ('true', '1', 'yes')
+            elif pd.api.types.is_numeric_dtype(series.dtype):
+                value = float(value)
+            elif pd.api.types.is_datetime64_any_dtype(series.dtype):
+                value = pd.Timestamp(value)
+            else:
+                # Missing cells are already masked out, so their 'nan' text can't match
+                series = series.astype(str)
+                value = str(value)
+        except ValueError as e:
+            raise _bad_value(column, value, e) from None
+        mask &= _OPERATORS[op](series, value).fillna(False).astype(bool)
+    return mask
+
+
+def filter_expression(filters, schema):
+    """The filters as a pyarrow compute expression over ``schema``, or None without filters."""
+    expression = None
+    for column, op, value in filters:
+        arrow_type = schema.field(column).type
+        try:
+            coerced = coerce_arrow_value(value, arrow_type)
+            # A fractional bound on an integer column compares as a float
+            scalar = pa.scalar(coerced) if isinstance(coerced, float) else pa.scalar(coerced, arrow_type)
+        except (ValueError, TypeError, pa.ArrowInvalid) as e:
+            raise _bad_value(column, value, e) from None
+        term = _OPERATORS[op](pc.field(column), scalar)
+        expression = term if expression is None else expression & term
+    return expression
@@ -0,0 +1,362 @@
+"""Readers for delimited text uploads (CSV/TXT)."""
+
+import csv
+import io
+import os
+from collections import namedtuple
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
+
+from filters import filter_expression, filter_mask
+
+# Files at or above this size are read with the streaming Arrow reader
+STREAMING_THRESHOLD_BYTES = int(float(os.getenv('STREAMING_INGEST_THRESHOLD_MB', '50')) * 1024 * 1024)
+STREAMING_BLOCK_SIZE = 8 * 1024 * 1024
+
+# How much of the file the sniffer looks at, and the delimiters it considers
+SNIFF_BYTES = 64 * 1024
+SNIFF_DELIMITERS = ',|\t;'
+
+# Rows per chunk when pandas filters a file while reading it
+FILTER_CHUNK_ROWS = 100_000
+
+# What the sniffer learned about a delimited file. ``dtypes`` maps column
+# labels to the dtype seen in the sample, for columns that had any values;
+# ``names`` is the first row as written in the file
+DelimitedFormat = namedtuple('DelimitedFormat', ['sep', 'quotechar', 'header', 'dtypes', 'names'])
+
+# Only text and float columns are pinned from the sample. Integer and boolean
+# columns often gain blanks or fractions further down, which would fail the
+# full parse, so those are still inferred by the reader
+_ARROW_TYPES = {
+    'float64': pa.float64(),
+    'str': pa.string(),
+    'object': pa.string(),
+}
+
+
+def dedupe_columns(names):
+    """Name columns the way pandas does: blanks become ``Unnamed: i``, repeats get ``.1``, ``.2``..."""
+    columns = []
+    seen = {}
+    for i, name in enumerate(names):
+        name = f'Unnamed: {i}' if name is None or name == '' else str(name)
+        candidate = name
+        while candidate in seen:
+            seen[name] += 1
+            candidate = f'{name}.{seen[name]}'
+        seen[candidate] = 0
+        columns.append(candidate)
+    return columns
+
+
+def source_size(source):
+    size = getattr(source, 'size', None)
+    if size is not None:
+        return size
+    position = source.tell()
+    size = source.seek(0, os.SEEK_END)
+    source.seek(position)
+    return size
+
+
+def read_all(source):
+    """All bytes of an in-memory upload or an open binary file."""
+    if hasattr(source, 'getvalue'):
+        return source.getvalue()
+    source.seek(0)
+    return source.read()
+
+
+class _CountingReader:
+    """File-like wrapper that records how many bytes the reader has consumed."""
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.bytes_read = 0
+        self.closed = False
+
+    def read(self, size=-1):
+        chunk = self.raw.read(size)
+        self.bytes_read += len(chunk)
+        return chunk
+
+    def readable(self):
+        return True
+
+    def close(self):
+        self.closed = True
+
+
+def _looks_numeric(value):
+    try:
+        float(value)
+    except ValueError:
+        return False
+    return True
+
+
+def sniff_delimited(source, sep=None):
+    """Work out the delimiter, quoting, header row and column dtypes from the first few KB.
+
+    ``sep`` overrides the detected delimiter. The source position is left at the start.
+    """
+    source.seek(0)
+    sample = source.read(SNIFF_BYTES)
+    source.seek(0)
+    if isinstance(sample, bytes):
+        sample = sample.decode('utf-8', errors='replace')
+    # Only whole lines, unless the sample is the entire file
+    if len(sample) >= SNIFF_BYTES and '\n' in sample:
+        sample = sample[:sample.rindex('\n') + 1]
+    if not sample.strip():
+        return DelimitedFormat(sep or ',', '"', True, {}, [])
+
+    sniffer = csv.Sniffer()
+    try:
+        dialect = sniffer.sniff(sample, delimiters=sep or SNIFF_DELIMITERS)
+        quotechar = dialect.quotechar or '"'
+        detected_sep = dialect.delimiter
+    except csv.Error:
+        quotechar = '"'
+        detected_sep = ','
+    sep = sep or detected_sep
+
+    try:
+        first_row = next(csv.reader(io.StringIO(sample), delimiter=sep, quotechar=quotechar))
+    except (csv.Error, StopIteration, TypeError):
+        # TypeError: a multi-character separator, which only pandas can split on
+        first_row = []
+
+    # The sniffer's header test is easily fooled by all-text files, so only
+    # believe "no header" when the first row also carries numbers
+    header = True
+    try:
+        if not sniffer.has_header(sample):
+            header = not any(_looks_numeric(value) for value in first_row if value.strip())
+    except csv.Error:
+        pass
+
+    try:
+        sample_df = pd.read_csv(
+            io.StringIO(sample), sep=sep, quotechar=quotechar, header=0 if header else None
+        )
+    except (ValueError, pd.errors.ParserError):
+        return DelimitedFormat(sep, quotechar, header, {}, first_row)
+
+    dtypes = {
+        column: str(dtype)
+        for column, dtype in sample_df.dtypes.items()
+        if str(dtype) in _ARROW_TYPES and sample_df[column].notna().any()
+    }
+    return DelimitedFormat(sep, quotechar, header, dtypes, first_row)
+
+
+def column_labels(fmt):
+    """Labels pandas will give the columns of a sniffed file."""
+    return dedupe_columns(fmt.names) if fmt.header else list(range(len(fmt.names)))
+
+
+def _needed_columns(fmt, columns, filters):
+    """Columns to read: the projection plus any only used by the filters, in file order."""
+    wanted = set(column_labels(fmt) if columns is None else columns)
+    wanted.update(column for column, _, _ in filters)
+    return [label for label in column_labels(fmt) if label in wanted]
+
+
+def limit_rows(tables, max_rows=None):
+    """Pass Arrow tables through until ``max_rows`` rows have gone by, then stop reading."""
+    rows = 0
+    for table in tables:
+        if max_rows is not None and rows + table.num_rows >= max_rows:
+            yield table.slice(0, max_rows - rows)
+            return
+        rows += table.num_rows
+        yield table
+
+
+def collect_tables(tables, schema, spill_path=None):
+    """Assemble Arrow tables into a frame of ``ArrowDtype`` columns.
+
+    With ``spill_path`` the tables are written to an Arrow file there and the
+    frame is memory-mapped from it, so its data lives in the page cache rather
+    than on the heap. ``schema`` is used when there are no tables at all.
+    """
+    if spill_path is None:
+        collected = list(tables)
+        table = pa.concat_tables(collected) if collected else schema.empty_table()
+        del collected
+        return table.to_pandas(types_mapper=pd.ArrowDtype, self_destruct=True)
+
+    writer = None
+    try:
+        for table in tables:
+            if writer is None:
+                writer = pa.ipc.new_file(spill_path, table.schema)
+            writer.write_table(table)
+        if writer is None:
+            writer = pa.ipc.new_file(spill_path, schema)
+    finally:
+        if writer is not None:
+            writer.close()
+    df = pa.ipc.open_file(pa.memory_map(spill_path)).read_all().to_pandas(types_mapper=pd.ArrowDtype)
+    try:
+        # The mapping outlives the directory entry, and the disk space is
+        # returned once the frame is gone
+        os.remove(spill_path)
+    except OSError:
+        pass
+    return df
+
+
+def read_delimited_streaming(source, fmt, progress=None, column_types=None, columns=None, filters=(),
+                             max_rows=None, spill_path=None):
+    """Read delimited text block by block with pyarrow's multithreaded CSV reader.
+
+    ``progress`` is called as ``progress(bytes_read, total_bytes, rows)`` after
+    every block. ``filters`` and the ``columns`` projection are applied to each
+    block as it arrives, so dropped rows never accumulate, and reading stops
+    after ``max_rows`` rows. The kept blocks are handed to pandas as
+    ``ArrowDtype`` columns, which wrap the Arrow buffers instead of copying
+    them into NumPy arrays; see ``collect_tables`` for ``spill_path``.
+    """
+    if column_types is None and fmt.header:
+        column_types = {
+            column: _ARROW_TYPES[dtype]
+            for column, dtype in fmt.dtypes.items()
+        }
+
+    # Arrow can skip converting unused columns, but it picks them by their
+    # name in the file, so only when the header names are unique and not blank
+    include_columns = None
+    if (columns is not None or filters) and fmt.header and all(fmt.names) and len(set(fmt.names)) == len(fmt.names):
+        include_columns = _needed_columns(fmt, columns, filters)
+
+    total_bytes = source_size(source)
+    source.seek(0)
+    counting = _CountingReader(source)
+    reader = pacsv.open_csv(
+        counting,
+        read_options=pacsv.ReadOptions(
+            block_size=STREAMING_BLOCK_SIZE,
+            use_threads=True,
+            autogenerate_column_names=not fmt.header,
+        ),
+        parse_options=pacsv.ParseOptions(delimiter=fmt.sep, quote_char=fmt.quotechar),
+        # Treat empty fields as missing, like pandas does
+        convert_options=pacsv.ConvertOptions(
+            column_types=column_types, strings_can_be_null=True, include_columns=include_columns,
+        ),
+    )
+
+    # Blocks are labelled like the final frame (as strings for files without a header)
+    filters = [(str(column), op, value) for column, op, value in filters]
+
+    def blocks():
+        expression = None
+        for batch in reader:
+            table = pa.Table.from_batches([batch])
+            if fmt.header:
+                table = table.rename_columns(dedupe_columns(table.column_names))
+            else:
+                table = table.rename_columns([str(i) for i in range(table.num_columns)])
+            if filters:
+                if expression is None:
+                    expression = filter_expression(filters, table.schema)
+                table = table.filter(expression)
+            if columns is not None:
+                table = table.select([str(column) for column in columns])
+            yield table
+
+    def reported(tables):
+        rows = 0
+        for table in tables:
+            rows += table.num_rows
+            if progress is not None:
+                progress(counting.bytes_read, total_bytes, rows)
+            yield table
+
+    df = collect_tables(reported(limit_rows(blocks(), max_rows)), reader.schema, spill_path)
+    if not fmt.header:
+        df.columns = list(columns) if columns is not None else range(len(df.columns))
+    return df
+
+
+def _read_pandas(source, fmt, dtype, columns, filters, max_rows=None):
+    source.seek(0)
+    options = dict(sep=fmt.sep, quotechar=fmt.quotechar, header=0 if fmt.header else None)
+    if columns is None and not filters:
+        return pd.read_csv(source, dtype=dtype, nrows=max_rows, **options)
+
+    needed = _needed_columns(fmt, columns, filters) if fmt.names else None
+    if dtype and needed is not None:
+        dtype = {column: value for column, value in dtype.items() if column in needed}
+    if not filters:
+        return pd.read_csv(source, dtype=dtype or None, usecols=needed, nrows=max_rows, **options)[list(columns)]
+
+    # Filter chunk by chunk, so only matching rows are ever held together
+    kept = []
+    rows = 0
+    # Closing the reader as a context manager leaves ``source`` open for a retry
+    with pd.read_csv(source, dtype=dtype or None, usecols=needed, chunksize=FILTER_CHUNK_ROWS, **options) as chunks:
+        for chunk in chunks:
+            chunk = chunk[filter_mask(chunk, filters).to_numpy()]
+            kept.append(chunk if columns is None else chunk[list(columns)])
+            rows += len(chunk)
+            if max_rows is not None and rows >= max_rows:
+                break
+    if not kept:
+        return pd.DataFrame(columns=list(columns if columns is not None else needed or []))
+    df = pd.concat(kept, ignore_index=True)
+    return df if max_rows is None else df.head(max_rows)
+
+
+def read_delimited(source, sep=None, progress=None, columns=None, filters=(), max_rows=None, spill_path=None):
+    """Parse delimited text in one pass, using the sniffed format and dtypes.
+
+    ``sep`` overrides the sniffed delimiter. Large files go through the
+    streaming Arrow reader. ``columns`` limits the frame to those columns and
+    ``filters`` (see ``filters.py``) to the matching rows, both applied while
+    reading; ``max_rows`` stops reading early. With ``spill_path`` the frame
+    is backed by a memory-mapped file there instead of the heap.
+    """
+    fmt = sniff_delimited(source, sep)
+    options = dict(progress=progress, columns=columns, filters=filters, max_rows=max_rows, spill_path=spill_path)
+
+    # Arrow only takes a single-character delimiter
+    if len(fmt.sep) == 1 and (spill_path is not None or source_size(source) >= STREAMING_THRESHOLD_BYTES):
+        try:
+            return read_delimited_streaming(source, fmt, **options)
+        except pa.ArrowInvalid:
+            pass
+        # Column types come from the sniffed sample (or Arrow's first block).
+        # The usual misfit is a count column that turns fractional further down,
+        # so widen integers to float once; anything else goes to pandas
+        source.seek(0)
+        first_block = pacsv.open_csv(
+            source,
+            read_options=pacsv.ReadOptions(block_size=STREAMING_BLOCK_SIZE, autogenerate_column_names=not fmt.header),
+            parse_options=pacsv.ParseOptions(delimiter=fmt.sep, quote_char=fmt.quotechar),
+        ).schema
+        widened = {
+            field.name: pa.float64() if pa.types.is_integer(field.type) else field.type
+            for field in first_block
+            if len(first_block.get_all_field_indices(field.name)) == 1
+        }
+        if fmt.header:
+            widened.update((column, _ARROW_TYPES[dtype]) for column, dtype in fmt.dtypes.items())
+        try:
+            return read_delimited_streaming(source, fmt, column_types=widened, **options)
+        except pa.ArrowInvalid:
+            if spill_path is not None:
+                # pandas would need the whole file in memory, which is what spilling avoids
+                raise ValueError("The file can't be read block by block, so it can't be kept on disk") from None
+
+    try:
+        # An explicit dtype map spares pandas its per-column type inference
+        return _read_pandas(source, fmt, fmt.dtypes or None, columns, filters, max_rows)
+    except (ValueError, TypeError, OverflowError):
+        # A column the sample got wrong (e.g. a float column with text further down)
+        return _read_pandas(source, fmt, None, columns, filters, max_rows)
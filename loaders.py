@@ -0,0 +1,272 @@
+"""Turn uploaded files into DataFrames, one at a time or on a worker pool.
+
+Nothing here touches Streamlit, so the same parsing runs in worker threads,
+worker processes and outside the app.
+"""
+
+import io
+import keyword
+import multiprocessing
+import os
+import re
+import threading
+import time
+import uuid
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from caching import CACHE_DIR
+from filters import filter_expression, filter_mask
+from ingest import collect_tables, column_labels, limit_rows, read_all, read_delimited, sniff_delimited
+from optimize import compact_dtypes
+from workbooks import open_workbook
+
+SUPPORTED_FORMATS = ('csv', 'txt', 'xlsx', 'parquet')
+
+LOAD_WORKERS = max(1, int(os.getenv('LOAD_WORKERS', min(8, os.cpu_count() or 1))))
+# Excel parsing is pure Python and holds the GIL, so several workbooks are
+# parsed in separate processes instead of threads
+EXCEL_IN_PROCESSES = os.getenv('LOAD_EXCEL_IN_PROCESSES', '1') == '1'
+
+# Frames loaded with ``disk_backed`` are memory-mapped from files written here
+BACKING_DIR = os.path.join(CACHE_DIR, 'backing')
+
+# One parse request. ``source`` is a file-like with a ``name`` (e.g. a Streamlit
+# UploadedFile); ``progress`` is an optional callback for the text readers.
+# ``columns`` (None for all), ``filters`` and ``max_rows`` narrow what is loaded;
+# ``disk_backed`` keeps CSV/TXT/Parquet data in a memory-mapped file
+LoadJob = namedtuple(
+    'LoadJob',
+    ['source', 'file_type', 'sep', 'sheet', 'compact', 'progress', 'columns', 'filters', 'max_rows', 'disk_backed'],
+    defaults=(None, (), None, False),
+)
+
+# File types that can be loaded with ``disk_backed``
+DISK_BACKED_FORMATS = ('csv', 'txt', 'parquet')
+
+# What a file holds, read without loading it. ``types`` are display strings;
+# ``rows`` and ``row_groups`` are only known for Parquet
+SourceSchema = namedtuple('SourceSchema', ['columns', 'types', 'rows', 'row_groups'])
+
+# ``df`` and ``report`` are None when ``error`` is set; ``seconds`` is the parse time
+LoadResult = namedtuple('LoadResult', ['df', 'report', 'error', 'seconds'], defaults=(None,))
+
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
+
+class NamedBytesIO(io.BytesIO):
+    """In-memory file carrying the attributes the loaders read from uploads."""
+
+    def __init__(self, data, name):
+        super().__init__(data)
+        self.name = name
+        self.size = len(data)
+
+
+def file_format(file_name):
+    return file_name.split('.')[-1].lower()
+
+
+def upload_separator(file_type, sep=None):
+    """The separator the app reads an upload with: a comma for CSV, ``sep`` for TXT (None detects it)."""
+    if file_type == 'csv':
+        return ','
+    return sep if file_type == 'txt' else None
+
+
+def clean_name(name):
+    # Remove any characters that are not alphanumeric or underscore
+    cleaned = re.sub(r'\W+', '_', name)
+    # Ensure the name starts with a letter or underscore
+    if not cleaned[0].isalpha() and cleaned[0] != '_':
+        cleaned = '_' + cleaned
+    # If the name is a Python keyword, prefix it with an underscore
+    if keyword.iskeyword(cleaned):
+        cleaned = '_' + cleaned
+    # Ensure the name is not empty
+    if not cleaned:
+        cleaned = '_unnamed'
+    return cleaned
+
+
+def unique_names(names):
+    """``names`` in order, with repeats made distinct by a ``_2``, ``_3``... suffix."""
+    taken = set()
+    unique = []
+    for name in names:
+        candidate, number = name, 1
+        while candidate in taken:
+            number += 1
+            candidate = f'{name}_{number}'
+        taken.add(candidate)
+        unique.append(candidate)
+    return unique
+
+
+def scan_source(source, file_type, sep=None):
+    """The columns of a CSV, TXT or Parquet file, from its header or footer only."""
+    if file_type in ('csv', 'txt'):
+        fmt = sniff_delimited(source, sep)
+        return SourceSchema(column_labels(fmt), fmt.dtypes, None, None)
+    if file_type == 'parquet':
+        source.seek(0)
+        parquet_file = pq.ParquetFile(source)
+        schema = parquet_file.schema_arrow
+        source.seek(0)
+        return SourceSchema(
+            schema.names, {field.name: str(field.type) for field in schema},
+            parquet_file.metadata.num_rows, parquet_file.metadata.num_row_groups,
+        )
+    raise ValueError(f"Can't scan '.{file_type}' files before loading them")
+
+
+def _backing_path():
+    os.makedirs(BACKING_DIR, exist_ok=True)
+    return os.path.join(BACKING_DIR, f'{uuid.uuid4().hex}.arrow')
+
+
+def _read_parquet_batches(source, columns, filters, max_rows, spill_path):
+    """Read Parquet batch by batch, for when the whole table mustn't be in memory at once."""
+    source.seek(0)
+    parquet_file = pq.ParquetFile(source)
+    schema = parquet_file.schema_arrow
+    expression = filter_expression(filters, schema) if filters else None
+    needed = None
+    if columns is not None:
+        wanted = set(columns) | {column for column, _, _ in filters}
+        needed = [name for name in schema.names if name in wanted]
+
+    def batches():
+        for batch in parquet_file.iter_batches(columns=needed):
+            table = pa.Table.from_batches([batch])
+            if expression is not None:
+                table = table.filter(expression)
+            if columns is not None:
+                table = table.select(list(columns))
+            yield table
+
+    return collect_tables(limit_rows(batches(), max_rows), schema, spill_path)
+
+
+def parse_source(source, file_type, sep=None, sheet=None, compact=False, progress=None, columns=None, filters=(),
+                 max_rows=None, disk_backed=False):
+    """Parse one file into ``(df, compaction report or None)``; raises on failure.
+
+    ``columns`` and ``filters`` are pushed down into the CSV and Parquet
+    readers; workbooks are read whole and narrowed afterwards. ``max_rows``
+    keeps only the first rows, and ``disk_backed`` memory-maps CSV, TXT and
+    Parquet data from a file instead of holding it on the heap.
+    """
+    spill_path = _backing_path() if disk_backed and file_type in DISK_BACKED_FORMATS else None
+    if file_type in ('csv', 'txt'):
+        df = read_delimited(
+            source, sep=sep, progress=progress, columns=columns, filters=filters,
+            max_rows=max_rows, spill_path=spill_path,
+        )
+    elif file_type == 'xlsx':
+        # Sheets stream from the shared read-only workbook opened for this upload
+        workbook = open_workbook(source)
+        sheet = sheet if sheet is not None else workbook.sheet_names[0]
+        # Filters are applied after reading, so the row limit has to wait for them
+        df = workbook.read_sheet(sheet, max_rows=None if filters else max_rows)
+        if filters:
+            df = df[filter_mask(df, filters).to_numpy()].reset_index(drop=True)
+        if columns is not None:
+            df = df[list(columns)]
+        if max_rows is not None:
+            df = df.head(max_rows)
+    elif file_type == 'parquet':
+        if max_rows is not None or spill_path is not None:
+            df = _read_parquet_batches(source, columns, filters, max_rows, spill_path)
+        else:
+            expression = None
+            if filters:
+                source.seek(0)
+                expression = filter_expression(filters, pq.read_schema(source))
+            source.seek(0)
+            # pyarrow checks the filters against each row group's statistics and
+            # skips the groups that can't match
+            df = pd.read_parquet(source, columns=list(columns) if columns is not None else None, filters=expression)
+    else:
+        raise ValueError(
+            f"Unsupported file format '.{file_type}'. "
+            "Please upload CSV, TXT, XLSX, or Parquet, optionally compressed or in a zip."
+        )
+
+    report = None
+    # Compacting copies columns onto the heap, which a memory-mapped frame is meant to avoid
+    if compact and spill_path is None:
+        df, report = compact_dtypes(df)
+    return df, report
+
+
+def _parse_bytes(name, data, file_type, sep, sheet, compact, columns, filters, max_rows):
+    start = time.perf_counter()
+    df, report = parse_source(
+        NamedBytesIO(data, name), file_type, sep=sep, sheet=sheet, compact=compact, columns=columns, filters=filters,
+        max_rows=max_rows,
+    )
+    return df, report, time.perf_counter() - start
+
+
+def _get_process_pool():
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            # Spawned rather than forked: the app process runs many threads
+            _process_pool = ProcessPoolExecutor(
+                max_workers=LOAD_WORKERS, mp_context=multiprocessing.get_context('spawn')
+            )
+        return _process_pool
+
+
+def _run(job):
+    start = time.perf_counter()
+    try:
+        df, report = parse_source(
+            job.source, job.file_type, job.sep, job.sheet, job.compact, job.progress, job.columns, job.filters,
+            job.max_rows, job.disk_backed,
+        )
+    except Exception as e:
+        return LoadResult(None, None, e, time.perf_counter() - start)
+    return LoadResult(df, report, None, time.perf_counter() - start)
+
+
+def excel_in_processes(jobs):
+    """Whether the workbooks among ``jobs`` should be parsed in worker processes."""
+    return EXCEL_IN_PROCESSES and sum(job.file_type == 'xlsx' for job in jobs) > 1
+
+
+def run_job(job, in_process=False):
+    """Parse one job into a ``LoadResult``; with ``in_process`` a workbook goes to a worker process."""
+    if not (in_process and job.file_type == 'xlsx'):
+        return _run(job)
+    start = time.perf_counter()
+    try:
+        # Reading the upload and a broken pool fail this file alone, like a parse error does
+        future = _get_process_pool().submit(
+            _parse_bytes, os.path.basename(job.source.name), read_all(job.source),
+            job.file_type, job.sep, job.sheet, job.compact, job.columns, job.filters, job.max_rows,
+        )
+        df, report, seconds = future.result()
+    except Exception as e:
+        return LoadResult(None, None, e, time.perf_counter() - start)
+    return LoadResult(df, report, None, seconds)
+
+
+def parse_jobs(jobs, workers=LOAD_WORKERS):
+    """Parse independent jobs concurrently and return their ``LoadResult`` in job order.
+
+    A failing job only sets the ``error`` of its own result.
+    """
+    if len(jobs) <= 1 or workers <= 1:
+        return [_run(job) for job in jobs]
+
+    in_process = excel_in_processes(jobs)
+    with ThreadPoolExecutor(max_workers=min(workers, len(jobs))) as threads:
+        return list(threads.map(lambda job: run_job(job, in_process), jobs))
@@ -1,13 +1,35 @@
 import streamlit as st
-from mitosheet.streamlit.v1 import spreadsheet
+import streamlit.components.v1 as components
 import pandas as pd
-import openpyxl
-import io
 import os
-import re
-import keyword
-import time
+import secrets
+import threading
+from concurrent.futures import wait
 from dotenv import load_dotenv
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+from admission import DISK_GRID_ROWS, admit, admitted_key, available_bytes, estimate_footprint
+from archives import expand_upload
+from assets import page_styles
+from caching import format_bytes, frame_nbytes, parse_cache, scan_cache, upload_hash, upload_key
+from catalog import PREVIEW_LINES, load_catalog, open_sample, sample_key
+from combine import SOURCE_COLUMN, combine_frames, combined_name, compatible_groups
+from export import (
+    BUNDLE_LABELS, EAGER_EXPORT_MAX_BYTES, FORMAT_LABELS,
+    available_formats, build_bundle, build_export, bundle_formats, export_cache, frame_hash,
+)
+from filters import FILTER_OPS
+from loaders import (
+    SUPPORTED_FORMATS, LoadJob, clean_name, excel_in_processes, file_format, run_job, scan_source, unique_names,
+    upload_separator,
+)
+from metrics import RunMetrics, import_times, prometheus_text, stage_percentiles, timed_import
+from profiling import PROFILE_SAMPLE_ROWS, profile_frame, profile_table
+from query import QuerySource, duckdb_available, run_query
+from replay import submit_replay
+from scheduler import heavy_jobs
+from store import claim_dataset, dataset_key, load_dataset, recent_datasets, save_dataset
+from viewer import PAGE_SIZES, frame_summary, page, view_positions
+from workbooks import open_workbook
 
 # Load environment variables
 load_dotenv()
@@ -28,201 +50,32 @@ st.set_page_config(
     }
 )
 
-# Load CSS
-def load_css(css_file):
-    with open(css_file, 'r') as f:
-        return f'<style>{f.read()}</style>'
+# Time the stages of this rerun; shown with ?debug=1 and logged when the script ends
+run_metrics = RunMetrics(getattr(get_script_run_ctx(), 'session_id', None))
+show_debug_panel = os.getenv('METRICS_DEBUG_PANEL') == '1' or st.query_params.get('debug') == '1'
 
-st.markdown(load_css('style.css'), unsafe_allow_html=True)
+# Stored datasets are only listed for and reopened by the browser that uploaded them. Its token
+# is kept in a cookie, so it survives a refresh or a restart but never shows up in a shared
+# link, the browser history or a proxy log
+OWNER_COOKIE = 'mito_store_owner'
+store_owner = st.context.cookies.get(OWNER_COOKIE) or st.session_state.get('store_owner')
+if not store_owner:
+    store_owner = st.session_state['store_owner'] = secrets.token_urlsafe(16)
+if st.context.cookies.get(OWNER_COOKIE) != store_owner:
+    # Cookies are only read when a session connects, so this session keeps the new token in its state
+    components.html(
+        f"""<script>
+        const secure = window.parent.location.protocol === 'https:' ? '; Secure' : '';
+        window.parent.document.cookie = '{OWNER_COOKIE}={store_owner}; Path=/; Max-Age=31536000; SameSite=Strict' + secure;
+        </script>""",
+        height=0,
+    )
+# Earlier versions put the token in the URL; take it out of any link still carrying it
+if 'owner' in st.query_params:
+    del st.query_params['owner']
 
-# Add custom font styles
-st.markdown("""
-    <style>
-        @import url('https://fonts.googleapis.com/css2?family=Nunito:wght@400;500;600;700&display=swap');
-        
-        /* Define root variables */
-        :root {
-            --app-font-family: 'Nunito', sans-serif;
-        }
-        
-        /* Global font styles */
-        body,
-        .header-text,
-        h1, h2, h3, h4, h5, h6,
-        .st-emotion-cache-1629p8f h1,
-        .st-emotion-cache-1629p8f h2,
-        .st-emotion-cache-1629p8f h3,
-        .st-emotion-cache-1629p8f p,
-        .st-emotion-cache-1629p8f li,
-        .st-emotion-cache-1629p8f span,
-        .stMarkdown,
-        .stText,
-        .stTitle,
-        .stHeader,
-        div[data-testid="stMarkdownContainer"] p,
-        div[data-testid="stMarkdownContainer"] li,
-        div[data-testid="stHeader"],
-        div[data-testid="stHeading"],
-        div.st-emotion-cache-q8sbsg p,
-        div.st-emotion-cache-1wbqy5l,
-        button, 
-        input, 
-        select, 
-        textarea {
-            font-family: var(--app-font-family) !important;
-            letter-spacing: 0;
-        }
-
-        /* Style the file uploader container */
-        [data-testid="stFileUploader"] {
-            background: linear-gradient(135deg, rgba(88, 80, 236, 0.05), rgba(88, 80, 236, 0.1)) !important;
-            padding: 2rem !important;
-            border-radius: 8px !important;
-            border: 1px solid rgba(88, 80, 236, 0.2) !important;
-        }
-
-        /* Style the actual dropzone */
-        [data-testid="stFileUploader"] > section {
-            background: white !important;
-            border: 2px dashed rgba(88, 80, 236, 0.3) !important;
-            border-radius: 6px !important;
-            color: rgb(88, 80, 236) !important;
-        }
-
-        /* Hide the Browse files button */
-        [data-testid="stFileUploader"] button[data-testid="baseButton-primary"],
-        button.st-emotion-cache-7ym5gk,
-        .st-emotion-cache-1erivf3 button[kind="primary"] {
-            display: none !important;
-        }
-
-        /* Style the button */
-        [data-testid="stFileUploader"] button {
-            background: rgb(88, 80, 236) !important;
-            color: white !important;
-            border: none !important;
-            padding: 0.5rem 1.5rem !important;
-            border-radius: 4px !important;
-            font-weight: 600 !important;
-            transition: all 0.2s ease !important;
-        }
-
-        [data-testid="stFileUploader"] button:hover {
-            background: rgb(108, 99, 255) !important;
-            box-shadow: 0 2px 4px rgba(88, 80, 236, 0.2) !important;
-        }
-
-        /* New attempt for delete buttons */
-        .st-emotion-cache-1erivf3 button.st-emotion-cache-19rxjzo,
-        .st-emotion-cache-1erivf3 button.st-emotion-cache-7ym5gk,
-        .st-emotion-cache-1erivf3 button.st-emotion-cache-1q62vxm,
-        div[class*="uploadedFile"] button,
-        div[class*="fileUploadBlock"] button[class*="removeButton"] {
-            width: 22px !important;
-            height: 22px !important;
-            min-height: 22px !important;
-            min-width: 22px !important;
-            padding: 3px !important;
-            margin: 0 0 0 8px !important;
-            background: rgb(88, 80, 236) !important;
-            border-radius: 3px !important;
-            display: inline-flex !important;
-            align-items: center !important;
-            justify-content: center !important;
-        }
-
-        /* Style the X mark */
-        .st-emotion-cache-1erivf3 button.st-emotion-cache-19rxjzo p,
-        .st-emotion-cache-1erivf3 button.st-emotion-cache-7ym5gk p,
-        .st-emotion-cache-1erivf3 button.st-emotion-cache-1q62vxm p,
-        div[class*="uploadedFile"] button p,
-        div[class*="fileUploadBlock"] button[class*="removeButton"] p {
-            font-size: 14px !important;
-            line-height: 1 !important;
-            margin: 0 !important;
-            padding: 0 !important;
-            color: white !important;
-            transform: scale(0.8) !important;
-        }
-        
-        /* Specific header styling */
-        div[data-testid="stHeader"],
-        div[data-testid="stHeading"],
-        div.st-emotion-cache-q8sbsg p,
-        div.st-emotion-cache-1wbqy5l {
-            font-family: var(--app-font-family) !important;
-            font-weight: 600;
-            letter-spacing: -0.01em;
-        }
-        
-        /* Adjust specific elements if needed */
-        .stMarkdown {
-            line-height: 1.6;
-        }
-
-        /* Header specific adjustments for Nunito */
-        .header-text {
-            font-weight: 600;
-            letter-spacing: -0.01em;
-        }
-
-        /* Footer styles */
-        footer a:hover {
-            color: rgb(67, 56, 202) !important;
-            text-decoration: underline !important;
-        }
-
-        footer {
-            position: fixed;
-            bottom: 0;
-            left: 0;
-            right: 0;
-            z-index: 999;
-            backdrop-filter: blur(8px);
-        }
-
-        /* Reduce space between elements */
-        .element-container {
-            margin-top: 0 !important;
-            margin-bottom: 0 !important;
-            padding-top: 0 !important;
-            padding-bottom: 0 !important;
-        }
-        .stApp > header {
-            margin-bottom: 0 !important;
-        }
-    </style>
-""", unsafe_allow_html=True)
-
-# Hide Streamlit default UI elements
-hide_streamlit_style = """
-            <style>
-            div[data-testid="stToolbar"] {
-            visibility: hidden;
-            height: 0%;
-            position: fixed;
-            }
-            div[data-testid="stDecoration"] {
-            visibility: hidden;
-            height: 0%;
-            position: fixed;
-            }
-            div[data-testid="stStatusWidget"] {
-            visibility: hidden;
-            height: 0%;
-            position: fixed;
-            }
-            #MainMenu {
-            visibility: hidden;
-            height: 0%;
-            }
-            header {
-            visibility: hidden;
-            height: 0%;
-            }
-            </style>
-            """
-st.markdown(hide_streamlit_style, unsafe_allow_html=True)
+# Styles are read from disk once per process
+st.markdown(page_styles('style.css', 'theme.css'), unsafe_allow_html=True)
 
 # Header
 st.markdown(
@@ -303,119 +156,713 @@ Press Win+H (Windows) or Cmd+H (Mac) to use your device's native voice dictation
         # Add a container with custom styling and minimal spacing
         with st.container():
             st.markdown('<div style="margin: 0; padding: 0;">', unsafe_allow_html=True)
-            uploaded_files = st.file_uploader(
+            uploads = st.file_uploader(
                 " ",  # Empty space with a single space to maintain layout
                 accept_multiple_files=True,
-                help="Supported formats: CSV, TXT, XLSX, Parquet",
+                help="Supported formats: CSV, TXT, XLSX, Parquet, compressed as .gz, .zst or .bz2, or several in a .zip",
                 label_visibility="collapsed",  # This will hide the label completely
             )
             st.markdown('</div>', unsafe_allow_html=True)
+
+    # Compressed uploads are read through a decompressing stream, and each file in a zip is an upload of its own
+    uploaded_files = []
+    for upload in uploads or []:
+        try:
+            files = expand_upload(upload)
+        except Exception as e:
+            st.error(f"Error opening {upload.name}: {e}")
+            continue
+        if not files:
+            st.warning(f"{upload.name} doesn't hold any files.")
+        uploaded_files.extend(files)
     
     # Create a container in col3 for separator inputs
     with col3:
+        # Parsed uploads stay on disk for a while and can be opened again without uploading them
+        reopen_keys = []
+        recent = recent_datasets(store_owner)
+        recent_names = {entry['key']: entry['name'] for entry in recent}
+        if recent:
+            labels = {entry['key']: f"{entry['name']} • {entry['rows']:,} rows" for entry in recent}
+            # The options reorder as datasets are used, so the selection is kept in session state
+            reopen_keys = st.multiselect(
+                "Reopen recent datasets",
+                list(labels),
+                default=[key for key in st.session_state.get('reopened_datasets', []) if key in labels],
+                format_func=labels.get,
+                placeholder="Pick datasets",
+                help="Your uploads are kept on disk after parsing, so they reopen instantly after a refresh or restart. "
+                     "They are tied to this browser's cookie, so only this browser sees them.",
+            )
+            st.session_state['reopened_datasets'] = reopen_keys
+
+        # Sample files opened from the Sample Files tab, or picked here
+        sample_files = {file['file_name']: file for file in load_catalog()}
+        open_samples = []
+        if sample_files:
+            st.session_state['open_samples'] = [
+                file_name for file_name in st.session_state.get('open_samples', []) if file_name in sample_files
+            ]
+            open_samples = st.multiselect(
+                "Open sample files",
+                list(sample_files),
+                format_func=lambda file_name: sample_files[file_name]['name'],
+                placeholder="Pick sample files",
+                help="Sample files are read once and shared by everyone using the app, so they open instantly.",
+                key="open_samples",
+            )
+
         separator_inputs = {}
-        if uploaded_files:
-            for uploaded_file in uploaded_files:
+        if uploaded_files or reopen_keys or open_samples:
+            for uploaded_file in uploaded_files or []:
                 if uploaded_file.name.endswith('.txt'):
                     separator_inputs[uploaded_file.name] = st.text_input(
                         f"Separator for {uploaded_file.name}",
-                        ',',
+                        '',
+                        placeholder="Auto-detect",
+                        help="Leave empty to detect the separator from the file, or type one to override it.",
                         key=f"sep_{uploaded_file.name}"
                     )
+            compact_frames = st.checkbox(
+                "Compact dtypes",
+                value=False,
+                help="Store repetitive text as categories, date-like text as dates and downcast numbers where no values change. Cuts memory and speeds up filters and pivots.",
+                key="compact_dtypes",
+            )
+            sample_mode = st.checkbox(
+                "Work on a sample",
+                value=False,
+                help="Edit a sample in the grid, then apply the generated code to the full data for the final output.",
+                key="sample_mode",
+            )
+            if sample_mode:
+                sample_rows = st.number_input("Sample rows", min_value=100, value=10_000, step=1_000, key="sample_rows")
+                sample_method = st.radio("Sample from", ["First rows", "Random rows"], horizontal=True, key="sample_method")
+            sql_mode = st.checkbox(
+                "Query with SQL",
+                value=False,
+                help="Join, filter and aggregate the uploads with SQL first, and open only the query result in the grid."
+                     if duckdb_available() else "Needs the 'duckdb' package.",
+                disabled=not duckdb_available(),
+                key="sql_mode",
+            )
 
-    @st.cache_data
-    def convert_df(df):
-        return df.to_csv(index=False).encode('utf-8')
+    def spreadsheet(*args, **kwargs):
+        # Mito is imported here rather than at the top, so the page is drawn before the first import
+        return timed_import('mitosheet.streamlit.v1').spreadsheet(*args, **kwargs)
 
-    def load_file(uploaded_file, sep=None, selected_sheet=None):
-        try:
-            file_type = uploaded_file.name.split('.')[-1].lower()
-
-            if file_type == 'csv':
-                df = pd.read_csv(uploaded_file)
-            elif file_type == 'txt':
-                # Use the separator from our inputs dictionary
-                sep = separator_inputs.get(uploaded_file.name, ',')
-                df = pd.read_csv(uploaded_file, sep=sep) if sep else None
-                if df is None:
-                    st.warning("Please provide a valid separator for the TXT file.")
-            elif file_type == 'xlsx':
-                xls = pd.ExcelFile(uploaded_file, engine='openpyxl')
-                df = pd.read_excel(xls, sheet_name=selected_sheet) if selected_sheet else None
-            elif file_type == 'parquet':
-                df = pd.read_parquet(uploaded_file)
-            else:
-                df = None
-                st.warning(f"Unsupported file format for {uploaded_file.name}. Please upload CSV, TXT, XLSX, or Parquet.")
-        except Exception as e:
-            st.error(f"Error loading file: {e}")
-            df = None
+    def ingest_progress(file_name, slot):
+        # Worker threads fill in a placeholder laid out by the script thread
+        def update(bytes_read, total_bytes, rows):
+            fraction = min(bytes_read / total_bytes, 1.0) if total_bytes else 1.0
+            text = f"Reading {file_name}: {bytes_read / 1024 ** 2:,.0f} of {total_bytes / 1024 ** 2:,.0f} MB • {rows:,} rows"
+            slot.progress(fraction, text=text)
 
-        return df
+        return update
+
+    script_ctx = get_script_run_ctx()
+    session_id = getattr(script_ctx, 'session_id', None)
+
+    def attach_script_context():
+        # Lets worker threads draw into this session's page
+        add_script_run_ctx(threading.current_thread(), script_ctx)
+
+    def run_load_job(job, in_process):
+        attach_script_context()
+        return run_job(job, in_process)
+
+    def queue_note(ahead):
+        # Heavy jobs from every session share a few workers and take turns
+        if not ahead:
+            return "waiting for a free worker (next in line)"
+        return f"waiting for a free worker ({ahead:,} job{'s' if ahead > 1 else ''} ahead)"
+
+    def wait_for_jobs(futures, slots, labels):
+        """Block until the heavy jobs are done, showing each one's place in the shared queue."""
+        shown = {}
+        while True:
+            _, pending = wait(futures, timeout=0.25)
+            if not pending:
+                break
+            for future, slot, label in zip(futures, slots, labels):
+                if future not in pending:
+                    continue
+                state = 'running' if future.running() else heavy_jobs.position(future)
+                if shown.get(id(slot)) == state:
+                    continue
+                shown[id(slot)] = state
+                if state == 'running':
+                    slot.info(f"⏳ {label}...")
+                else:
+                    slot.info(f"⏳ {label}: {queue_note(state)}")
+
+    def run_heavy_job(label, key, fn, *args, file=None):
+        """``fn(*args)`` on the shared workers, waiting with its place in the queue shown.
+
+        Another session asking for the same ``key`` at the same time waits for
+        this run instead of starting its own. Raises what ``fn`` raises.
+        """
+        future = heavy_jobs.submit(session_id, fn, *args, key=key)
+        slot = st.empty()
+        wait_for_jobs([future], [slot], [label])
+        slot.empty()
+        if future.queued_seconds is not None:
+            run_metrics.record('queue', future.queued_seconds, file=file)
+        return future.result()
+
+    def display_profile(key, df, name):
+        # Computed only when switched on; unchanged columns come from the cache
+        if not st.toggle(
+            f"Profile the columns of {name}", key=f"profile_{key}",
+            help=f"Missing values, distinct counts, ranges, top values and histograms for every column. "
+                 f"Quantiles, top values and histograms use {PROFILE_SAMPLE_ROWS:,} random rows of larger frames, "
+                 f"and distinct counts marked ≈ are estimates.",
+        ):
+            return
+        with run_metrics.stage('profile', file=key, rows=len(df)):
+            table = profile_table(profile_frame(df))
+        st.dataframe(
+            table,
+            column_config={
+                'missing %': st.column_config.NumberColumn(format="%.1f%%"),
+                'histogram': st.column_config.BarChartColumn(y_min=0),
+            },
+            hide_index=True,
+            use_container_width=True,
+        )
 
-    def display_mito_output(dfs, code):
+    def display_result_page(key, df, identity):
+        # Only one page of rows is sent to the browser; sorting and filtering happen here
+        summary = frame_summary(df, identity)
+        dtype_counts = ", ".join(f"{dtype} × {count}" for dtype, count in summary['dtypes'])
+        st.caption(
+            f"{summary['rows']:,} rows × {summary['columns']:,} columns • {format_bytes(summary['memory'])} • {dtype_counts}"
+        )
+
+        column_positions = list(range(len(df.columns)))
+        column_label = lambda position: str(df.columns[position])
+        sort_col, order_col, filter_col, text_col, size_col = st.columns([2, 1, 2, 2, 1])
+        with sort_col:
+            sort_by = st.selectbox("Sort by", [None] + column_positions, key=f"view_sort_{key}",
+                                   format_func=lambda position: "(original order)" if position is None else column_label(position))
+        with order_col:
+            ascending = st.radio("Order", ["Ascending", "Descending"], key=f"view_order_{key}") == "Ascending"
+        with filter_col:
+            filter_column = st.selectbox("Filter column", [None] + column_positions, key=f"view_filter_col_{key}",
+                                         format_func=lambda position: "(no filter)" if position is None else column_label(position))
+        with text_col:
+            filter_text = st.text_input("Filter value", key=f"view_filter_text_{key}",
+                                        help="Text to search for, or a comparison such as `>= 1000` or `!= 0`.")
+        with size_col:
+            page_size = st.selectbox("Rows per page", PAGE_SIZES, index=1, key=f"view_page_size_{key}")
+
+        positions = view_positions(df, identity, sort_by, ascending, filter_column, filter_text.strip())
+        total_pages = max(1, -(-len(positions) // page_size))
+        page_key = f"view_page_{key}"
+        if st.session_state.get(page_key, 1) > total_pages:
+            st.session_state[page_key] = total_pages
+        page_number = st.number_input(f"Page (of {total_pages:,})", min_value=1, max_value=total_pages, step=1, key=page_key)
+
+        st.dataframe(page(df, positions, page_number, page_size), use_container_width=True)
+        first_row = (page_number - 1) * page_size
+        filtered_note = f" (filtered from {len(df):,})" if len(positions) != len(df) else ""
+        if len(positions):
+            st.caption(f"Rows {first_row + 1:,}–{min(first_row + page_size, len(positions)):,} of {len(positions):,}{filtered_note}")
+        else:
+            st.caption(f"No rows match the filter{filtered_note}")
+
+    def display_mito_output(dfs, code, input_keys=()):
         st.header("Code Generated")
         st.code(code, language="python")
 
         st.header("Final Output")
+        formats = available_formats()
+        identities = {}
         for key, df_temp in dfs.items():
             st.subheader(f"DataFrame: {key}")
-            st.dataframe(df_temp, use_container_width=True)
-            
-            csv = convert_df(df_temp)
-            st.download_button(
-                label=f"📥 Download {key} as CSV",
-                data=csv,
-                file_name=f'{key}.csv',
-                mime='text/csv',
+            with run_metrics.stage('render', file=key, rows=len(df_temp)):
+                # An output is fixed by the code and its inputs. The demo folder's inputs
+                # aren't known to the app, so those outputs are hashed in full instead
+                identity = identities[key] = (code, tuple(input_keys), key) if input_keys else frame_hash(df_temp)
+                display_result_page(key, df_temp, identity)
+            display_profile(f"output_{key}", df_temp, key)
+
+            export_format = st.selectbox(
+                f"Download format for {key}", formats,
+                format_func=FORMAT_LABELS.get, key=f"export_format_{key}",
             )
+            export_key = (key, identity, export_format)
+            export = export_cache.get(export_key)
+            if export is None:
+                eager = df_temp.memory_usage(index=False).sum() <= EAGER_EXPORT_MAX_BYTES
+                if eager or st.button(f"Prepare {key} for download", key=f"prepare_export_{key}"):
+                    with run_metrics.stage('export', file=key, rows=len(df_temp)) as stage:
+                        export = run_heavy_job(
+                            f"Preparing {key} as {FORMAT_LABELS[export_format]}", ('export', export_key),
+                            build_export, df_temp, key, export_format, file=key,
+                        )
+                        stage['bytes'] = len(export.data)
+                    export_cache.put(export_key, export)
+
+            if export is not None:
+                st.download_button(
+                    label=f"📥 Download {key} as {FORMAT_LABELS[export_format]}",
+                    data=export.data,
+                    file_name=export.file_name,
+                    mime=export.mime,
+                )
             st.markdown("---")
 
-    def clean_name(name):
-        # Remove any characters that are not alphanumeric or underscore
-        cleaned = re.sub(r'\W+', '_', name)
-        # Ensure the name starts with a letter or underscore
-        if not cleaned[0].isalpha() and cleaned[0] != '_':
-            cleaned = '_' + cleaned
-        # If the name is a Python keyword, prefix it with an underscore
-        if keyword.iskeyword(cleaned):
-            cleaned = '_' + cleaned
-        # Ensure the name is not empty
-        if not cleaned:
-            cleaned = '_unnamed'
-        return cleaned
-
-    if uploaded_files:
-        dataframes = []
+        if not dfs:
+            return
+        # Every output and the code in one file, only built when asked for
+        st.subheader("Download all outputs")
+        bundle_format = st.selectbox(
+            "Bundle format", bundle_formats(), format_func=BUNDLE_LABELS.get, key="bundle_format",
+            help="Each frame is written once, in row chunks. The generated code is included as code.py "
+                 "(a sheet named code in the workbook).",
+        )
+        bundle_key = ('bundle', code, tuple(identities.items()), bundle_format)
+        bundle = export_cache.get(bundle_key)
+        if bundle is None and st.button("Prepare all outputs for download", key="prepare_bundle"):
+            try:
+                with run_metrics.stage('export', rows=sum(len(df) for df in dfs.values())) as stage:
+                    bundle = run_heavy_job(
+                        f"Preparing {len(dfs)} outputs as {BUNDLE_LABELS[bundle_format]}", bundle_key,
+                        build_bundle, dict(dfs), code, bundle_format,
+                    )
+                    stage['bytes'] = len(bundle.data)
+            except Exception as e:
+                st.error(f"Error preparing the outputs for download: {e}")
+            else:
+                export_cache.put(bundle_key, bundle)
+        if bundle is not None:
+            st.download_button(
+                label=f"📦 Download all outputs ({bundle.file_name}, {format_bytes(len(bundle.data))})",
+                data=bundle.data,
+                file_name=bundle.file_name,
+                mime=bundle.mime,
+                key="download_bundle",
+            )
+
+    def sample_frame(df, rows, method):
+        if len(df) <= rows:
+            sampled = df
+        elif method == "Random rows":
+            # Fixed seed so the grid shows the same rows on every rerun
+            sampled = df.sample(n=rows, random_state=0).sort_index()
+        else:
+            sampled = df.head(rows)
+        sampled = sampled.copy(deep=False)
+        sampled.name = df.name
+        return sampled
+
+    @st.fragment(run_every=1)
+    def wait_for_replay(future):
+        if future.done():
+            st.rerun()
+        if future.running():
+            st.info("⏳ Applying the code to the full data...")
+        else:
+            st.info(f"⏳ Applying the code to the full data: {queue_note(heavy_jobs.position(future))}")
+
+    def display_full_replay(dfs, code, full_frames, frame_keys):
+        replay_key = (code, tuple(frame_keys), tuple(dfs.keys()))
+        replay = st.session_state.get('replay')
+        if replay is not None and replay['key'] != replay_key:
+            # The code or the inputs changed since the last replay
+            replay = None
+
+        if st.button("▶️ Apply to full data", disabled=replay is not None and not replay['future'].done()):
+            future = submit_replay(
+                code, {df.name: df for df in full_frames}, list(dfs.keys()), session=session_id, key=('replay', replay_key),
+            )
+            replay = st.session_state['replay'] = {'key': replay_key, 'future': future}
+
+        if replay is None or not replay['future'].done():
+            st.header("Code Generated")
+            st.code(code, language="python")
+            if replay is None:
+                st.info("The grid shows a sample. Click **Apply to full data** to run the code on every row.")
+            else:
+                wait_for_replay(replay['future'])
+            return
+
+        try:
+            outputs = replay['future'].result()
+        except Exception as e:
+            st.error(f"Error applying the code to the full data: {e}")
+            return
+        display_mito_output(outputs, code, frame_keys)
+
+    def cached_upload(uploaded_file, cache_key):
+        """The frame parsed for ``cache_key`` from the parse cache or the on-disk store, or None."""
+        df = parse_cache.get(cache_key)
+        if df is not None:
+            claim_dataset(dataset_key(cache_key), store_owner)
+            return df
+        # A refresh or restart finds the frame in the on-disk store
+        with run_metrics.stage('store_load', file=uploaded_file.name):
+            # The bytes are in hand, so a copy stored by anyone else becomes this browser's too
+            stored = load_dataset(dataset_key(cache_key), store_owner, claim=True)
+        if stored is None:
+            return None
+        df, report = stored
+        parse_cache.put(cache_key, df)
+        if report is not None:
+            st.session_state.setdefault('compaction_reports', {})[uploaded_file.name] = report
+        return df
+
+    def select_load_options(uploaded_file, file_type, sep, file_hash):
+        """Columns and row filters to load, picked from the file's schema before it is parsed."""
+        scan_key = (file_hash, file_type, sep)
+        schema = scan_cache.get(scan_key)
+        if schema is None:
+            try:
+                schema = scan_source(uploaded_file, file_type, sep)
+            except Exception as e:
+                st.warning(f"Couldn't read the columns of {uploaded_file.name} before loading: {e}")
+                return None, ()
+            scan_cache.put(scan_key, schema)
+        if not schema.columns:
+            return None, ()
+
+        with st.expander(f"Columns and filters for {uploaded_file.name}"):
+            details = f"{len(schema.columns):,} columns"
+            if schema.rows is not None:
+                details += f" • {schema.rows:,} rows in {schema.row_groups:,} row groups"
+            st.caption(details)
+            st.dataframe(
+                pd.DataFrame({
+                    'Column': [str(column) for column in schema.columns],
+                    'Type': [schema.types.get(column, 'detected on load') for column in schema.columns],
+                }),
+                hide_index=True,
+                use_container_width=True,
+            )
+            selected = st.multiselect(
+                "Columns to load", schema.columns, placeholder="All columns",
+                key=f"load_columns_{uploaded_file.name}",
+            )
+            labels = {str(column): column for column in schema.columns}
+            filter_rows = st.data_editor(
+                pd.DataFrame({'Column': [], 'Operator': [], 'Value': []}, dtype=object),
+                num_rows="dynamic",
+                column_config={
+                    'Column': st.column_config.SelectboxColumn(options=list(labels)),
+                    'Operator': st.column_config.SelectboxColumn(options=FILTER_OPS),
+                    'Value': st.column_config.TextColumn(),
+                },
+                hide_index=True,
+                use_container_width=True,
+                key=f"load_filters_{uploaded_file.name}",
+            )
+            st.caption("Rows must match every filter. Only the chosen columns and matching rows are read into memory.")
+
+        columns = tuple(column for column in schema.columns if column in selected) or None
+        filters = tuple(
+            (labels[row['Column']], row['Operator'], str(row['Value']).strip())
+            for row in filter_rows.to_dict('records')
+            if row['Column'] in labels and row['Operator'] in FILTER_OPS
+            and not pd.isna(row['Value']) and str(row['Value']).strip()
+        )
+        return columns, filters
+
+    def query_uploads(uploaded_files):
+        """Run the user's SQL over the uploads and return the result as the only frame for the grid."""
+        sources = []
         for uploaded_file in uploaded_files:
-            if uploaded_file.name.endswith('.xlsx'):
-                xls = pd.ExcelFile(uploaded_file, engine='openpyxl')
-                sheet_names = xls.sheet_names
+            file_type = file_format(uploaded_file.name)
+            if file_type not in SUPPORTED_FORMATS:
+                st.warning(f"Unsupported file format for {uploaded_file.name}. Please upload CSV, TXT, XLSX, or Parquet, optionally compressed or in a zip.")
+                continue
+            # An empty separator input means detect it from the file
+            sep = upload_separator(file_type, separator_inputs.get(uploaded_file.name) or None)
+            sources.append(QuerySource(
+                clean_name(os.path.splitext(uploaded_file.name)[0]), uploaded_file, file_type, sep, None,
+                upload_hash(uploaded_file),
+            ))
+        if not sources:
+            return [], []
+
+        tables = ", ".join(f"`{source.name}`" for source in sources)
+        if any(source.file_type == 'xlsx' for source in sources):
+            tables += " • workbooks are queried by their first sheet"
+        st.caption(f"Tables: {tables}")
+        with st.form("sql_form"):
+            sql = st.text_area("SQL", value=f"SELECT *\nFROM {sources[0].name}\nLIMIT 1000", height=150, key="sql_text")
+            if st.form_submit_button("Run query"):
+                st.session_state['sql_submitted'] = sql
+        sql = st.session_state.get('sql_submitted')
+        if not sql:
+            return [], []
+
+        try:
+            with run_metrics.stage('query') as stage:
+                df = run_query(sql, sources)
+                stage['rows'] = len(df)
+        except Exception as e:
+            st.error(f"Query failed: {e}")
+            return [], []
+        df = df.copy(deep=False)
+        df.name = 'query_result'
+        st.caption(f"Query returned {len(df):,} rows × {len(df.columns):,} columns")
+        return [df], [('sql', sql, tuple(source.file_hash for source in sources))]
+
+    dataframes = []
+    frame_keys = []
+    # The upload each entry of ``dataframes`` came from
+    upload_names = []
+    if uploaded_files and sql_mode:
+        dataframes, frame_keys = query_uploads(uploaded_files)
+    elif uploaded_files:
+        # Work out the parse options for each upload and serve what we can from the parse cache
+        planned = []
+        jobs = []
+        # What makes each job's result, so the same parse asked for by two sessions runs once
+        job_keys = []
+        progress_slots = []
+        # Memory taken by this rerun's frames, which later uploads are admitted against
+        session_bytes = 0
+        for uploaded_file in uploaded_files:
+            file_type = file_format(uploaded_file.name)
+            if file_type not in SUPPORTED_FORMATS:
+                st.warning(f"Unsupported file format for {uploaded_file.name}. Please upload CSV, TXT, XLSX, or Parquet, optionally compressed or in a zip.")
+                continue
+
+            # An empty separator input means detect it from the file
+            sep = upload_separator(file_type, separator_inputs.get(uploaded_file.name) or None)
+            selected_sheet = None
+            if file_type == 'xlsx':
+                try:
+                    sheet_names = open_workbook(uploaded_file).sheet_names
+                except Exception as e:
+                    st.error(f"Error opening workbook {uploaded_file.name}: {e}")
+                    continue
                 selected_sheet = st.selectbox(f"Select a sheet name for {uploaded_file.name}", sheet_names)
-            else:
-                selected_sheet = None
-            
-            df = load_file(uploaded_file, selected_sheet=selected_sheet)
-            
+                if not selected_sheet:
+                    continue
+
+            with run_metrics.stage('upload', file=uploaded_file.name, bytes=uploaded_file.size):
+                file_hash = upload_hash(uploaded_file)
+            columns, filters = None, ()
+            if file_type != 'xlsx':
+                columns, filters = select_load_options(uploaded_file, file_type, sep, file_hash)
+
+            # Reruns reuse the parsed frame as long as the bytes and options are unchanged.
+            # A frame loaded in full is shared with any session, as it takes no more memory
+            cache_key = upload_key(file_hash, file_type, sep, selected_sheet, compact_frames, columns, filters)
+            df = cached_upload(uploaded_file, cache_key)
+            if df is None:
+                # Estimate the parsed size first and pick a cheaper way to load it if it won't fit
+                with run_metrics.stage('admission', file=uploaded_file.name, bytes=uploaded_file.size):
+                    try:
+                        estimate = estimate_footprint(uploaded_file, file_type, sep, selected_sheet, columns, key=cache_key)
+                    except Exception:
+                        # Let the parser report files the sample can't be read from
+                        estimate = None
+                admission = None
+                if estimate is not None:
+                    admission = admit(estimate, available_bytes(session_bytes), file_type, sep, compact_frames)
+                    if admission.strategy == 'refuse':
+                        st.error(f"{uploaded_file.name} {admission.message} Try again with fewer files open or fewer columns.")
+                        continue
+                    if admission.strategy != 'full':
+                        # A fallback is only reused by sessions whose budget gives the same one
+                        cache_key = admitted_key(cache_key, admission.strategy, admission.max_rows)
+                        df = cached_upload(uploaded_file, cache_key)
             if df is not None:
-                # Use the cleaned file name (without extension) as the DataFrame name
-                file_name = clean_name(os.path.splitext(uploaded_file.name)[0])
-                df.name = file_name
-                dataframes.append(df)
+                if df.attrs.get('admission', {}).get('strategy') != 'disk':
+                    session_bytes += frame_nbytes(df)
+                planned.append((uploaded_file, cache_key, df, None))
+                continue
+
+            if admission is not None and admission.strategy != 'disk':
+                needed = estimate.compact_bytes if admission.compact else estimate.bytes
+                session_bytes += min(needed, admission.available)
+            planned.append((uploaded_file, cache_key, None, admission))
+            job_keys.append(('parse', cache_key))
+            slot = st.empty()
+            progress_slots.append(slot)
+            jobs.append(LoadJob(
+                uploaded_file, file_type, sep, selected_sheet,
+                admission.compact if admission else compact_frames,
+                ingest_progress(uploaded_file.name, slot), columns, filters,
+                admission.max_rows if admission else None,
+                admission.disk_backed if admission else False,
+            ))
+
+        # Parse the cache misses side by side on the workers shared by all sessions; results come back in upload order
+        in_process = excel_in_processes(jobs)
+        futures = [
+            heavy_jobs.submit(session_id, run_load_job, job, in_process, key=job_key)
+            for job, job_key in zip(jobs, job_keys)
+        ]
+        wait_for_jobs(futures, progress_slots, [f"Reading {job.source.name}" for job in jobs])
+        for slot in progress_slots:
+            slot.empty()
+        for job, future in zip(jobs, futures):
+            if future.queued_seconds is not None:
+                run_metrics.record('queue', future.queued_seconds, file=job.source.name)
+        results = iter([future.result() for future in futures])
 
+        for uploaded_file, cache_key, df, admission in planned:
+            if df is None:
+                result = next(results)
+                if result.error is not None:
+                    st.error(f"Error loading file {uploaded_file.name}: {result.error}")
+                    continue
+                df = result.df
+                run_metrics.record('parse', result.seconds, file=uploaded_file.name, rows=len(df), bytes=uploaded_file.size)
+                if admission is not None and admission.strategy != 'full':
+                    # Cached under the fallback's own key, so reruns that get the same fallback reuse it
+                    df.attrs['admission'] = {'strategy': admission.strategy, 'message': admission.message}
+                parse_cache.put(cache_key, df)
+                # A row sample or a disk-backed frame isn't the dataset the options describe
+                if admission is None or admission.strategy in ('full', 'compact'):
+                    save_dataset(dataset_key(cache_key), df, uploaded_file.name, result.report, store_owner)
+                if result.report is not None:
+                    st.session_state.setdefault('compaction_reports', {})[uploaded_file.name] = result.report
+            df = df.copy(deep=False)
+            fallback = df.attrs.get('admission', {})
+            if fallback:
+                message = f"{uploaded_file.name} {fallback['message']}"
+                if fallback['strategy'] == 'sample' and file_format(uploaded_file.name) != 'xlsx':
+                    message += " Keep fewer columns under \"Columns and filters\" to load more rows."
+                st.warning(message)
+
+            # Use the cleaned file name (without extension) as the DataFrame name
+            file_name = clean_name(os.path.splitext(uploaded_file.name)[0])
+            df.name = file_name
+            dataframes.append(df)
+            # The key records any fallback, so outputs, views and exports of a fallback
+            # load are never cached as the full frame's
+            frame_keys.append(cache_key)
+            upload_names.append(uploaded_file.name)
+
+            report = st.session_state.get('compaction_reports', {}).get(uploaded_file.name)
+            if compact_frames and report:
+                st.caption(
+                    f"{file_name}: {format_bytes(report['before'])} → {format_bytes(report['after'])} "
+                    f"after compacting {len(report['changes'])} of {len(df.columns)} columns"
+                )
+            display_profile(f"upload_{uploaded_file.name}", df, uploaded_file.name)
+
+        # Uploads with the same columns, such as one file per month, can be stacked into one frame.
+        # Row samples and disk-backed frames aren't the whole file, so they stay separate
+        eligible = [
+            position for position, df in enumerate(dataframes)
+            if df.attrs.get('admission', {}).get('strategy') not in ('sample', 'disk')
+        ]
+        combined, absorbed = {}, set()
+        for group in compatible_groups([dataframes[position] for position in eligible]):
+            positions = [eligible[i] for i in group]
+            names = [upload_names[position] for position in positions]
+            if not st.checkbox(
+                f"Combine {len(names)} uploads with the same columns into one frame ({', '.join(names)})",
+                key=f"combine_{'|'.join(names)}",
+                help=f"Stacks the files in upload order, with a {SOURCE_COLUMN} column naming the file each row came from.",
+            ):
+                continue
+            combine_key = ('combined', tuple(frame_keys[position] for position in positions))
+            df = parse_cache.get(combine_key)
+            if df is None:
+                members = [dataframes[position] for position in positions]
+                try:
+                    with run_metrics.stage('combine', rows=sum(len(member) for member in members)):
+                        df = combine_frames(members, names)
+                except Exception as e:
+                    st.error(f"Error combining {', '.join(names)}: {e}")
+                    continue
+                parse_cache.put(combine_key, df)
+            df = df.copy(deep=False)
+            df.name = combined_name([dataframes[position].name for position in positions])
+            combined[positions[0]] = (df, combine_key)
+            absorbed.update(positions[1:])
+        if combined:
+            kept = [
+                combined.get(position, (df, key))
+                for position, (df, key) in enumerate(zip(dataframes, frame_keys)) if position not in absorbed
+            ]
+            dataframes = [df for df, _ in kept]
+            frame_keys = [key for _, key in kept]
+
+        cache_stats = parse_cache.stats()
+        st.caption(
+            f"Parse cache: {cache_stats['hits']:,} hits • {cache_stats['misses']:,} misses • "
+            f"{format_bytes(cache_stats['bytes'])} of {format_bytes(cache_stats['max_bytes'])} used"
+        )
+
+    # Reopened datasets join the uploads, unless the same upload is already open
+    open_keys = {dataset_key(frame_key) for frame_key in frame_keys}
+    for key in reopen_keys:
+        if key in open_keys:
+            continue
+        cache_key = ('store', key)
+        df = parse_cache.get(cache_key)
+        if df is None:
+            stored = load_dataset(key, store_owner)
+            if stored is None:
+                st.warning("A recent dataset has expired from the store. Please upload it again.")
+                continue
+            df = stored[0]
+            parse_cache.put(cache_key, df)
+        df = df.copy(deep=False)
+        df.name = clean_name(os.path.splitext(recent_names[key])[0])
+        dataframes.append(df)
+        frame_keys.append(cache_key)
+
+    # Sample files are parsed once per process and shared read-only by every session that opens them
+    for file_name in open_samples:
+        file = sample_files[file_name]
+        cache_key = sample_key(file)
+        df = parse_cache.get(cache_key)
+        if df is None:
+            try:
+                df = run_heavy_job(f"Reading {file['name']}", cache_key, open_sample, file, file=file_name)
+            except Exception as e:
+                st.error(f"Error loading sample file {file_name}: {e}")
+                continue
+            parse_cache.put(cache_key, df)
+        df = df.copy(deep=False)
+        df.name = clean_name(os.path.splitext(file_name)[0])
+        dataframes.append(df)
+        frame_keys.append(cache_key)
+
+    if uploaded_files or reopen_keys or open_samples:
         if dataframes:
+            # Mito calls its inputs df1, df2... unless it is given names. The generated
+            # code then reads the same variables a replay binds, so names must be distinct
+            df_names = unique_names([df.name for df in dataframes])
+            for df, name in zip(dataframes, df_names):
+                df.name = name
+            # Mito deep-copies every frame, so one kept on disk for lack of memory only goes in as its first rows
+            on_disk = [df.attrs.get('admission', {}).get('strategy') == 'disk' for df in dataframes]
             try:
-                # Call the Mitosheet spreadsheet function with all dataframes
-                dfs, code = spreadsheet(*dataframes)
+                if sample_mode or any(on_disk):
+                    # The grid only gets a sample; the full frames are used when the code is replayed
+                    samples = [
+                        sample_frame(df, sample_rows, sample_method) if sample_mode
+                        else sample_frame(df, DISK_GRID_ROWS, "First rows") if disk else df
+                        for df, disk in zip(dataframes, on_disk)
+                    ]
+                    with run_metrics.stage('spreadsheet', rows=sum(len(df) for df in samples)):
+                        dfs, code = spreadsheet(*samples, df_names=df_names)
+                    display_full_replay(dfs, code, dataframes, frame_keys)
+                else:
+                    # Call the Mitosheet spreadsheet function with all dataframes
+                    with run_metrics.stage('spreadsheet', rows=sum(len(df) for df in dataframes)):
+                        dfs, code = spreadsheet(*dataframes, df_names=df_names)
 
-                # Display Mitosheet output
-                display_mito_output(dfs, code)
+                    # Display Mitosheet output
+                    display_mito_output(dfs, code, frame_keys)
             except Exception as e:
                 st.error(f"Error processing spreadsheet: {e}")
     else:
         try:
             # Load demo file and interact with Mitosheet
-            dfs, code = spreadsheet(import_folder='./data')
+            with run_metrics.stage('spreadsheet'):
+                dfs, code = spreadsheet(import_folder='./data')
             if len(dfs) != 0:
                 display_mito_output(dfs, code)
         except Exception as e:
@@ -440,6 +887,17 @@ Press Win+H (Windows) or Cmd+H (Mac) to use your device's native voice dictation
     """, unsafe_allow_html=True)
 
 # Sample Files Tab Content
+SAMPLE_FILES_PER_PAGE = 20
+SAMPLE_EAGER_DOWNLOAD_BYTES = 5 * 1024 * 1024
+
+
+def open_in_mito(file_name):
+    # Runs before the rerun, so the MitoSheet tab's picker already shows the file
+    selected = st.session_state.get('open_samples', [])
+    if file_name not in selected:
+        st.session_state['open_samples'] = selected + [file_name]
+
+
 with samples_tab:
     st.title("Sample Files")
     
@@ -451,84 +909,69 @@ with samples_tab:
                  border: 1px solid rgba(255, 171, 0, 0.2);
                  margin: 0.5rem 0 1.5rem 0;
                  font-size: 0.95rem;'>
-            ℹ️ All sample files use pipe ( <code>|</code> ) as delimiter. When importing, enter <code>|</code> in the delimiter field.
+            ℹ️ All sample files use pipe ( <code>|</code> ) as delimiter. It is detected automatically when importing; type <code>|</code> in the separator field only if you need to override it.
         </div>
     """, unsafe_allow_html=True)
     
-    def count_file_rows(file_path):
-        try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                return sum(1 for _ in f)
-        except Exception as e:
-            return "Unable to count rows"
-    
-    # Sample file metadata
-    sample_files = [
-        {
-            "name": "ICICI Bluechip Fund (Sep-Dec 2024)",
-            "description": """Mutual fund performance data for ICICI Bluechip Fund comparing two quarters (September and December 2024). 
-Contains NAV values and fund metrics.""",
-            "file_path": "sample_files/ICICI_BLUECHIP_SEP_DEC_2024.txt",
-            "size": "7.0 KB",
-            "rows": count_file_rows('sample_files/ICICI_BLUECHIP_SEP_DEC_2024.txt'),
-            "preview_rows": 5
-        },
-        {
-            "name": "RBI Cards Data (December 2024)",
-            "description": """Monthly RBI data on credit/debit card transactions and ATM/POS usage for December 2024. 
-Includes transaction volumes and values across different channels.""",
-            "file_path": "sample_files/RBI_CARDS_ATM_POS_DEC2024.txt",
-            "size": "14 KB",
-            "rows": count_file_rows('sample_files/RBI_CARDS_ATM_POS_DEC2024.txt'),
-            "preview_rows": 5
-        },
-        {
-            "name": "RBI Cards Data (Full Year 2024)",
-            "description": """Comprehensive yearly RBI data on credit/debit card transactions and ATM/POS usage for the entire year 2024. 
-Monthly breakdown of transaction metrics.""",
-            "file_path": "sample_files/RBI_CARDS_ATM_POS_2024_FULL_YEAR_MONTHLY.txt",
-            "size": "157 KB",
-            "rows": count_file_rows('sample_files/RBI_CARDS_ATM_POS_2024_FULL_YEAR_MONTHLY.txt'),
-            "preview_rows": 5
-        }
-    ]
+    # Sizes, row counts and previews come from the catalog manifest, not from reading the files
+    catalog = load_catalog()
+    if len(catalog) > SAMPLE_FILES_PER_PAGE:
+        search = st.text_input("Search sample files", key="sample_search", placeholder="File name or column")
+        if search:
+            needle = search.lower()
+            catalog = [
+                file for file in catalog
+                if needle in file['name'].lower() or needle in file['file_name'].lower()
+                or any(needle in column.lower() for column in file['columns'])
+            ]
+        if len(catalog) > SAMPLE_FILES_PER_PAGE:
+            st.caption(f"Showing {SAMPLE_FILES_PER_PAGE} of {len(catalog):,} files; search to narrow down")
+            catalog = catalog[:SAMPLE_FILES_PER_PAGE]
 
     # Display sample files catalog with enhanced styling
-    for file in sample_files:
-        with st.expander(f"{file['name']} ({file['size']} • {file['rows']:,} rows)"):
+    for file in catalog:
+        with st.expander(f"{file['name']} ({format_bytes(file['size'])} • {file['rows']:,} rows)"):
             st.markdown(f"""
             <div style='background-color: rgba(79, 70, 229, 0.05); padding: 1rem; border-radius: 0.5rem; margin-bottom: 1rem;'>
                 {file['description']}
             </div>
             """, unsafe_allow_html=True)
             
-            # Read and display preview with enhanced styling
-            try:
-                with open(file['file_path'], 'r', encoding='utf-8') as f:
-                    preview_data = ''.join([next(f) for _ in range(file['preview_rows'])])
-                st.markdown("**📄 Preview (First 5 rows):**")
-                st.code(preview_data, language='text')
-            except Exception as e:
-                st.warning(f"Preview not available: {str(e)}")
+            # Display preview with enhanced styling
+            if file['preview']:
+                st.markdown(f"**📄 Preview (First {PREVIEW_LINES} rows):**")
+                st.code(file['preview'], language='text')
+            else:
+                st.warning("Preview not available: the file is empty")
             
-            # Download button with enhanced styling and spinner
+            # The file is only read when a download is set up, and large files wait for a click
             try:
-                with open(file['file_path'], 'rb') as f:
-                    file_data = f.read()
-                    
                 col1, col2, col3 = st.columns([1,2,1])
                 with col2:
-                    if st.download_button(
-                        label=f"📥 Download {file['name']}",
-                        data=file_data,
-                        file_name=file['file_path'].split('/')[-1],
-                        mime='text/plain',
+                    opened = file['file_name'] in st.session_state.get('open_samples', [])
+                    st.button(
+                        f"✅ {file['name']} is open in MitoSheet" if opened else f"📝 Open {file['name']} in MitoSheet",
+                        key=f"open_sample_{file['file_name']}",
+                        on_click=open_in_mito,
+                        args=(file['file_name'],),
+                        disabled=opened,
                         use_container_width=True,
-                    ):
-                        with st.spinner(f'Preparing download for {file["name"]}...'):
-                            # Add a small delay to show the spinner (especially for small files)
-                            time.sleep(1)
-                        st.success(f'✅ {file["name"]} is ready for download!')
+                    )
+                    prepare_key = f"prepare_sample_{file['file_name']}"
+                    if file['size'] > SAMPLE_EAGER_DOWNLOAD_BYTES and not st.session_state.get(prepare_key):
+                        if st.button(f"Prepare {file['name']} for download", key=f"{prepare_key}_button", use_container_width=True):
+                            st.session_state[prepare_key] = True
+                            st.rerun()
+                    else:
+                        with open(file['file_path'], 'rb') as f:
+                            if st.download_button(
+                                label=f"📥 Download {file['name']}",
+                                data=f,
+                                file_name=file['file_name'],
+                                mime='text/plain',
+                                use_container_width=True,
+                            ):
+                                st.success(f'✅ {file["name"]} is ready for download!')
             except Exception as e:
                 st.error(f"Error setting up download: {str(e)}")
 
@@ -552,4 +995,30 @@ Monthly breakdown of transaction metrics.""",
            🔗 Access Files on Google Drive
         </a>
     </div>
-    """, unsafe_allow_html=True)
\ No newline at end of file
+    """, unsafe_allow_html=True)
+
+run_metrics.finish()
+if show_debug_panel:
+    with st.expander("⏱️ Performance", expanded=True):
+        st.caption(f"Rerun {run_metrics.run_id}")
+        jobs = heavy_jobs.stats()
+        st.caption(
+            f"Heavy jobs: {jobs['running']} running on {jobs['workers']} workers • "
+            f"{jobs['queued']} queued from {jobs['sessions']} sessions"
+        )
+        st.dataframe(
+            pd.DataFrame(run_metrics.stages, columns=['stage', 'seconds', 'rows', 'bytes', 'file', 'peak_rss_bytes']),
+            hide_index=True,
+            use_container_width=True,
+        )
+        st.caption("All reruns in this process" + (" (this was its first)" if run_metrics.cold else ""))
+        st.dataframe(pd.DataFrame.from_dict(stage_percentiles(), orient='index'), use_container_width=True)
+        imports = import_times()
+        if imports:
+            st.caption("First import of lazily loaded modules")
+            st.dataframe(
+                pd.DataFrame(sorted(imports.items()), columns=['module', 'seconds']),
+                hide_index=True,
+                use_container_width=True,
+            )
+        st.download_button("Download Prometheus metrics", prometheus_text(), file_name="metrics.prom", mime="text/plain")
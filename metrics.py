@@ -0,0 +1,300 @@
+"""Per-stage timings for each rerun of the app, with process-wide percentiles.
+
+Finished runs are logged as one JSON line each, to standard error unless
+``METRICS_LOG_PATH`` names a file, and, when ``METRICS_PROM_PATH`` is set, summarised in a Prometheus text file that node_exporter's textfile
+collector (or anything else) can scrape.
+"""
+
+import importlib
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from itertools import count
+from collections import defaultdict, deque, namedtuple
+from contextlib import contextmanager
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # Windows: peak memory isn't reported
+    resource = None
+
+# Stage timings kept per stage for the percentiles
+METRICS_WINDOW = int(os.getenv('METRICS_WINDOW', '1000'))
+METRICS_LOG_PATH = os.getenv('METRICS_LOG_PATH')
+METRICS_PROM_PATH = os.getenv('METRICS_PROM_PATH')
+QUANTILES = (0.5, 0.9, 0.99)
+# Seconds between resident memory samples; sampling only runs while a stage is open
+RSS_SAMPLE_SECONDS = 0.01
+
+# One timed stage. ``file`` is set for per-upload stages; ``peak_rss_bytes`` is
+# the process's highest sampled resident memory while the stage ran, or None
+# for stages recorded after the fact (queue waits, parses in worker processes)
+StageRecord = namedtuple('StageRecord', ['stage', 'seconds', 'rows', 'bytes', 'file', 'peak_rss_bytes'])
+
+logger = logging.getLogger('metrics')
+_handler = logging.FileHandler(METRICS_LOG_PATH, encoding='utf-8') if METRICS_LOG_PATH else logging.StreamHandler()
+_handler.setFormatter(logging.Formatter('%(message)s'))
+logger.addHandler(_handler)
+logger.setLevel(logging.INFO)
+# Records are JSON lines; the root logger's format would break them
+logger.propagate = False
+
+_windows = defaultdict(lambda: deque(maxlen=METRICS_WINDOW))
+_totals = defaultdict(lambda: {'count': 0, 'seconds': 0.0, 'rows': 0, 'bytes': 0})
+_lock = threading.Lock()
+# Seconds each lazily imported module took the first time it was needed
+_import_seconds = {}
+_first_run_claimed = False
+
+
+def _proc_status(field):
+    with open('/proc/self/status', 'r') as f:
+        for line in f:
+            if line.startswith(field + ':'):
+                return int(line.split()[1]) * 1024
+    raise OSError(f'{field} not in /proc/self/status')
+
+
+def current_rss_bytes():
+    try:
+        return _proc_status('VmRSS')
+    except OSError:
+        return None
+
+
+def peak_rss_bytes():
+    """Highest resident memory of the process so far, or None where the OS doesn't say."""
+    try:
+        return _proc_status('VmHWM')
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def reset_peak_rss():
+    """Restart the peak RSS from the current RSS where the OS allows it (Linux) and return the new baseline."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return _proc_status('VmRSS')
+    except OSError:
+        return peak_rss_bytes()
+
+
+class _RssSampler:
+    """Samples resident memory in one background thread while any stage is open.
+
+    Each open stage keeps the highest sample seen since it opened, so a stage
+    that allocates and frees reports its peak rather than where it ended.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._peaks = {}
+        self._tokens = count()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def open(self):
+        """Start tracking a peak; returns a token for ``close``, or None where RSS can't be read."""
+        rss = current_rss_bytes()
+        if rss is None:
+            return None
+        with self._lock:
+            token = next(self._tokens)
+            self._peaks[token] = rss
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='metrics-rss', daemon=True)
+                self._thread.start()
+        self._wake.set()
+        return token
+
+    def close(self, token):
+        """The peak since ``open``, including the memory held now."""
+        if token is None:
+            return None
+        rss = current_rss_bytes() or 0
+        with self._lock:
+            return max(self._peaks.pop(token), rss)
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            rss = current_rss_bytes() or 0
+            with self._lock:
+                if not self._peaks:
+                    # Sleep until the next stage opens
+                    self._wake.clear()
+                    continue
+                for token, peak in self._peaks.items():
+                    if rss > peak:
+                        self._peaks[token] = rss
+            time.sleep(self.interval)
+
+
+_rss_sampler = _RssSampler(RSS_SAMPLE_SECONDS)
+
+
+def timed_import(name):
+    """Import a module on first use and remember how long that took."""
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    start = time.perf_counter()
+    module = importlib.import_module(name)
+    with _lock:
+        _import_seconds.setdefault(name, time.perf_counter() - start)
+    return module
+
+
+def import_times():
+    """``{module: seconds}`` for the modules imported through ``timed_import`` so far."""
+    with _lock:
+        return dict(_import_seconds)
+
+
+def _claim_first_run():
+    global _first_run_claimed
+    with _lock:
+        first, _first_run_claimed = not _first_run_claimed, True
+    return first
+
+
+class RunMetrics:
+    """Stages timed during one rerun of the script."""
+
+    def __init__(self, session_id=None):
+        self.run_id = uuid.uuid4().hex[:12]
+        self.session_id = session_id
+        self.started = time.time()
+        self.stages = []
+        # The process's first run pays for imports and cold caches
+        self.cold = _claim_first_run()
+        self._start = time.perf_counter()
+        self._start_rss = current_rss_bytes()
+        self._finished = False
+
+    def record(self, stage, seconds, file=None, rows=None, bytes=None, peak_rss_bytes=None):
+        self.stages.append(StageRecord(stage, seconds, rows, bytes, file, peak_rss_bytes))
+
+    @contextmanager
+    def stage(self, stage, file=None, rows=None, bytes=None):
+        """Time the block; it can fill in ``rows`` and ``bytes`` on the yielded dict once they are known."""
+        counts = {'rows': rows, 'bytes': bytes}
+        start = time.perf_counter()
+        token = _rss_sampler.open()
+        try:
+            yield counts
+        finally:
+            seconds = time.perf_counter() - start
+            self.record(stage, seconds, file=file, peak_rss_bytes=_rss_sampler.close(token), **counts)
+
+    def _peak_rss(self):
+        # The sampler only runs inside stages, so a rerun that just redraws the
+        # page doesn't poll memory; the run's peak is its highest stage peak,
+        # or the memory held at either end of the run
+        if self._start_rss is None:
+            return None
+        peaks = [record.peak_rss_bytes for record in self.stages if record.peak_rss_bytes is not None]
+        return max([self._start_rss, current_rss_bytes() or 0] + peaks)
+
+    def as_dict(self):
+        return {
+            'run_id': self.run_id,
+            'session_id': self.session_id,
+            'started': self.started,
+            'cold': self.cold,
+            'process_peak_rss_bytes': peak_rss_bytes(),
+            'stages': [record._asdict() for record in self.stages],
+        }
+
+    def finish(self):
+        """Close the run: add its total, fold it into the percentiles and write the logs."""
+        if self._finished:
+            return
+        self._finished = True
+        seconds = time.perf_counter() - self._start
+        peak = self._peak_rss()
+        self.record('rerun', seconds, peak_rss_bytes=peak)
+        if self.cold:
+            self.record('cold_start', seconds, peak_rss_bytes=peak)
+        with _lock:
+            for record in self.stages:
+                _windows[record.stage].append(record.seconds)
+                totals = _totals[record.stage]
+                totals['count'] += 1
+                totals['seconds'] += record.seconds
+                totals['rows'] += record.rows or 0
+                totals['bytes'] += record.bytes or 0
+        logger.info(json.dumps(self.as_dict()))
+        if METRICS_PROM_PATH:
+            try:
+                write_prometheus(METRICS_PROM_PATH)
+            except OSError:
+                pass
+
+
+def stage_percentiles():
+    """Per stage: run count, total rows and bytes, and wall-time percentiles over the recent window."""
+    with _lock:
+        snapshot = {stage: (np.array(window), dict(_totals[stage])) for stage, window in _windows.items()}
+    summary = {}
+    for stage, (seconds, totals) in sorted(snapshot.items()):
+        summary[stage] = {
+            **totals,
+            **{f'p{round(q * 100)}': float(np.quantile(seconds, q)) for q in QUANTILES},
+            'max': float(seconds.max()),
+        }
+    return summary
+
+
+def prometheus_text():
+    lines = [
+        '# HELP mito_stage_seconds Wall time of each app stage over recent reruns',
+        '# TYPE mito_stage_seconds summary',
+    ]
+    summary = stage_percentiles()
+    for stage, values in summary.items():
+        for q in QUANTILES:
+            lines.append(f'mito_stage_seconds{{stage="{stage}",quantile="{q}"}} {values[f"p{round(q * 100)}"]:.6f}')
+        lines.append(f'mito_stage_seconds_sum{{stage="{stage}"}} {values["seconds"]:.6f}')
+        lines.append(f'mito_stage_seconds_count{{stage="{stage}"}} {values["count"]}')
+    for name, key, help_text in (
+        ('mito_stage_rows_total', 'rows', 'Rows processed by each stage'),
+        ('mito_stage_bytes_total', 'bytes', 'Bytes processed by each stage'),
+    ):
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+        lines += [f'{name}{{stage="{stage}"}} {values[key]}' for stage, values in summary.items()]
+    imports = import_times()
+    if imports:
+        lines += [
+            '# HELP mito_import_seconds Time taken by the first import of each lazily loaded module',
+            '# TYPE mito_import_seconds gauge',
+        ]
+        lines += [f'mito_import_seconds{{module="{name}"}} {seconds:.6f}' for name, seconds in sorted(imports.items())]
+    peak = peak_rss_bytes()
+    if peak is not None:
+        lines += [
+            '# HELP mito_process_peak_rss_bytes Highest resident memory of the app process',
+            '# TYPE mito_process_peak_rss_bytes gauge',
+            f'mito_process_peak_rss_bytes {peak}',
+        ]
+    return '\n'.join(lines) + '\n'
+
+
+def write_prometheus(path):
+    temp_path = f'{path}.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        f.write(prometheus_text())
+    os.replace(temp_path, path)
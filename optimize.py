@@ -0,0 +1,141 @@
+"""Shrink loaded DataFrames by picking tighter dtypes where that loses nothing."""
+
+import re
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from caching import frame_nbytes
+
+# A text column becomes categorical when it has at most this share of distinct values
+CATEGORY_MAX_RATIO = 0.5
+# How many values are tried before committing to a datetime conversion
+DATE_SAMPLE_SIZE = 1000
+_DATE_LIKE = re.compile(r'^\s*\d{1,4}[-/.]\w{1,9}[-/.]\d{1,4}([ T]\d{1,2}:\d{2}(:\d{2}(\.\d+)?)?)?\s*$')
+
+# Formats a text column may be read with. Day-first and month-first both
+# appear, so a column that fits both (every day 12 or under) stays text
+_DATE_FORMATS = (
+    ['%Y-%m-%d', '%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d %H:%M', '%Y/%m/%d', '%d-%b-%Y', '%d/%b/%Y']
+    + [f'{day_month}{sep}%Y{time}' for sep in '/-.' for day_month in (f'%d{sep}%m', f'%m{sep}%d')
+       for time in ('', ' %H:%M', ' %H:%M:%S')]
+)
+
+_INT_TYPES = [np.int8, np.int16, np.int32, np.int64]
+
+
+def _is_text(series):
+    dtype = series.dtype
+    if isinstance(dtype, pd.ArrowDtype):
+        return pa.types.is_string(dtype.pyarrow_dtype) or pa.types.is_large_string(dtype.pyarrow_dtype)
+    return pd.api.types.is_object_dtype(dtype) or pd.api.types.is_string_dtype(dtype)
+
+
+def _round_trips(texts, fmt):
+    """Whether every text parses with ``fmt`` and prints back exactly as it was."""
+    try:
+        parsed = pd.to_datetime(texts, format=fmt, errors='coerce')
+    except (ValueError, TypeError, OverflowError):
+        return False
+    return bool(parsed.notna().all()) and bool((parsed.dt.strftime(fmt) == texts).all())
+
+
+def _as_datetime(series, values):
+    sample = values.iloc[:DATE_SAMPLE_SIZE].astype(str)
+    if not sample.str.match(_DATE_LIKE).all():
+        return None
+    # Formats are tried on the sample first, then on every distinct value. The
+    # round trip rules out guesses such as '01/02/2024' read month-first
+    formats = [fmt for fmt in _DATE_FORMATS if _round_trips(pd.Series(sample.unique()), fmt)]
+    if formats:
+        texts = pd.Series(values.astype(str).unique())
+        formats = [fmt for fmt in formats if _round_trips(texts, fmt)]
+    if len(formats) != 1:
+        return None
+    return pd.to_datetime(series, format=formats[0])
+
+
+def _smallest_int(series, values):
+    dtype = series.dtype
+    if isinstance(dtype, pd.ArrowDtype):
+        current_size = dtype.pyarrow_dtype.bit_width // 8
+    else:
+        current_size = dtype.itemsize
+
+    low, high = values.min(), values.max()
+    for int_type in _INT_TYPES:
+        info = np.iinfo(int_type)
+        if info.min <= low and high <= info.max:
+            if np.dtype(int_type).itemsize >= current_size:
+                return None
+            if isinstance(dtype, pd.ArrowDtype):
+                return series.astype(pd.ArrowDtype(pa.from_numpy_dtype(int_type)))
+            if isinstance(dtype, pd.api.extensions.ExtensionDtype):
+                # Nullable Int64 and friends keep their missing values
+                return series.astype(f'Int{np.dtype(int_type).itemsize * 8}')
+            return series.astype(int_type)
+    return None
+
+
+def _as_float32(series, values):
+    if isinstance(series.dtype, pd.ArrowDtype):
+        target = pd.ArrowDtype(pa.float32())
+    else:
+        target = np.float32
+    with np.errstate(over='ignore'):
+        narrowed = series.astype(target)
+    if not (narrowed.dropna().astype('float64').to_numpy() == values.astype('float64').to_numpy()).all():
+        return None
+    return narrowed
+
+
+def compact_column(series):
+    """Return a cheaper lossless version of ``series``, or None to keep it as is."""
+    values = series.dropna()
+    if values.empty:
+        return None
+
+    if _is_text(series):
+        converted = _as_datetime(series, values)
+        if converted is not None:
+            return converted
+        if values.nunique() <= CATEGORY_MAX_RATIO * len(series):
+            return series.astype('category')
+        return None
+
+    if pd.api.types.is_integer_dtype(series.dtype):
+        return _smallest_int(series, values)
+
+    if pd.api.types.is_float_dtype(series.dtype):
+        if isinstance(series.dtype, pd.ArrowDtype):
+            is_double = pa.types.is_float64(series.dtype.pyarrow_dtype)
+        else:
+            is_double = series.dtype.itemsize == 8
+        if is_double:
+            return _as_float32(series, values)
+    return None
+
+
+def compact_dtypes(df):
+    """Return ``(compacted frame, report)`` with low-cardinality text as categoricals,
+    date-like text as datetime64 and numbers downcast where the values are unchanged.
+
+    The report holds the memory before and after and the dtype changes per column.
+    """
+    before = frame_nbytes(df)
+    columns = {}
+    changes = {}
+    for position, column in enumerate(df.columns):
+        series = df.iloc[:, position]
+        converted = compact_column(series)
+        if converted is not None:
+            changes[column] = f'{series.dtype} → {converted.dtype}'
+            series = converted
+        columns[position] = series
+
+    compacted = pd.concat(columns, axis=1) if columns else df.copy()
+    compacted.columns = df.columns
+    compacted.index = df.index
+    report = {'before': before, 'after': frame_nbytes(compacted), 'changes': changes}
+    return compacted, report
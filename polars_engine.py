@@ -0,0 +1,754 @@
+"""Run Mito-generated pandas code as lazy Polars queries where the steps allow it.
+
+The statements Mito writes for its common steps (filters, added, renamed and
+deleted columns, simple formulas, merges, pivots, dedupes and concatenations)
+are turned into lazy Polars plans, which are optimised and then run in one
+multithreaded pass. Any other statement runs in pandas on the frames it
+touches, so every script still finishes.
+
+Converting between the two engines keeps each column's pandas dtype and each
+row's index label, so the outputs are meant to be the frames pandas would
+have produced. Before a full run, both engines replay the first
+``VERIFY_ROWS`` rows of each input and must agree there, floats to within
+``FLOAT_RTOL``; the full outputs themselves are not compared.
+Sorts always run in pandas. Its default quicksort doesn't keep tied rows in
+their original order, so no stable sort can reproduce its output.
+"""
+
+import ast
+import os
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from replay import replay_code
+
+try:
+    import polars as pl
+except ImportError:  # optional: only needed for the Polars replay engine
+    pl = None
+
+# Rows of each input the two engines are first compared on; 0 skips the check
+VERIFY_ROWS = int(os.getenv('POLARS_VERIFY_ROWS', '10000'))
+# Relative tolerance for floats. Sums and means may be added up in a different
+# order, so they can differ in the last bits
+FLOAT_RTOL = 1e-9
+
+INDEX_COLUMN = '__mito_index__'
+AGGREGATIONS = ('sum', 'mean', 'median', 'min', 'max', 'count')
+
+# A frame held as a lazy Polars plan. ``dtypes`` maps each column, in order, to
+# its pandas dtype (None where pandas' own result depends on the data, as after
+# a left merge); ``index`` is None for a fresh RangeIndex, otherwise the labels
+# are carried in INDEX_COLUMN and were 'range' or arbitrary 'labels'
+LazyFrame = namedtuple('LazyFrame', ['plan', 'dtypes', 'index'])
+
+
+class Untranslatable(Exception):
+    """A statement, or a frame, the Polars plan can't reproduce exactly."""
+
+
+def polars_available():
+    return pl is not None
+
+
+def _supported_dtype(dtype):
+    if isinstance(dtype, np.dtype):
+        return dtype.kind in 'iufb' or dtype.kind == 'M'
+    if isinstance(dtype, pd.StringDtype):
+        # The default string dtype, with NaN rather than pd.NA for missing values
+        return dtype.na_value is not pd.NA
+    if isinstance(dtype, pd.CategoricalDtype):
+        return dtype.categories.dtype.kind in 'iu' or isinstance(dtype.categories.dtype, pd.StringDtype)
+    return False
+
+
+def to_lazy(df):
+    """``df`` as a LazyFrame, or None when its columns, dtypes or index can't round-trip."""
+    columns = list(df.columns)
+    if (
+        not all(isinstance(column, str) for column in columns)
+        or len(set(columns)) != len(columns)
+        or INDEX_COLUMN in columns
+        or not all(_supported_dtype(dtype) for dtype in df.dtypes)
+    ):
+        return None
+    if isinstance(df.index, pd.RangeIndex) and df.index.name is None:
+        index = None if df.index.start == 0 and df.index.step == 1 else 'range'
+    elif df.index.dtype == np.int64 and df.index.name is None:
+        index = 'labels'
+    else:
+        return None
+
+    frame = pl.from_pandas(df)
+    if index is not None:
+        frame = frame.with_columns(pl.Series(INDEX_COLUMN, df.index.to_numpy()))
+    return LazyFrame(frame.lazy(), dict(zip(columns, df.dtypes)), index)
+
+
+def _index_labels(values, index):
+    if index == 'range':
+        # Taking rows from a RangeIndex gives a RangeIndex again when they are evenly spaced
+        if len(values) == 0:
+            return pd.RangeIndex(0)
+        if len(values) == 1:
+            return pd.RangeIndex(values[0], values[0] + 1)
+        steps = np.diff(values)
+        if steps[0] > 0 and (steps == steps[0]).all():
+            return pd.RangeIndex(values[0], values[-1] + steps[0], steps[0])
+    return pd.Index(values, dtype=np.int64)
+
+
+def to_pandas(lazy):
+    """Run the plan and return the frame pandas would hold."""
+    df = lazy.plan.collect().to_pandas()
+    if lazy.index is None:
+        df.index = pd.RangeIndex(len(df))
+    else:
+        df.index = _index_labels(df.pop(INDEX_COLUMN).to_numpy(dtype=np.int64), lazy.index)
+    for column, dtype in lazy.dtypes.items():
+        if dtype is not None and df[column].dtype != dtype:
+            df[column] = df[column].astype(dtype)
+    return df
+
+
+def _kinds(lazy):
+    kinds = {}
+    for column, dtype in lazy.plan.collect_schema().items():
+        if dtype.is_integer():
+            kinds[column] = 'int'
+        elif dtype.is_float():
+            kinds[column] = 'float'
+        elif dtype == pl.Boolean:
+            kinds[column] = 'bool'
+        elif dtype == pl.String:
+            kinds[column] = 'str'
+        elif isinstance(dtype, (pl.Categorical, pl.Enum)):
+            kinds[column] = 'category'
+        elif isinstance(dtype, pl.Datetime) and dtype.time_zone is None:
+            kinds[column] = 'datetime'
+        else:
+            kinds[column] = None
+    return kinds
+
+
+def _with_index(lazy):
+    """The frame with its row labels as a column, so filters and dedupes keep them."""
+    if lazy.index is not None:
+        return lazy
+    plan = lazy.plan.with_row_index(INDEX_COLUMN).with_columns(pl.col(INDEX_COLUMN).cast(pl.Int64))
+    return LazyFrame(plan, lazy.dtypes, 'range')
+
+
+def _select(lazy, columns, dtypes=None):
+    extra = [INDEX_COLUMN] if lazy.index is not None else []
+    dtypes = dtypes if dtypes is not None else {column: lazy.dtypes[column] for column in columns}
+    return LazyFrame(lazy.plan.select(list(columns) + extra), dtypes, lazy.index)
+
+
+# Reading the generated code
+
+def _literal(node):
+    try:
+        return ast.literal_eval(node)
+    except (ValueError, TypeError, SyntaxError, MemoryError, RecursionError):
+        raise Untranslatable(ast.unparse(node))
+
+
+def _string_list(node):
+    value = _literal(node)
+    if isinstance(value, str):
+        value = [value]
+    if not isinstance(value, (list, tuple)) or not all(isinstance(item, str) for item in value):
+        raise Untranslatable(ast.unparse(node))
+    return list(value)
+
+
+def _keywords(call, allowed):
+    keywords = {}
+    for keyword in call.keywords:
+        if keyword.arg not in allowed:
+            raise Untranslatable(f'{keyword.arg}=')
+        keywords[keyword.arg] = keyword.value
+    return keywords
+
+
+def _frame_name(node):
+    if not isinstance(node, ast.Name):
+        raise Untranslatable(ast.unparse(node))
+    return node.id
+
+
+def _column_ref(node, frame):
+    """The column name if ``node`` is ``frame['column']``."""
+    if (
+        isinstance(node, ast.Subscript)
+        and isinstance(node.value, ast.Name)
+        and node.value.id == frame
+        and isinstance(node.slice, ast.Constant)
+        and isinstance(node.slice.value, str)
+    ):
+        return node.slice.value
+    return None
+
+
+def _method_call(node):
+    """``(receiver, method, call)`` for ``receiver.method(...)``, else None."""
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute):
+        return node.func.value, node.func.attr, node
+    return None
+
+
+_COMPARISONS = {
+    ast.Eq: 'eq', ast.NotEq: 'ne_missing', ast.Gt: 'gt', ast.GtE: 'ge', ast.Lt: 'lt', ast.LtE: 'le',
+}
+_COMPARABLE = {
+    'int': (int, float), 'float': (int, float), 'bool': (bool,), 'str': (str,), 'category': (str,),
+    'datetime': (pd.Timestamp,),
+}
+
+
+def _comparison_value(node):
+    # pd.to_datetime('2024-01-31') in date filters
+    if (
+        isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) and node.func.attr == 'to_datetime'
+        and isinstance(node.func.value, ast.Name) and node.func.value.id == 'pd'
+        and len(node.args) == 1 and not node.keywords
+    ):
+        value = pd.Timestamp(_literal(node.args[0]))
+        if value.tzinfo is not None or value.nanosecond:
+            raise Untranslatable(ast.unparse(node))
+        return value
+    value = _literal(node)
+    if value is None or isinstance(value, (list, tuple, dict, set, complex)):
+        raise Untranslatable(ast.unparse(node))
+    return value
+
+
+def _mask(node, frame, kinds):
+    """A filter condition as a Polars expression that is never null, as pandas masks aren't."""
+    if isinstance(node, ast.BinOp) and isinstance(node.op, (ast.BitAnd, ast.BitOr)):
+        left, right = _mask(node.left, frame, kinds), _mask(node.right, frame, kinds)
+        return left & right if isinstance(node.op, ast.BitAnd) else left | right
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Invert):
+        return ~_mask(node.operand, frame, kinds)
+
+    if isinstance(node, ast.Compare) and len(node.ops) == 1 and type(node.ops[0]) in _COMPARISONS:
+        column = _column_ref(node.left, frame)
+        if column not in kinds:
+            raise Untranslatable(ast.unparse(node))
+        kind = kinds[column]
+        value = _comparison_value(node.comparators[0])
+        op = _COMPARISONS[type(node.ops[0])]
+        allowed = _COMPARABLE.get(kind, ())
+        if (
+            not isinstance(value, allowed)
+            or (kind in ('int', 'float') and isinstance(value, bool))
+            or (kind == 'bool' and op not in ('eq', 'ne_missing'))
+            or (kind == 'category' and op not in ('eq', 'ne_missing'))
+        ):
+            raise Untranslatable(ast.unparse(node))
+        if isinstance(value, pd.Timestamp):
+            value = value.to_pydatetime()
+        expr = getattr(pl.col(column), op)(pl.lit(value))
+        # pandas says False where a value is missing, except for != where it says True
+        return expr if op == 'ne_missing' else expr.fill_null(False)
+
+    call = _method_call(node)
+    if call is None:
+        raise Untranslatable(ast.unparse(node))
+    receiver, method, call = call
+    if method in ('isna', 'isnull', 'notna', 'notnull') and not call.args and not call.keywords:
+        column = _column_ref(receiver, frame)
+        if column not in kinds or kinds[column] is None:
+            raise Untranslatable(ast.unparse(node))
+        # Missing floats are always null in the plans, never NaN
+        return pl.col(column).is_null() if method in ('isna', 'isnull') else pl.col(column).is_not_null()
+
+    if method in ('contains', 'startswith', 'endswith') and isinstance(receiver, ast.Attribute) and receiver.attr == 'str':
+        column = _column_ref(receiver.value, frame)
+        if column not in kinds or kinds[column] != 'str' or len(call.args) != 1:
+            raise Untranslatable(ast.unparse(node))
+        pattern = _literal(call.args[0])
+        keywords = {keyword.arg: _literal(keyword.value) for keyword in call.keywords}
+        if not isinstance(pattern, str) or keywords.get('na') is not False:
+            raise Untranslatable(ast.unparse(node))
+        values = pl.col(column)
+        if method == 'contains':
+            if keywords.get('regex', True) is not False or set(keywords) - {'na', 'regex', 'case'}:
+                raise Untranslatable(ast.unparse(node))
+            if keywords.get('case', True) is False:
+                values, pattern = values.str.to_uppercase(), pattern.upper()
+            expr = values.str.contains(pattern, literal=True)
+        else:
+            if set(keywords) != {'na'}:
+                raise Untranslatable(ast.unparse(node))
+            expr = values.str.starts_with(pattern) if method == 'startswith' else values.str.ends_with(pattern)
+        return expr.fill_null(False)
+
+    raise Untranslatable(ast.unparse(node))
+
+
+_ARITHMETIC = {ast.Add: '__add__', ast.Sub: '__sub__', ast.Mult: '__mul__', ast.Div: '__truediv__'}
+_WIDE_NUMBERS = (np.dtype(np.int64), np.dtype(np.float64))
+
+
+def _formula(node, frame, lazy, kinds):
+    """``(expression, pandas dtype, kind)`` for a formula of columns of ``frame`` and constants."""
+    column = _column_ref(node, frame)
+    if column is not None:
+        if column not in kinds or kinds[column] not in ('int', 'float', 'str'):
+            raise Untranslatable(ast.unparse(node))
+        return pl.col(column), lazy.dtypes[column], kinds[column]
+
+    if isinstance(node, ast.Constant) and type(node.value) in (int, float, str):
+        if type(node.value) is int:
+            return pl.lit(node.value, dtype=pl.Int64), np.dtype(np.int64), 'int'
+        if type(node.value) is float:
+            return pl.lit(node.value, dtype=pl.Float64), np.dtype(np.float64), 'float'
+        return pl.lit(node.value, dtype=pl.String), pd.StringDtype(na_value=np.nan), 'str'
+
+    if isinstance(node, ast.BinOp) and type(node.op) in _ARITHMETIC:
+        left, left_dtype, left_kind = _formula(node.left, frame, lazy, kinds)
+        right, right_dtype, right_kind = _formula(node.right, frame, lazy, kinds)
+        if 'str' in (left_kind, right_kind):
+            if left_kind != right_kind or not isinstance(node.op, ast.Add):
+                raise Untranslatable(ast.unparse(node))
+            return left + right, (left_dtype if left_dtype == right_dtype else None), 'str'
+        # Narrower ints and floats promote differently in the two libraries
+        if left_dtype not in _WIDE_NUMBERS or right_dtype not in _WIDE_NUMBERS:
+            raise Untranslatable(ast.unparse(node))
+        if isinstance(node.op, ast.Div) or 'float' in (left_kind, right_kind):
+            kind, dtype = 'float', np.dtype(np.float64)
+        else:
+            kind, dtype = 'int', np.dtype(np.int64)
+        expr = getattr(left.cast(pl.Float64) if kind == 'float' else left, _ARITHMETIC[type(node.op)])(right)
+        if kind == 'float':
+            # 0 / 0 gives NaN; keep missing values as nulls like the rest of the plan
+            expr = expr.fill_nan(None)
+        return expr, dtype, kind
+
+    raise Untranslatable(ast.unparse(node))
+
+
+class LazyReplay:
+    """Replay generated code statement by statement, in Polars where possible and pandas otherwise."""
+
+    def __init__(self, code, inputs):
+        self.tree = ast.parse(code or '')
+        self.inputs = inputs
+        self.namespace = {}
+        self.lazy = {}
+        # Names whose plan is only a conversion of the pandas frame or input they hold
+        self.converted = set()
+        # Frame names in the order pandas' namespace would first hold them
+        self.order = list(inputs)
+        # ``(engine, statement)`` for each statement run
+        self.steps = []
+
+    # Moving frames between the engines
+
+    def _lazy_frame(self, name):
+        if name in self.lazy:
+            return self.lazy[name]
+        if name in self.namespace:
+            df = self.namespace[name]
+        elif name in self.inputs:
+            df = self.inputs[name]
+        else:
+            raise Untranslatable(name)
+        if not isinstance(df, pd.DataFrame):
+            raise Untranslatable(name)
+        lazy = to_lazy(df)
+        if lazy is None:
+            raise Untranslatable(name)
+        self.lazy[name] = lazy
+        self.converted.add(name)
+        return lazy
+
+    def _pandas_frame(self, name):
+        if name not in self.namespace:
+            if name in self.lazy and name not in self.converted:
+                self.namespace[name] = to_pandas(self.lazy[name])
+            elif name in self.inputs:
+                # Mito's code edits frames in place
+                self.namespace[name] = self.inputs[name].copy()
+        return self.namespace.get(name)
+
+    def _assign(self, name, lazy):
+        self.lazy[name] = lazy
+        self.converted.discard(name)
+        self.namespace.pop(name, None)
+        if name not in self.order:
+            self.order.append(name)
+
+    # Statements
+
+    def _run_pandas(self, statement):
+        names = {node.id for node in ast.walk(statement) if isinstance(node, ast.Name)}
+        for name in names:
+            self._pandas_frame(name)
+        before = set(self.namespace)
+        exec(compile(ast.Module([statement], type_ignores=[]), '<mito-generated-code>', 'exec'), self.namespace)
+        # Any frame the statement mentions may have been changed in place
+        for name in names:
+            self.lazy.pop(name, None)
+            self.converted.discard(name)
+        for name in self.namespace:
+            if name not in before and name not in self.order:
+                self.order.append(name)
+
+    def _run_polars(self, statement):
+        if isinstance(statement, ast.Assign) and len(statement.targets) == 1:
+            target = statement.targets[0]
+            if isinstance(target, ast.Name):
+                result = self._expression(statement.value)
+                if isinstance(result, pd.DataFrame):
+                    # Pivots come back as the small pandas frame pandas would build
+                    self.lazy.pop(target.id, None)
+                    self.converted.discard(target.id)
+                    self.namespace[target.id] = result
+                    if target.id not in self.order:
+                        self.order.append(target.id)
+                else:
+                    self._assign(target.id, result)
+                return
+            if isinstance(target, ast.Subscript) and isinstance(target.value, ast.Name):
+                name = target.value.id
+                column = _literal(target.slice)
+                if not isinstance(column, str) or column == INDEX_COLUMN:
+                    raise Untranslatable(ast.unparse(target))
+                self._assign(name, self._set_column(name, column, statement.value))
+                return
+        if isinstance(statement, ast.Expr):
+            call = _method_call(statement.value)
+            if call is not None:
+                receiver, method, call = call
+                name = _frame_name(receiver)
+                if method == 'rename':
+                    self._assign(name, self._rename(name, call))
+                    return
+                if method == 'drop':
+                    keywords = _keywords(call, {'axis', 'columns', 'inplace'})
+                    if 'inplace' not in keywords or _literal(keywords['inplace']) is not True:
+                        raise Untranslatable(ast.unparse(statement))
+                    self._assign(name, self._drop(name, call))
+                    return
+                if method == 'insert':
+                    self._assign(name, self._insert(name, call))
+                    return
+        raise Untranslatable(ast.unparse(statement))
+
+    def _expression(self, node):
+        if isinstance(node, ast.Subscript):
+            name = _frame_name(node.value)
+            lazy = self._lazy_frame(name)
+            if isinstance(node.slice, ast.List):
+                columns = _string_list(node.slice)
+                if len(set(columns)) != len(columns) or not set(columns) <= set(lazy.dtypes):
+                    raise Untranslatable(ast.unparse(node))
+                return _select(lazy, columns)
+            lazy = _with_index(lazy)
+            return LazyFrame(lazy.plan.filter(_mask(node.slice, name, _kinds(lazy))), lazy.dtypes, lazy.index)
+
+        call = _method_call(node)
+        if call is None:
+            raise Untranslatable(ast.unparse(node))
+        receiver, method, call = call
+        if method == 'concat' and isinstance(receiver, ast.Name) and receiver.id == 'pd':
+            return self._concat(call)
+        if method == 'copy':
+            keywords = _keywords(call, {'deep'})
+            if call.args or _literal(keywords.get('deep', ast.Constant(True))) is not True:
+                raise Untranslatable(ast.unparse(node))
+            return self._expression(receiver) if not isinstance(receiver, ast.Name) else self._lazy_frame(receiver.id)
+        name = _frame_name(receiver)
+        if method == 'drop_duplicates':
+            return self._drop_duplicates(name, call)
+        if method == 'drop':
+            if 'inplace' in {keyword.arg for keyword in call.keywords}:
+                raise Untranslatable(ast.unparse(node))
+            return self._drop(name, call)
+        if method == 'merge':
+            return self._merge(name, call)
+        if method == 'pivot_table':
+            return self._pivot_table(name, call)
+        raise Untranslatable(ast.unparse(node))
+
+    def _set_column(self, name, column, value):
+        lazy = self._lazy_frame(name)
+        expr, dtype, kind = _formula(value, name, lazy, _kinds(lazy))
+        if dtype is None:
+            raise Untranslatable(ast.unparse(value))
+        dtypes = dict(lazy.dtypes)
+        # An existing column keeps its place; a new one goes on the end
+        dtypes[column] = dtype
+        plan = lazy.plan.with_columns(expr.alias(column))
+        return _select(LazyFrame(plan, dtypes, lazy.index), list(dtypes), dtypes)
+
+    def _rename(self, name, call):
+        keywords = _keywords(call, {'columns', 'inplace'})
+        if call.args or 'columns' not in keywords or _literal(keywords.get('inplace')) is not True:
+            raise Untranslatable(ast.unparse(call))
+        mapping = _literal(keywords['columns'])
+        lazy = self._lazy_frame(name)
+        if not isinstance(mapping, dict) or not all(isinstance(v, str) for v in mapping.values()):
+            raise Untranslatable(ast.unparse(call))
+        mapping = {old: new for old, new in mapping.items() if old in lazy.dtypes}
+        renamed = [mapping.get(column, column) for column in lazy.dtypes]
+        if len(set(renamed)) != len(renamed) or INDEX_COLUMN in renamed:
+            raise Untranslatable(ast.unparse(call))
+        dtypes = {mapping.get(column, column): dtype for column, dtype in lazy.dtypes.items()}
+        return LazyFrame(lazy.plan.rename(mapping), dtypes, lazy.index)
+
+    def _drop(self, name, call):
+        keywords = _keywords(call, {'axis', 'columns', 'inplace'})
+        if 'columns' in keywords and not call.args:
+            columns = _string_list(keywords['columns'])
+        elif len(call.args) == 1 and 'axis' in keywords and _literal(keywords['axis']) in (1, 'columns'):
+            columns = _string_list(call.args[0])
+        else:
+            raise Untranslatable(ast.unparse(call))
+        lazy = self._lazy_frame(name)
+        if not set(columns) <= set(lazy.dtypes):
+            raise Untranslatable(ast.unparse(call))
+        return _select(lazy, [column for column in lazy.dtypes if column not in columns])
+
+    def _insert(self, name, call):
+        if len(call.args) != 3 or call.keywords:
+            raise Untranslatable(ast.unparse(call))
+        position, column, value = (_literal(arg) for arg in call.args)
+        lazy = self._lazy_frame(name)
+        if (
+            type(position) is not int or not 0 <= position <= len(lazy.dtypes)
+            or not isinstance(column, str) or column in lazy.dtypes or column == INDEX_COLUMN
+            or type(value) not in (int, float)
+        ):
+            raise Untranslatable(ast.unparse(call))
+        if type(value) is int:
+            expr, dtype = pl.lit(value, dtype=pl.Int64), np.dtype(np.int64)
+        else:
+            expr, dtype = pl.lit(value, dtype=pl.Float64), np.dtype(np.float64)
+        items = list(lazy.dtypes.items())
+        items.insert(position, (column, dtype))
+        dtypes = dict(items)
+        return _select(LazyFrame(lazy.plan.with_columns(expr.alias(column)), dtypes, lazy.index), list(dtypes), dtypes)
+
+    def _drop_duplicates(self, name, call):
+        keywords = _keywords(call, {'subset', 'keep'})
+        lazy = _with_index(self._lazy_frame(name))
+        subset = _string_list(keywords['subset']) if 'subset' in keywords else list(lazy.dtypes)
+        keep = _literal(keywords['keep']) if 'keep' in keywords else 'first'
+        if call.args or not subset or not set(subset) <= set(lazy.dtypes) or keep not in ('first', 'last', False):
+            raise Untranslatable(ast.unparse(call))
+        plan = lazy.plan.unique(subset=subset, keep=keep or 'none', maintain_order=True)
+        return LazyFrame(plan, lazy.dtypes, lazy.index)
+
+    def _concat(self, call):
+        keywords = _keywords(call, {'join', 'ignore_index'})
+        join = _literal(keywords['join']) if 'join' in keywords else 'outer'
+        ignore_index = _literal(keywords['ignore_index']) if 'ignore_index' in keywords else False
+        if len(call.args) != 1 or not isinstance(call.args[0], ast.List) or not call.args[0].elts:
+            raise Untranslatable(ast.unparse(call))
+        frames = [self._lazy_frame(_frame_name(node)) for node in call.args[0].elts]
+        dtypes = frames[0].dtypes
+        # Differing columns or dtypes are aligned and upcast by pandas; leave that to it
+        if join not in ('inner', 'outer') or ignore_index not in (True, False) or any(
+            list(frame.dtypes.items()) != list(dtypes.items()) or any(dtype is None for dtype in frame.dtypes.values()) for frame in frames
+        ):
+            raise Untranslatable(ast.unparse(call))
+        if ignore_index:
+            plans = [frame.plan.select(list(dtypes)) for frame in frames]
+            return LazyFrame(pl.concat(plans, how='vertical'), dict(dtypes), None)
+        frames = [_with_index(frame) for frame in frames]
+        plans = [frame.plan.select(list(dtypes) + [INDEX_COLUMN]) for frame in frames]
+        index = 'range' if all(frame.index == 'range' for frame in frames) else 'labels'
+        return LazyFrame(pl.concat(plans, how='vertical'), dict(dtypes), index)
+
+    def _merge(self, name, call):
+        keywords = _keywords(call, {'left_on', 'right_on', 'on', 'how', 'suffixes'})
+        if len(call.args) != 1:
+            raise Untranslatable(ast.unparse(call))
+        left = self._lazy_frame(name)
+        right = self._lazy_frame(_frame_name(call.args[0]))
+        if 'on' in keywords:
+            left_on = right_on = _string_list(keywords['on'])
+        else:
+            left_on = _string_list(keywords['left_on']) if 'left_on' in keywords else None
+            right_on = _string_list(keywords['right_on']) if 'right_on' in keywords else None
+        how = _literal(keywords['how']) if 'how' in keywords else 'inner'
+        suffixes = list(_literal(keywords['suffixes'])) if 'suffixes' in keywords else ['_x', '_y']
+        # Keys with different names are both kept by pandas, and outer joins are sorted
+        if (
+            not left_on or left_on != right_on or how not in ('inner', 'left')
+            or len(suffixes) != 2 or not all(isinstance(suffix, str) for suffix in suffixes)
+            or not set(left_on) <= set(left.dtypes) or not set(right_on) <= set(right.dtypes)
+        ):
+            raise Untranslatable(ast.unparse(call))
+        left_kinds, right_kinds = _kinds(left), _kinds(right)
+        for key in left_on:
+            if (
+                left.dtypes[key] is None or left.dtypes[key] != right.dtypes[key]
+                or left_kinds[key] not in ('int', 'str', 'datetime')
+            ):
+                raise Untranslatable(ast.unparse(call))
+
+        overlap = [column for column in left.dtypes if column in right.dtypes and column not in left_on]
+        left_names = {column: column + suffixes[0] if column in overlap else column for column in left.dtypes}
+        right_names = {column: column + suffixes[1] if column in overlap else column
+                       for column in right.dtypes if column not in left_on}
+        dtypes = {left_names[column]: dtype for column, dtype in left.dtypes.items()}
+        for column, new_name in right_names.items():
+            dtype = right.dtypes[column]
+            if how == 'left':
+                # Unmatched rows become NaN, which only some dtypes can hold as they are
+                if right_kinds[column] in ('int', 'float'):
+                    dtype = None
+                elif right_kinds[column] not in ('str', 'datetime', 'category'):
+                    raise Untranslatable(ast.unparse(call))
+            dtypes[new_name] = dtype
+        if len(dtypes) != len(left_names) + len(right_names):
+            raise Untranslatable(ast.unparse(call))
+
+        left_plan = left.plan.select(list(left.dtypes)).rename(left_names)
+        right_plan = right.plan.select(list(right.dtypes)).rename(right_names)
+        plan = left_plan.join(
+            right_plan, on=left_on, how=how, nulls_equal=True, coalesce=True, maintain_order='left_right',
+        )
+        return LazyFrame(plan.select(list(dtypes)), dtypes, None)
+
+    def _pivot_table(self, name, call):
+        keywords = _keywords(call, {'index', 'values', 'aggfunc'})
+        if call.args or not {'index', 'values', 'aggfunc'} <= set(keywords):
+            raise Untranslatable(ast.unparse(call))
+        index = _string_list(keywords['index'])
+        values = _string_list(keywords['values'])
+        aggfunc = _literal(keywords['aggfunc'])
+        lazy = self._lazy_frame(name)
+        kinds = _kinds(lazy)
+        if (
+            not index or not values or not isinstance(aggfunc, dict) or list(aggfunc) != values
+            or not set(index + values) <= set(lazy.dtypes) or set(index) & set(values)
+            or any(kinds[key] not in ('int', 'str', 'datetime') or lazy.dtypes[key] is None for key in index)
+        ):
+            raise Untranslatable(ast.unparse(call))
+
+        aggregations = []
+        result_dtypes = {}
+        for value, functions in aggfunc.items():
+            functions = [functions] if isinstance(functions, str) else functions
+            if (
+                not isinstance(functions, list) or not functions
+                or lazy.dtypes[value] not in (np.int64, np.float64)
+            ):
+                raise Untranslatable(ast.unparse(call))
+            for function in functions:
+                if function not in AGGREGATIONS:
+                    raise Untranslatable(ast.unparse(call))
+                expr = getattr(pl.col(value), function)()
+                if function == 'count' or (function in ('sum', 'min', 'max') and kinds[value] == 'int'):
+                    dtype = np.dtype(np.int64)
+                    expr = expr.cast(pl.Int64)
+                else:
+                    dtype = np.dtype(np.float64)
+                    expr = expr.cast(pl.Float64)
+                result_dtypes[(value, function)] = dtype
+                aggregations.append(expr.alias(f'{len(aggregations)}'))
+
+        # pandas' groupby drops rows with a missing key and sorts the groups
+        plan = (
+            lazy.plan.filter(pl.all_horizontal([pl.col(key).is_not_null() for key in index]))
+            .group_by(index)
+            .agg(aggregations)
+            .sort(index)
+        )
+        grouped = plan.collect().to_pandas()
+        key_arrays = [grouped[key].astype(lazy.dtypes[key]) for key in index]
+        if len(index) == 1:
+            labels = pd.Index(key_arrays[0], name=index[0])
+        else:
+            labels = pd.MultiIndex.from_arrays(key_arrays, names=index)
+        table = pd.DataFrame(
+            {column: grouped[f'{position}'].astype(dtype).to_numpy()
+             for position, (column, dtype) in enumerate(result_dtypes.items())},
+            index=labels,
+        )
+        table.columns = pd.MultiIndex.from_tuples(list(result_dtypes))
+        # The rest of pivot_table: drop empty rows, sort the columns, drop empty columns
+        if len(table.columns):
+            table = table.dropna(how='all')
+        table = table.sort_index(axis=1)
+        return table.dropna(how='all', axis=1)
+
+    def run(self):
+        for statement in self.tree.body:
+            try:
+                self._run_polars(statement)
+                self.steps.append(('polars', statement))
+            except Untranslatable:
+                self._run_pandas(statement)
+                self.steps.append(('pandas', statement))
+        return self
+
+    def outputs(self, output_names=None):
+        """The DataFrames named in ``output_names`` (by default all of them), as pandas frames."""
+        if output_names is None:
+            output_names = [
+                name for name in self.order
+                # As in replay_code: inputs named after files that start with a digit begin with an underscore
+                if not name.startswith('__') and (
+                    name in self.lazy or isinstance(self.namespace.get(name, self.inputs.get(name)), pd.DataFrame)
+                )
+            ]
+        outputs = {}
+        for name in output_names:
+            value = self._pandas_frame(name)
+            if not isinstance(value, pd.DataFrame):
+                raise NameError(f"The generated code did not produce a DataFrame named '{name}'")
+            outputs[name] = value
+        return outputs
+
+
+def outputs_match(expected, actual):
+    """Whether two replays returned the same frames: names, columns, dtypes, index and values.
+
+    Floats only need to agree to within ``FLOAT_RTOL``; everything else must be equal.
+    """
+    if list(expected) != list(actual):
+        return False
+    for name, df in expected.items():
+        try:
+            pd.testing.assert_frame_equal(df, actual[name], check_exact=False, rtol=FLOAT_RTOL, atol=0)
+        except AssertionError:
+            return False
+    return True
+
+
+def replay_lazy(code, inputs, output_names=None, verify_rows=VERIFY_ROWS):
+    """Like ``replay.replay_code``, with as much of the work as possible in Polars.
+
+    The engines are first compared on the leading ``verify_rows`` rows of each
+    input, with ``outputs_match``; if they disagree there, or Polars fails, the
+    whole run uses pandas. The rest of the rows are not checked, so this is a
+    spot check rather than proof that the full outputs are identical.
+    """
+    if pl is None:
+        return replay_code(code, inputs, output_names)
+    if verify_rows:
+        sample = {name: df.head(verify_rows) for name, df in inputs.items()}
+        try:
+            expected = replay_code(code, sample, output_names)
+        except Exception:
+            expected = None
+        if expected is not None:
+            try:
+                matched = outputs_match(expected, LazyReplay(code, sample).run().outputs(output_names))
+            except Exception:
+                matched = False
+            if not matched:
+                return replay_code(code, inputs, output_names)
+    try:
+        return LazyReplay(code, inputs).run().outputs(output_names)
+    except Exception:
+        return replay_code(code, inputs, output_names)
@@ -0,0 +1,222 @@
+"""Column profiles of a frame: missing values, distinct counts, ranges, quantiles, top values and histograms.
+
+Missing values, minimums and maximums are exact. Quantiles, top values and
+histograms come from a fixed random sample on columns longer than
+``PROFILE_SAMPLE_ROWS``, and distinct counts of high-cardinality columns are
+estimated from the smallest hashes of the whole column (a KMV sketch), so a
+million-row column of numbers costs about one vectorised hash and a
+partition. Text is counted exactly by Arrow.
+
+Profiles are cached per column, so an output frame that keeps most of its
+input's columns only profiles the ones the code changed.
+"""
+
+import hashlib
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from caching import ByteLRU
+
+PROFILE_SAMPLE_ROWS = 100_000
+# Hashes kept by the distinct-count sketch; estimates are within a few percent
+DISTINCT_SKETCH_SIZE = 4096
+TOP_VALUES = 5
+HISTOGRAM_BINS = 20
+
+# ``distinct_exact`` is False when ``distinct`` is an estimate; ``top`` holds
+# ``(value, share of non-missing rows)`` and ``histogram`` the share of values in
+# each of ``HISTOGRAM_BINS`` equal-width bins between ``min`` and ``max``
+ColumnProfile = namedtuple(
+    'ColumnProfile',
+    ['column', 'dtype', 'rows', 'nulls', 'distinct', 'distinct_exact', 'min', 'max', 'quantiles', 'top', 'histogram'],
+)
+
+# Profiles are small; bound them by count
+_profiles = ByteLRU(4096, sizeof=lambda profile: 1)
+
+
+def _hashes(series):
+    try:
+        return pd.util.hash_pandas_object(series, index=False).to_numpy()
+    except TypeError:
+        # Unhashable cells (lists, dicts) are hashed by their text form
+        return pd.util.hash_pandas_object(series.astype(str), index=False).to_numpy()
+
+
+def _object_types(series):
+    """The value types of an object column, as bytes to mix into its key.
+
+    Values of mixed columns are hashed as text, so 1 and '1' only differ by type.
+    One C-level pass names the column's kind; only mixed columns pay for a code
+    per row, taken from a factorised ``type`` of each value.
+    """
+    kind = pd.api.types.infer_dtype(series, skipna=True)
+    if not kind.startswith('mixed') and kind != 'unknown-array':
+        return kind.encode()
+    codes, types = pd.factorize(series.map(type))
+    return repr((kind, [t.__qualname__ for t in types])).encode() + codes.tobytes()
+
+
+def column_key(series):
+    """Identity for a column: its name, dtype and length plus a hash of every value.
+
+    Typed columns are hashed straight from their Arrow buffers, one pass over the
+    bytes rather than a hash per value; object columns by one vectorised hash of
+    their values plus the type of each value when the column mixes types.
+    """
+    hasher = hashlib.blake2b(digest_size=16)
+    hasher.update(repr((str(series.name), str(series.dtype), len(series))).encode())
+    try:
+        if series.dtype == object:
+            raise pa.ArrowTypeError("object columns can mix types that Arrow would coerce")
+        array = pa.array(series)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+        hasher.update(_hashes(series).tobytes())
+        if series.dtype == object:
+            hasher.update(_object_types(series))
+        return hasher.hexdigest()
+    for chunk in array.chunks if isinstance(array, pa.ChunkedArray) else [array]:
+        hasher.update(repr((chunk.offset, len(chunk))).encode())
+        # A dictionary's values sit outside its index buffers
+        buffers = chunk.buffers() + (chunk.dictionary.buffers() if isinstance(chunk, pa.DictionaryArray) else [])
+        for buffer in buffers:
+            hasher.update(b'-' if buffer is None else buffer)
+    return hasher.hexdigest()
+
+
+def _ranged(dtype):
+    # Columns with an order worth showing as min, max, quantiles and a histogram
+    return (pd.api.types.is_numeric_dtype(dtype) and not pd.api.types.is_bool_dtype(dtype)) \
+        or pd.api.types.is_datetime64_any_dtype(dtype) or pd.api.types.is_timedelta64_dtype(dtype)
+
+
+def _distinct(values, sample_distinct, sampled):
+    """``(distinct non-missing values, exact?)``, given the distinct values of the sample."""
+    if not isinstance(values.dtype, np.dtype) or values.dtype.kind not in 'biufmM':
+        # Text is counted exactly in Arrow, which is cheaper than hashing every string here
+        try:
+            return pc.count_distinct(pa.array(values)).as_py(), True
+        except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+            return int(pd.unique(_hashes(values)).size), True
+    if not sampled:
+        return sample_distinct, True
+    if sample_distinct * 4 < PROFILE_SAMPLE_ROWS:
+        # A low-cardinality column is counted exactly; its hash table stays small
+        return int(values.nunique()), True
+    # Twice the sketch size, so repeated values still leave enough distinct hashes
+    hashes = _hashes(values)
+    smallest = np.unique(np.partition(hashes, 2 * DISTINCT_SKETCH_SIZE)[:2 * DISTINCT_SKETCH_SIZE])
+    if len(smallest) < DISTINCT_SKETCH_SIZE:
+        return int(pd.unique(hashes).size), True
+    # k distinct hashes spread evenly below the k-th smallest one
+    estimate = (DISTINCT_SKETCH_SIZE - 1) * 2.0 ** 64 / float(smallest[DISTINCT_SKETCH_SIZE - 1])
+    return int(min(round(estimate), len(values))), False
+
+
+def _histogram(sample, low, high):
+    bounds = pd.Series([low, high], dtype=sample.dtype)
+    if sample.dtype.kind in 'mM':
+        # Dates and durations are binned by their integer ticks
+        sample, bounds = sample.astype('int64'), bounds.astype('int64')
+    numbers = sample.to_numpy(dtype='f8', na_value=np.nan)
+    low, high = bounds.to_numpy(dtype='f8', na_value=np.nan)
+    numbers = numbers[np.isfinite(numbers)]
+    if not len(numbers) or not np.isfinite(low) or not np.isfinite(high):
+        return None
+    counts, _ = np.histogram(numbers, bins=HISTOGRAM_BINS, range=(low, high) if high > low else None)
+    return (counts / len(numbers)).tolist()
+
+
+def profile_column(series, positions=None):
+    """Profile one column; ``positions`` are the sampled rows, or None to use every row."""
+    rows = len(series)
+    missing = series.isna().to_numpy()
+    nulls = int(missing.sum())
+    values = series[~missing] if nulls else series
+    if positions is None:
+        sample = values
+    else:
+        sample = series.iloc[positions]
+        sample = sample[sample.notna().to_numpy()]
+
+    top = []
+    distinct, exact = 0, True
+    if isinstance(series.dtype, pd.CategoricalDtype) and len(values):
+        # Exact: the category codes are counted, not the values
+        counts = np.bincount(values.cat.codes.to_numpy(), minlength=len(series.cat.categories))
+        distinct = int(np.count_nonzero(counts))
+        order = np.argsort(counts)[::-1][:TOP_VALUES]
+        top = [(series.cat.categories[i], counts[i] / len(values)) for i in order if counts[i]]
+    elif len(values):
+        try:
+            counts = sample.value_counts(sort=True)
+        except TypeError:
+            counts = sample.astype(str).value_counts(sort=True)
+        distinct, exact = _distinct(values, len(counts), positions is not None)
+        # A value seen once isn't a top value
+        top = [(value, count / len(sample)) for value, count in counts.head(TOP_VALUES).items() if count > 1]
+
+    low = high = quantiles = histogram = None
+    if len(values) and _ranged(series.dtype):
+        low, high = values.min(), values.max()
+        quantiles = tuple(sample.quantile([0.25, 0.5, 0.75]).tolist()) if len(sample) else None
+        histogram = _histogram(sample, low, high)
+
+    return ColumnProfile(
+        series.name, str(series.dtype), rows, nulls, distinct, exact, low, high, quantiles, top, histogram,
+    )
+
+
+def profile_frame(df, sample_rows=PROFILE_SAMPLE_ROWS, seed=0):
+    """A ``ColumnProfile`` for each column of ``df``, reusing cached profiles of unchanged columns.
+
+    Columns are taken by position, so duplicate column names are no problem.
+    """
+    positions = None
+    if len(df) > sample_rows:
+        # The same rows of every column, and the same rows on every run
+        positions = np.sort(np.random.default_rng(seed).choice(len(df), sample_rows, replace=False))
+    profiles = []
+    for i in range(len(df.columns)):
+        series = df.iloc[:, i]
+        key = (column_key(series), sample_rows, seed)
+        profile = _profiles.get(key)
+        if profile is None:
+            profile = profile_column(series, positions)
+            _profiles.put(key, profile)
+        profiles.append(profile)
+    return profiles
+
+
+def _text(value):
+    if value is None:
+        return ''
+    if isinstance(value, (float, np.floating)):
+        return f'{value:,.6g}'
+    if isinstance(value, (int, np.integer)) and not isinstance(value, (bool, np.bool_)):
+        return f'{value:,}'
+    return str(value)
+
+
+def profile_table(profiles):
+    """One row per column, with values as display text and the histogram as a list for a bar chart."""
+    return pd.DataFrame({
+        'column': [str(profile.column) for profile in profiles],
+        'type': [profile.dtype for profile in profiles],
+        'missing': [profile.nulls for profile in profiles],
+        'missing %': [100 * profile.nulls / profile.rows if profile.rows else 0.0 for profile in profiles],
+        'distinct': [f"{'' if profile.distinct_exact else '≈'}{profile.distinct:,}" for profile in profiles],
+        'min': [_text(profile.min) for profile in profiles],
+        '25%': [_text(profile.quantiles[0]) if profile.quantiles else '' for profile in profiles],
+        'median': [_text(profile.quantiles[1]) if profile.quantiles else '' for profile in profiles],
+        '75%': [_text(profile.quantiles[2]) if profile.quantiles else '' for profile in profiles],
+        'max': [_text(profile.max) for profile in profiles],
+        'top values': [
+            ', '.join(f'{_text(value)} ({share:.1%})' for value, share in profile.top) for profile in profiles
+        ],
+        'histogram': [profile.histogram for profile in profiles],
+    })
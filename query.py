@@ -0,0 +1,152 @@
+"""Run SQL over uploaded files with an in-process DuckDB database.
+
+Each upload becomes a table named by ``clean_name``, registered from Python:
+Parquet as a lazily scanned Arrow dataset over a temporary copy, text and
+workbooks as the frame the app's own readers parse, taken from and kept in
+the parse cache, so a file is parsed once for all queries and the grid. The connection can't touch
+the file system, change its settings or run anything but one SELECT, so a
+query can only read the uploads it names.
+"""
+
+import atexit
+import importlib.util
+import os
+import re
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict, namedtuple
+
+import pyarrow.dataset as ds
+
+from caching import HASH_CHUNK_SIZE, ByteLRU, parse_cache, upload_key
+from loaders import parse_source
+from metrics import timed_import
+from workbooks import open_workbook
+
+# Budget for the query results kept across reruns
+QUERY_CACHE_MAX_BYTES = int(float(os.getenv('QUERY_CACHE_MAX_MB', '512')) * 1024 * 1024)
+# Budget for the temporary copies of Parquet uploads that the tables scan
+QUERY_TEMP_MAX_BYTES = int(float(os.getenv('QUERY_TEMP_MAX_MB', '2048')) * 1024 * 1024)
+
+# One table for the query stage. ``file_hash`` is the upload's content hash;
+# ``sep`` is None to let DuckDB detect it; ``sheet`` only applies to workbooks
+QuerySource = namedtuple('QuerySource', ['name', 'source', 'file_type', 'sep', 'sheet', 'file_hash'])
+
+_results = ByteLRU(QUERY_CACHE_MAX_BYTES)
+
+_temp_dir = None
+_temp_files = OrderedDict()
+_temp_bytes = 0
+_temp_lock = threading.Lock()
+
+# Comments and opening brackets allowed before the SELECT or WITH keyword
+_LEADING = re.compile(r'^(?:\s+|--[^\n]*(?:\n|$)|/\*.*?\*/|\()*', re.DOTALL)
+
+
+def duckdb_available():
+    # duckdb is optional and only imported when a query runs
+    return importlib.util.find_spec('duckdb') is not None
+
+
+def _temp_copy(source, file_hash, suffix):
+    """Path of a temporary copy of ``source``, written once per content hash."""
+    global _temp_dir, _temp_bytes
+    with _temp_lock:
+        if _temp_dir is None:
+            _temp_dir = tempfile.mkdtemp(prefix='mito-query-')
+            atexit.register(shutil.rmtree, _temp_dir, True)
+        path = os.path.join(_temp_dir, f'{file_hash}.{suffix}')
+        if path in _temp_files:
+            _temp_files.move_to_end(path)
+            return path
+
+        # Copied in chunks, so a compressed upload is never inflated in memory
+        source.seek(0)
+        with open(path, 'wb') as f:
+            shutil.copyfileobj(source, f, HASH_CHUNK_SIZE)
+        size = os.path.getsize(path)
+        _temp_files[path] = size
+        _temp_bytes += size
+        # Drop the oldest copies, never the one just written
+        while _temp_bytes > QUERY_TEMP_MAX_BYTES and len(_temp_files) > 1:
+            old_path, size = _temp_files.popitem(last=False)
+            _temp_bytes -= size
+            try:
+                os.remove(old_path)
+            except OSError:
+                pass
+        return path
+
+
+def _parsed_upload(source):
+    """The upload as the app parses it without options, from the parse cache when any rerun already did."""
+    sheet = None
+    if source.file_type == 'xlsx':
+        # Keyed by the sheet's name, as the grid's uploads are
+        workbook = open_workbook(source.source)
+        sheet = source.sheet or workbook.sheet_names[0]
+    key = upload_key(source.file_hash, source.file_type, source.sep, sheet)
+    df = parse_cache.get(key)
+    if df is None:
+        df, _ = parse_source(source.source, source.file_type, source.sep, sheet)
+        parse_cache.put(key, df)
+    return df
+
+
+def _register(connection, source):
+    if source.file_type in ('csv', 'txt', 'xlsx'):
+        # DuckDB's own readers would ignore the app's parse rules, and it has no workbook reader
+        table = _parsed_upload(source)
+    elif source.file_type == 'parquet':
+        # Scanned lazily, so DuckDB only reads the columns and row groups the query needs
+        table = ds.dataset(_temp_copy(source.source, source.file_hash, 'parquet'), format='parquet')
+    else:
+        raise ValueError(f"Can't query '.{source.file_type}' files")
+    connection.register(source.name, table)
+
+
+def _check_read_only(connection, sql):
+    """Raise ``ValueError`` unless ``sql`` is a single SELECT (or WITH ... SELECT) statement."""
+    statements = connection.extract_statements(sql)
+    if len(statements) != 1:
+        raise ValueError("Run one SELECT statement at a time")
+    keyword = re.match(r'\w*', sql[_LEADING.match(sql).end():]).group().lower()
+    if statements[0].type != timed_import('duckdb').StatementType.SELECT or keyword not in ('select', 'with'):
+        raise ValueError("Only SELECT queries can be run on the uploads")
+
+
+def referenced_sources(sql, sources):
+    """The sources whose name appears in ``sql``; only those are registered."""
+    # Names come from clean_name, so they are plain word characters
+    return [source for source in sources if re.search(rf'\b{source.name}\b', sql, re.IGNORECASE)]
+
+
+def run_query(sql, sources):
+    """Run ``sql`` against tables over ``sources`` and return the result as a DataFrame.
+
+    Results are cached by the query text and the content of the files it reads.
+    """
+    used = referenced_sources(sql, sources)
+    key = (sql.strip(), tuple((source.name, source.file_type, source.sep, source.sheet, source.file_hash)
+                              for source in used))
+    df = _results.get(key)
+    if df is not None:
+        return df
+
+    if not duckdb_available():
+        raise ValueError("The SQL stage needs the 'duckdb' package")
+    connection = timed_import('duckdb').connect()
+    try:
+        _check_read_only(connection, sql)
+        for source in used:
+            _register(connection, source)
+        # No reading or writing files (read_csv, COPY, ATTACH, INSTALL), and no
+        # setting that could turn it back on
+        connection.execute('SET enable_external_access=false')
+        connection.execute('SET lock_configuration=true')
+        df = connection.execute(sql).df()
+    finally:
+        connection.close()
+    _results.put(key, df)
+    return df
@@ -0,0 +1,282 @@
+"""Re-run the code Mito generates against DataFrames other than the ones edited in the grid.
+
+Also a command line tool for scheduled jobs, e.g.::
+
+    python -m replay transform.py --input RBI_CARDS_ATM_POS_DEC2024=jan.txt --out jan.parquet
+"""
+
+import ast
+import builtins
+import os
+import sys
+
+import pandas as pd
+
+from scheduler import heavy_jobs
+
+# 'pandas' runs the code as written; 'polars' runs what it can as lazy Polars queries
+REPLAY_ENGINE = os.getenv('REPLAY_ENGINE', 'pandas')
+ENGINES = ('pandas', 'polars')
+
+
+def replay_code(code, inputs, output_names=None):
+    """Execute ``code`` with each ``inputs`` frame bound to its variable name.
+
+    The inputs are copied first because Mito's code edits frames in place.
+    Returns the DataFrames named in ``output_names`` (by default every DataFrame
+    the code leaves behind).
+    """
+    namespace = {name: df.copy() for name, df in inputs.items()}
+    exec(compile(code or '', '<mito-generated-code>', 'exec'), namespace)
+
+    if output_names is None:
+        output_names = [
+            name for name, value in namespace.items()
+            # Inputs named after files that start with a digit begin with an underscore
+            if isinstance(value, pd.DataFrame) and not name.startswith('__')
+        ]
+
+    outputs = {}
+    for name in output_names:
+        value = namespace.get(name)
+        if not isinstance(value, pd.DataFrame):
+            raise NameError(f"The generated code did not produce a DataFrame named '{name}'")
+        outputs[name] = value
+    return outputs
+
+
+def run_replay(code, inputs, output_names=None, engine=REPLAY_ENGINE):
+    """``replay_code`` on the chosen engine; see ``polars_engine.replay_lazy`` for how Polars is checked."""
+    if engine == 'polars':
+        from polars_engine import replay_lazy
+        return replay_lazy(code, inputs, output_names)
+    return replay_code(code, inputs, output_names)
+
+
+def submit_replay(code, inputs, output_names=None, engine=REPLAY_ENGINE, session=None, key=None):
+    """Queue ``run_replay`` on the shared heavy-job workers for ``session`` and return its Future.
+
+    Replays are independent of the script thread that asked for them.
+    """
+    return heavy_jobs.submit(session, run_replay, code, inputs, output_names, engine, key=key)
+
+
+def script_inputs(code):
+    """The variables ``code`` reads before assigning them, in order of first use.
+
+    For a script from the app these are its input DataFrames. Names that are
+    only called, such as Mito's sheet functions, and builtins are left out.
+    """
+    bound = set(dir(builtins))
+    inputs = []
+    for statement in ast.parse(code or '').body:
+        reads, called, local, stored = [], set(), set(), set()
+        for node in ast.walk(statement):
+            if isinstance(node, ast.Call) and isinstance(node.func, ast.Name):
+                called.add(node.func.id)
+            elif isinstance(node, ast.arg):
+                local.add(node.arg)
+            elif isinstance(node, ast.comprehension):
+                local.update(target.id for target in ast.walk(node.target) if isinstance(target, ast.Name))
+            elif isinstance(node, (ast.Import, ast.ImportFrom)):
+                stored.update((alias.asname or alias.name).split('.')[0] for alias in node.names)
+            elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                stored.add(node.name)
+            elif isinstance(node, ast.Name):
+                if isinstance(node.ctx, ast.Store):
+                    stored.add(node.id)
+                elif node.id not in bound:
+                    reads.append((node.lineno, node.col_offset, node.id))
+        # A name read and assigned in one statement, like df1 = df1.dropna(), is still read first
+        for _, _, name in sorted(reads):
+            if name not in called and name not in local and name not in inputs:
+                inputs.append(name)
+        bound |= stored
+    return inputs
+
+
+def _split_input(spec):
+    # NAME=PATH binds a file to a variable of the script; a bare PATH has None
+    # for its name until the script's inputs are known
+    name, sep, path = spec.partition('=')
+    if sep and name.isidentifier() and not os.path.exists(spec):
+        return name, path
+    return None, spec
+
+
+def _input_names(specs, expected):
+    """The variable each input is bound to; a bare PATH takes its cleaned file
+    name, as the app names uploads, or the one input the script still needs."""
+    from archives import inner_name
+    from loaders import clean_name
+
+    names = []
+    for name, path in specs:
+        if name is None:
+            name = clean_name(os.path.splitext(inner_name(os.path.basename(path)))[0])
+        names.append(name)
+    unbound = [name for name in expected if name not in names]
+    unmatched = [position for position, (name, _) in enumerate(specs) if name is None and names[position] not in expected]
+    if len(unbound) == 1 and len(unmatched) == 1:
+        names[unmatched[0]] = unbound[0]
+        unbound = []
+    if unbound:
+        raise ValueError(
+            f"the script reads {', '.join(expected)} but no input is bound to {', '.join(unbound)}. "
+            f"Name each input with --input NAME=PATH."
+        )
+    return names
+
+
+def _open_input(path):
+    # Compressed inputs are decompressed while they are parsed
+    from archives import COMPRESSIONS, compression_of, expand_upload
+
+    compression = compression_of(path)
+    if compression is not None and compression not in COMPRESSIONS:
+        raise ValueError(f"{path}: extract the files from .{compression} archives to replay on them")
+    source = open(path, 'rb')
+    return source if compression is None else expand_upload(source)[0]
+
+
+def _load_inputs(paths, sep, sheet, workers):
+    from loaders import LoadJob, file_format, parse_jobs, upload_separator
+
+    sources = [_open_input(path) for path in paths]
+    try:
+        jobs = []
+        for source in sources:
+            file_type = file_format(source.name)
+            # Without --sep each file is read as the app reads the upload, so the script sees the same frame
+            file_sep = sep if sep is not None else upload_separator(file_type)
+            jobs.append(LoadJob(source, file_type, file_sep, sheet, False, None))
+        results = parse_jobs(jobs, workers=workers)
+    finally:
+        for source in sources:
+            source.close()
+
+    frames = []
+    for path, result in zip(paths, results):
+        if result.error is not None:
+            raise RuntimeError(f"Error loading {path}: {result.error}") from result.error
+        frames.append(result.df)
+    return frames
+
+
+def _write_outputs(outputs, out, out_dir, fmt):
+    from export import EXTENSIONS, write_frame_to_path
+
+    if out:
+        if len(outputs) != 1:
+            raise ValueError(
+                f"--out needs exactly one output DataFrame, the script left {len(outputs)}: "
+                f"{', '.join(outputs)}. Pick one with --output or use --out-dir."
+            )
+        (df,) = outputs.values()
+        write_frame_to_path(df, out)
+        return [out]
+
+    os.makedirs(out_dir, exist_ok=True)
+    written = []
+    for name, df in outputs.items():
+        path = os.path.join(out_dir, f'{name}{EXTENSIONS[fmt]}')
+        write_frame_to_path(df, path)
+        written.append(path)
+    return written
+
+
+def _replay_one(code, name, path, args):
+    # One --each run; module level so it can go to a worker process
+    (df,) = _load_inputs([path], args.sep, args.sheet, workers=1)
+    outputs = run_replay(code, {name: df}, args.outputs, args.engine)
+    # Files are named after the input, so runs over different inputs don't collide
+    stem = os.path.splitext(os.path.basename(path))[0]
+    if len(outputs) == 1:
+        outputs = {stem: df for df in outputs.values()}
+    else:
+        outputs = {f'{stem}_{output}': df for output, df in outputs.items()}
+    return _write_outputs(outputs, None, args.out_dir, args.format)
+
+
+def main(argv=None):
+    import argparse
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    from export import available_formats
+    from loaders import LOAD_WORKERS
+
+    parser = argparse.ArgumentParser(
+        prog='python -m replay',
+        description='Run a script generated in the MitoSheet app against new input files, without Streamlit.',
+    )
+    parser.add_argument('script', help='Python file holding the code shown under "Code Generated"')
+    parser.add_argument(
+        '--input', action='append', required=True, metavar='[NAME=]PATH',
+        help='Input file (CSV, TXT, XLSX or Parquet). NAME is the DataFrame variable the script uses; '
+             'it defaults to the cleaned file name, as in the app, or to the one variable the script '
+             'reads that no other input is bound to. Repeat for several inputs.',
+    )
+    parser.add_argument(
+        '--sep', help="Separator for CSV/TXT inputs (default: as in the app, ',' for CSV and detected from each TXT file)",
+    )
+    parser.add_argument('--sheet', help='Sheet to read from XLSX inputs (default: the first sheet)')
+    parser.add_argument(
+        '--output', action='append', dest='outputs', metavar='NAME',
+        help='DataFrame to write; repeat for several (default: every DataFrame the script leaves)',
+    )
+    parser.add_argument('--out', help='Output file: .parquet, .feather, .csv, .csv.gz or .csv.zst')
+    parser.add_argument('--out-dir', help='Directory to write one file per output DataFrame')
+    parser.add_argument('--format', default='parquet', choices=available_formats(), help='Format used with --out-dir')
+    parser.add_argument(
+        '--each', metavar='NAME',
+        help='Run the script separately for every input, bound to NAME, writing into --out-dir',
+    )
+    parser.add_argument('--jobs', type=int, default=LOAD_WORKERS, help='Files loaded or processed in parallel')
+    parser.add_argument(
+        '--engine', default=REPLAY_ENGINE, choices=ENGINES,
+        help="'polars' runs filters, merges, pivots and the like as one optimised Polars query "
+             "(needs the polars package), after checking it against pandas on the first POLARS_VERIFY_ROWS rows",
+    )
+    args = parser.parse_args(argv)
+
+    if bool(args.out) == bool(args.out_dir):
+        parser.error('give exactly one of --out or --out-dir')
+    if args.each and not args.out_dir:
+        parser.error('--each writes one set of outputs per input, so it needs --out-dir')
+
+    with open(args.script, 'r', encoding='utf-8') as f:
+        code = f.read()
+    expected = script_inputs(code)
+
+    if args.each:
+        if expected and args.each not in expected:
+            parser.error(f"--each {args.each}: the script reads {', '.join(expected)}")
+        paths = [_split_input(spec)[1] for spec in args.input]
+        failures = 0
+        with ProcessPoolExecutor(max_workers=max(1, args.jobs)) as pool:
+            futures = {pool.submit(_replay_one, code, args.each, path, args): path for path in paths}
+            for future in as_completed(futures):
+                try:
+                    for written in future.result():
+                        print(f'{futures[future]} -> {written}')
+                except Exception as e:
+                    failures += 1
+                    print(f'{futures[future]}: {e}', file=sys.stderr)
+        return 1 if failures else 0
+
+    specs = [_split_input(spec) for spec in args.input]
+    paths = [path for _, path in specs]
+    try:
+        names = _input_names(specs, expected)
+        frames = _load_inputs(paths, args.sep, args.sheet, workers=args.jobs)
+        outputs = run_replay(code, dict(zip(names, frames)), args.outputs, args.engine)
+        for written in _write_outputs(outputs, args.out, args.out_dir, args.format):
+            print(written)
+    except Exception as e:
+        print(f'error: {e}', file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,116 @@
+"""A process-wide queue for heavy work (parsing, exports, replays), shared fairly between sessions.
+
+Jobs run on a fixed number of threads, so one session's burst of large
+uploads can't take every core from the others. Sessions take turns: a free
+worker starts the oldest job of the next session in line, so a session with
+twenty queued parses doesn't hold up another session's single one. Jobs
+submitted with the same ``key`` while one is still queued or running share
+its result instead of doing the work twice.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+
+from loaders import LOAD_WORKERS
+
+HEAVY_JOB_WORKERS = max(1, int(os.getenv('HEAVY_JOB_WORKERS', LOAD_WORKERS)))
+
+
+class FairScheduler:
+    """Run submitted callables on ``workers`` threads, round-robin between sessions."""
+
+    def __init__(self, workers):
+        self.workers = workers
+        self._queues = OrderedDict()
+        self._in_flight = {}
+        self._threads = []
+        self._idle = 0
+        self._running = 0
+        self._cond = threading.Condition()
+
+    def submit(self, session, fn, *args, key=None, **kwargs):
+        """Queue ``fn(*args, **kwargs)`` for ``session`` and return its Future.
+
+        The Future also carries ``queued_seconds``, set once the job starts.
+        """
+        with self._cond:
+            if key is not None and key in self._in_flight:
+                return self._in_flight[key]
+            future = Future()
+            future.queued_seconds = None
+            if key is not None:
+                self._in_flight[key] = future
+            self._queues.setdefault(session, deque()).append((future, fn, args, kwargs, key, time.perf_counter()))
+            if self._idle:
+                # Counted off here, so a second job in quick succession wakes another thread
+                self._idle -= 1
+                self._cond.notify()
+            elif len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._work, name=f'heavy-job-{len(self._threads)}', daemon=True)
+                self._threads.append(thread)
+                thread.start()
+        return future
+
+    def _order(self):
+        # The order queued jobs will start in: each session's first job, then each one's second...
+        queues = list(self._queues.values())
+        for turn in range(max((len(queue) for queue in queues), default=0)):
+            for queue in queues:
+                if turn < len(queue):
+                    yield queue[turn][0]
+
+    def position(self, future):
+        """Queued jobs that start before ``future``; 0 once it is running or done."""
+        with self._cond:
+            for ahead, queued in enumerate(self._order()):
+                if queued is future:
+                    return ahead
+        return 0
+
+    def stats(self):
+        with self._cond:
+            return {
+                'workers': self.workers,
+                'running': self._running,
+                'queued': sum(len(queue) for queue in self._queues.values()),
+                'sessions': len(self._queues),
+            }
+
+    def _next(self):
+        session, queue = next(iter(self._queues.items()))
+        job = queue.popleft()
+        # The session goes to the back of the line, or leaves it when it has nothing queued
+        if queue:
+            self._queues.move_to_end(session)
+        else:
+            del self._queues[session]
+        return job
+
+    def _work(self):
+        while True:
+            with self._cond:
+                while not self._queues:
+                    self._idle += 1
+                    self._cond.wait()
+                future, fn, args, kwargs, key, queued_at = self._next()
+                self._running += 1
+            try:
+                if future.set_running_or_notify_cancel():
+                    future.queued_seconds = time.perf_counter() - queued_at
+                    try:
+                        result = fn(*args, **kwargs)
+                    except BaseException as e:
+                        future.set_exception(e)
+                    else:
+                        future.set_result(result)
+            finally:
+                with self._cond:
+                    self._running -= 1
+                    if key is not None and self._in_flight.get(key) is future:
+                        del self._in_flight[key]
+
+
+heavy_jobs = FairScheduler(HEAVY_JOB_WORKERS)
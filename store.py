@@ -0,0 +1,204 @@
+"""Parsed datasets kept on disk as Arrow files, so a refresh or a restart doesn't mean parsing again.
+
+Each frame is written under a hash of its parse key and memory-mapped when it
+is read back, into ``ArrowDtype`` columns that stay on the map. The store is bounded by total size (least recently used first
+out) and by age. Each entry records the owners who uploaded it, as hashes of
+their tokens, and is only listed for and loaded by them.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import pyarrow as pa
+
+from caching import CACHE_DIR, frame_nbytes
+
+STORE_DIR = os.path.join(CACHE_DIR, 'datasets')
+INDEX_PATH = os.path.join(STORE_DIR, 'index.json')
+STORE_MAX_BYTES = int(float(os.getenv('DATASET_STORE_MAX_MB', '4096')) * 1024 * 1024)
+STORE_TTL_SECONDS = float(os.getenv('DATASET_STORE_TTL_HOURS', '168')) * 3600
+RECENT_LIMIT = 10
+
+_index = None
+_lock = threading.Lock()
+# Spills run off the script thread, one at a time
+_writer = ThreadPoolExecutor(max_workers=1)
+
+
+def dataset_key(parse_key):
+    """Store key for a parse cache key (content hash plus parse options)."""
+    return hashlib.blake2b(repr(parse_key).encode(), digest_size=16).hexdigest()
+
+
+def _owner_id(owner):
+    # Tokens aren't kept on disk, only their hashes
+    return hashlib.blake2b(owner.encode(), digest_size=16).hexdigest() if owner else None
+
+
+def _owned(entry, owner):
+    return owner is not None and _owner_id(owner) in entry.get('owners', ())
+
+
+def _arrow_backed(arrow_type):
+    return None if pa.types.is_dictionary(arrow_type) else pd.ArrowDtype(arrow_type)
+
+
+def _path(key):
+    return os.path.join(STORE_DIR, f'{key}.arrow')
+
+
+# The helpers below expect _lock to be held
+
+def _load_index():
+    global _index
+    if _index is None:
+        try:
+            with open(INDEX_PATH, 'r', encoding='utf-8') as f:
+                _index = json.load(f)
+        except (OSError, ValueError):
+            _index = {}
+    return _index
+
+
+def _save_index():
+    os.makedirs(STORE_DIR, exist_ok=True)
+    temp_path = f'{INDEX_PATH}.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(_index, f)
+    os.replace(temp_path, INDEX_PATH)
+
+
+def _remove(key):
+    _index.pop(key, None)
+    try:
+        os.remove(_path(key))
+    except OSError:
+        pass
+
+
+def _expired(entry, now):
+    return now - entry['last_used'] > STORE_TTL_SECONDS
+
+
+def _evict(now):
+    index = _load_index()
+    for key, entry in list(index.items()):
+        if _expired(entry, now) or not os.path.exists(_path(key)):
+            _remove(key)
+    total = sum(entry['bytes'] for entry in index.values())
+    for key in sorted(index, key=lambda key: index[key]['last_used']):
+        if total <= STORE_MAX_BYTES:
+            break
+        total -= index[key]['bytes']
+        _remove(key)
+
+
+def _write(key, df, name, report, owner):
+    temp_path = f'{_path(key)}.tmp'
+    try:
+        # Checked before anything is written: an entry json can't hold would stay
+        # in the index and break every later save
+        json.dumps([name, report])
+        table = pa.Table.from_pandas(df)
+        os.makedirs(STORE_DIR, exist_ok=True)
+        # Uncompressed, so a reload can map the buffers straight from the file
+        with pa.OSFile(temp_path, 'wb') as f, pa.ipc.new_file(f, table.schema) as writer:
+            writer.write_table(table)
+        os.replace(temp_path, _path(key))
+        now = time.time()
+        with _lock:
+            previous = _load_index().get(key, {})
+            owners = set(previous.get('owners', ())) | ({_owner_id(owner)} if owner else set())
+            _load_index()[key] = {
+                'name': name,
+                'rows': len(df),
+                'columns': len(df.columns),
+                'bytes': os.path.getsize(_path(key)),
+                'created': now,
+                'last_used': now,
+                'report': report,
+                'owners': sorted(owners),
+            }
+            _evict(now)
+            _save_index()
+    except (OSError, ValueError, TypeError, pa.ArrowException):
+        # The store is only a shortcut; a frame Arrow can't hold (mixed-type
+        # object columns) or a read-only disk just means parsing again next time
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+
+
+def save_dataset(key, df, name, report=None, owner=None):
+    """Spill ``df`` to the store in the background for ``owner``. Frames larger than the whole budget are skipped."""
+    if frame_nbytes(df) > STORE_MAX_BYTES:
+        return None
+    return _writer.submit(_write, key, df, name, report, owner)
+
+
+def load_dataset(key, owner, claim=False):
+    """``(df, compaction report)`` for a dataset of ``owner``, or None if it isn't theirs, isn't there or has expired.
+
+    With ``claim`` the dataset becomes ``owner``'s too. Only pass it when the
+    caller holds the file itself, e.g. the key was derived from an upload's bytes.
+    """
+    now = time.time()
+    with _lock:
+        entry = _load_index().get(key)
+        if entry is None or _expired(entry, now):
+            return None
+        if not _owned(entry, owner):
+            if not (claim and owner):
+                return None
+            entry['owners'] = sorted(set(entry.get('owners', ())) | {_owner_id(owner)})
+    try:
+        # Columns come back Arrow-backed, pointing into the mapped file rather
+        # than copied onto the heap, like a streamed upload; categoricals stay
+        # categorical, their codes are small
+        table = pa.ipc.open_file(pa.memory_map(_path(key))).read_all()
+        df = table.to_pandas(types_mapper=_arrow_backed)
+    except (OSError, pa.ArrowException):
+        with _lock:
+            _remove(key)
+            _save_index()
+        return None
+
+    with _lock:
+        entry['last_used'] = now
+        try:
+            _save_index()
+        except OSError:
+            pass
+    return df, entry['report']
+
+
+def claim_dataset(key, owner):
+    """Make a stored dataset ``owner``'s too; for callers holding the file itself, as with ``load_dataset``."""
+    with _lock:
+        entry = _load_index().get(key)
+        if entry is None or not owner or _owned(entry, owner):
+            return
+        entry['owners'] = sorted(set(entry.get('owners', ())) | {_owner_id(owner)})
+        try:
+            _save_index()
+        except OSError:
+            pass
+
+
+def recent_datasets(owner, limit=RECENT_LIMIT):
+    """``owner``'s most recently used datasets as dicts with ``key``, ``name``, ``rows``, ``columns`` and ``last_used``."""
+    now = time.time()
+    with _lock:
+        entries = [
+            {'key': key, **entry}
+            for key, entry in _load_index().items()
+            if not _expired(entry, now) and _owned(entry, owner)
+        ]
+    entries.sort(key=lambda entry: entry['last_used'], reverse=True)
+    return entries[:limit]
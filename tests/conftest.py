@@ -0,0 +1,10 @@
+import os
+import sys
+import tempfile
+
+# The app's modules sit at the top of the repository rather than in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Keeps Mito from sending usage events while its backend is driven in tests
+os.environ.setdefault('CI', '1')
+# Parse caches and the dataset store write somewhere throwaway, not the repo's .cache
+os.environ.setdefault('APP_CACHE_DIR', tempfile.mkdtemp(prefix='app-cache-tests-'))
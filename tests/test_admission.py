@@ -0,0 +1,86 @@
+import io
+import zipfile
+
+import pandas as pd
+import pytest
+
+from admission import Estimate, _sheet_xml_bytes, admit, admitted_key
+from loaders import parse_source
+
+openpyxl = pytest.importorskip('openpyxl')
+
+
+def test_fallback_loads_never_share_the_full_frames_key():
+    key = ('hash', 'csv', ',', None, False, None, ())
+    keys = [
+        admitted_key(key),
+        admitted_key(key, 'compact'),
+        admitted_key(key, 'disk'),
+        admitted_key(key, 'sample', 1_000),
+        admitted_key(key, 'sample', 2_000),
+    ]
+    assert keys[0] == admitted_key(key, 'full') == key
+    assert len(set(keys)) == len(keys)
+
+
+def test_row_samples_keep_their_size_when_free_memory_drifts():
+    estimate = Estimate(bytes=100_000_000, compact_bytes=80_000_000, rows=1_000_000)
+    first = admit(estimate, 8_012_345, 'xlsx')
+    second = admit(estimate, 8_034_567, 'xlsx')
+    assert first.strategy == second.strategy == 'sample'
+    assert first.max_rows == second.max_rows == 100_000
+
+
+def workbook_bytes(sheets, rename=None):
+    """An xlsx with one sheet per ``(name, rows)``, with parts moved from ``rename``'s keys to its values.
+
+    Moved parts are linked by relative targets, as Excel writes them.
+    """
+    workbook = openpyxl.Workbook()
+    workbook.remove(workbook.active)
+    for name, rows in sheets:
+        worksheet = workbook.create_sheet(name)
+        worksheet.append(['value'])
+        for row in range(rows):
+            worksheet.append([row])
+    buffer = io.BytesIO()
+    workbook.save(buffer)
+    if not rename:
+        return buffer
+
+    moved = io.BytesIO()
+    with zipfile.ZipFile(buffer) as original, zipfile.ZipFile(moved, 'w') as archive:
+        for info in original.infolist():
+            data = original.read(info.filename)
+            if info.filename == 'xl/_rels/workbook.xml.rels':
+                for old, new in rename.items():
+                    data = data.replace(f'"/{old}"'.encode(), f'"{new.removeprefix("xl/")}"'.encode())
+            archive.writestr(rename.get(info.filename, info.filename), data)
+    return moved
+
+
+def test_sheet_size_is_read_from_the_sheets_own_part_past_nine_sheets():
+    sheets = [(f'small{position}', 1) for position in range(11)]
+    sheets[1] = ('big', 2_000)
+    source = workbook_bytes(sheets)
+    sizes = {name: _sheet_xml_bytes(source, name) for name, _ in sheets}
+    # sheet10.xml sorts before sheet2.xml by name
+    assert max(sizes, key=sizes.get) == 'big'
+    assert _sheet_xml_bytes(source, 'missing') is None
+
+
+def test_sheet_size_follows_the_workbook_relationships():
+    source = workbook_bytes([('big', 2_000), ('small', 1)], rename={'xl/worksheets/sheet1.xml': 'xl/worksheets/data.xml'})
+    assert _sheet_xml_bytes(source, 'big') > 10 * _sheet_xml_bytes(source, 'small')
+
+
+def test_disk_backed_loads_are_not_compacted(tmp_path):
+    estimate = Estimate(bytes=100_000_000, compact_bytes=80_000_000, rows=1_000_000)
+    admission = admit(estimate, 1_000_000, 'csv', ',', compact=True)
+    assert (admission.strategy, admission.compact, admission.disk_backed) == ('disk', False, True)
+
+    source = io.BytesIO(b'city,sales\n' + b'Pune,1\nDelhi,2\n' * 500)
+    source.name = 'sales.csv'
+    df, report = parse_source(source, 'csv', ',', compact=True, disk_backed=True)
+    assert report is None
+    assert all(isinstance(dtype, pd.ArrowDtype) for dtype in df.dtypes)
@@ -0,0 +1,41 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from combine import SOURCE_COLUMN, combine_frames, compatible_groups
+
+
+def test_unsigned_64_bit_ids_are_not_stacked_with_signed_ones():
+    big = pd.DataFrame({'id': np.array([2 ** 63 + 1], dtype=np.uint64)})
+    signed = pd.DataFrame({'id': np.array([-1], dtype=np.int64)})
+    assert compatible_groups([big, signed]) == []
+    assert compatible_groups([big, big.copy()]) == [[0, 1]]
+
+
+def test_narrower_integers_combine_exactly():
+    frames = [
+        pd.DataFrame({'id': np.array([2 ** 62 + 1], dtype=np.int64)}),
+        pd.DataFrame({'id': np.array([7], dtype=np.uint32)}),
+    ]
+    assert compatible_groups(frames) == [[0, 1]]
+    combined = combine_frames(frames, ['jan.csv', 'feb.csv'])
+    assert combined['id'].tolist() == [2 ** 62 + 1, 7]
+    assert combined[SOURCE_COLUMN].tolist() == ['jan.csv', 'feb.csv']
+
+
+def test_large_signed_ids_are_not_stacked_with_floats():
+    ids = pd.DataFrame({'id': np.array([2 ** 62 + 1], dtype=np.int64)})
+    floats = pd.DataFrame({'id': np.array([1.5])})
+    assert compatible_groups([ids, floats]) == []
+    assert compatible_groups([ids, floats, ids.copy()]) == [[0, 2]]
+    small = pd.DataFrame({'id': np.array([7], dtype=np.int64)})
+    assert compatible_groups([small, floats]) == [[0, 1]]
+
+
+def test_arrow_backed_and_numpy_columns_share_a_schema():
+    numpy_backed = pd.DataFrame({'id': [1, 2], 'name': ['a', 'b']})
+    arrow_backed = pd.DataFrame({
+        'id': pd.array([3], dtype='int64[pyarrow]'),
+        'name': pd.array(['c'], dtype=pd.ArrowDtype(pa.string())),
+    })
+    assert compatible_groups([numpy_backed, arrow_backed]) == [[0, 1]]
@@ -0,0 +1,32 @@
+import io
+import zipfile
+
+import pandas as pd
+import pytest
+
+from export import build_bundle, build_export, frame_hash
+
+
+@pytest.fixture
+def df():
+    return pd.DataFrame({'city': ['Pune', 'Delhi', None], 'sales': [10.5, 20.0, 3.25]})
+
+
+def test_frame_hash_sees_a_single_edited_cell(df):
+    edited = df.copy()
+    edited.loc[1, 'sales'] = 20.01
+    assert frame_hash(df) == frame_hash(df.copy())
+    assert frame_hash(df) != frame_hash(edited)
+
+
+def test_csv_export_round_trips(df):
+    export = build_export(df, 'sales', 'csv')
+    assert export.file_name == 'sales.csv'
+    pd.testing.assert_frame_equal(pd.read_csv(io.BytesIO(export.data)), df, check_dtype=False)
+
+
+def test_zip_bundle_holds_every_frame_and_the_code(df):
+    bundle = build_bundle({'first': df, 'second': df.head(1)}, 'df1 = df1', 'zip/csv')
+    with zipfile.ZipFile(io.BytesIO(bundle.data)) as archive:
+        assert sorted(archive.namelist()) == ['code.py', 'first.csv', 'second.csv']
+        assert archive.read('code.py') == b'df1 = df1'
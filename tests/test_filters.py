@@ -0,0 +1,36 @@
+import io
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+import pytest
+
+from filters import FILTER_OPS, filter_expression, filter_mask
+
+FRAME = pd.DataFrame({
+    'city': ['Pune', None, 'Delhi', 'nan', np.nan, 'Pune'],
+    'sales': [10.0, np.nan, 30.0, 5.0, 20.0, None],
+    'units': pd.array([1, 2, None, 4, 5, 6], dtype='Int64'),
+})
+
+
+def arrow_rows(filters):
+    buffer = io.BytesIO()
+    FRAME.to_parquet(buffer, index=False)
+    buffer.seek(0)
+    schema = pq.read_schema(buffer)
+    buffer.seek(0)
+    return pq.read_table(buffer, filters=filter_expression(filters, schema)).to_pandas()
+
+
+@pytest.mark.parametrize('op', FILTER_OPS)
+@pytest.mark.parametrize('column, value', [('city', 'Pune'), ('city', 'nan'), ('sales', '10'), ('units', '4')])
+def test_pandas_and_arrow_filters_keep_the_same_rows(column, op, value):
+    filters = [(column, op, value)]
+    expected = arrow_rows(filters)
+    kept = FRAME[filter_mask(FRAME, filters).to_numpy()].reset_index(drop=True)
+    pd.testing.assert_frame_equal(kept, expected, check_dtype=False)
+
+
+def test_missing_values_fail_every_filter():
+    assert not filter_mask(FRAME, [('city', '!=', 'Pune')])[[1, 4]].any()
@@ -0,0 +1,38 @@
+import pandas as pd
+
+from optimize import compact_column, compact_dtypes
+
+
+def text(values):
+    return pd.Series(values, dtype=object)
+
+
+def test_iso_dates_become_datetimes():
+    converted = compact_column(text(['2024-01-31', '2024-02-29', '2024-03-01']))
+    assert list(converted) == list(pd.to_datetime(['2024-01-31', '2024-02-29', '2024-03-01']))
+
+
+def test_day_first_dates_are_read_day_first():
+    converted = compact_column(text(['13/02/2024', '01/03/2024', '25/12/2024']))
+    assert list(converted.dt.month) == [2, 3, 12]
+
+
+def test_dates_that_fit_either_order_stay_text():
+    series = text(['01/02/2024', '03/04/2024', '05/06/2024', '07/08/2024'])
+    converted = compact_column(series)
+    assert converted is None or not pd.api.types.is_datetime64_any_dtype(converted)
+
+
+def test_numbers_are_narrowed_without_changing_values():
+    df = pd.DataFrame({'small': [1, 2, 300], 'halves': [0.5, 1.25, -2.0], 'city': ['Pune'] * 3})
+    compacted, report = compact_dtypes(df)
+
+    assert compacted['small'].dtype.itemsize < df['small'].dtype.itemsize
+    assert compacted['halves'].dtype == 'float32'
+    assert str(compacted['city'].dtype) == 'category'
+    assert report['after'] < report['before']
+    pd.testing.assert_frame_equal(compacted.astype(df.dtypes.to_dict()), df)
+
+
+def test_floats_that_lose_precision_stay_double():
+    assert compact_column(pd.Series([0.1, 1 / 3])) is None
@@ -0,0 +1,46 @@
+import ast
+
+import pytest
+
+from engine_diff import CASES, check, make_inputs, random_script
+from polars_engine import LazyReplay
+from replay import replay_code
+
+pytest.importorskip('polars')
+
+
+@pytest.fixture(scope='module')
+def inputs():
+    return make_inputs(2_000)
+
+
+@pytest.mark.parametrize('name', list(CASES))
+def test_builtin_scripts_match_pandas(name, inputs):
+    if 'mitosheet' in CASES[name]:
+        pytest.importorskip('mitosheet')
+    status, line = check(name, CASES[name], inputs)
+    assert status == 'ok', line
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_random_scripts_match_pandas(seed, inputs):
+    status, line = check(f'random #{seed}', random_script(seed, list(inputs['cards'].columns)), inputs)
+    assert status == 'ok', line
+
+
+def test_pivots_run_in_polars(inputs):
+    pytest.importorskip('mitosheet')
+    replay = LazyReplay(CASES['pivot'], inputs).run()
+    engines = [engine for engine, statement in replay.steps if '.pivot_table(' in ast.unparse(statement)]
+    assert engines == ['polars']
+
+
+def test_scripts_that_fail_on_both_engines_are_not_matches(inputs):
+    status, _ = check('missing frame', "cards = missing[missing['A'] > 1]\n", inputs)
+    assert status == 'SKIPPED'
+
+
+def test_frames_named_after_files_starting_with_a_digit_are_outputs(inputs):
+    code = "_2024_jan = _2024_jan[_2024_jan['POS_VOLUME_NOS'] > 1000000]\n"
+    frames = {'_2024_jan': inputs['cards']}
+    assert list(LazyReplay(code, frames).run().outputs()) == list(replay_code(code, frames)) == ['_2024_jan']
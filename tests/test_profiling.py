@@ -0,0 +1,35 @@
+import numpy as np
+import pandas as pd
+
+from profiling import column_key, profile_frame
+
+
+def test_column_key_sees_every_value():
+    series = pd.Series(np.arange(100_000), name='n')
+    edited = series.copy()
+    edited.iloc[54_321] = -1
+    assert column_key(series) == column_key(series.copy())
+    assert column_key(series) != column_key(edited)
+
+
+def test_column_key_sees_category_labels():
+    series = pd.Series(['a', 'b', 'a'], dtype='category')
+    renamed = series.cat.rename_categories(['x', 'b'])
+    assert column_key(series) != column_key(renamed)
+
+
+def test_column_key_handles_mixed_object_columns():
+    series = pd.Series([1, '1', None], dtype=object)
+    assert column_key(series) != column_key(pd.Series(['1', '1', None], dtype=object))
+
+
+def test_profile_frame_counts_by_position():
+    df = pd.DataFrame([[1, 'x'], [None, 'y'], [3, 'x']], columns=['a', 'a'])
+    numbers, labels = profile_frame(df)
+    assert (numbers.rows, numbers.nulls) == (3, 1)
+    assert labels.distinct == 2
+
+
+def test_mixed_object_columns_count_each_value_once():
+    (profile,) = profile_frame(pd.DataFrame({'a': pd.Series([1, 'a', 'a', None, 2.5], dtype=object)}))
+    assert (profile.distinct, profile.distinct_exact) == (3, True)
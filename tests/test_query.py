@@ -0,0 +1,47 @@
+import io
+
+import pytest
+
+import query
+from caching import content_hash, parse_cache, upload_key
+from query import QuerySource, run_query
+
+pytest.importorskip('duckdb')
+
+
+def csv_source(name, data):
+    source = io.BytesIO(data)
+    source.name = f'{name}.csv'
+    return QuerySource(name, source, 'csv', ',', None, content_hash(data))
+
+
+def test_text_uploads_are_parsed_once_for_every_query(monkeypatch):
+    source = csv_source('sales', b'city,amount\nPune,10\nDelhi,30\nPune,5\n')
+    parses = []
+    parse_source = query.parse_source
+    monkeypatch.setattr(query, 'parse_source', lambda *args: parses.append(args) or parse_source(*args))
+
+    totals = run_query("SELECT city, SUM(amount) AS total FROM sales GROUP BY city ORDER BY city", [source])
+    count = run_query("SELECT COUNT(*) AS n FROM sales", [source])
+
+    assert totals.to_dict('list') == {'city': ['Delhi', 'Pune'], 'total': [30, 15]}
+    assert count['n'].tolist() == [3]
+    assert len(parses) == 1
+    # The frame is the one the grid reads for the same upload
+    assert parse_cache.get(upload_key(source.file_hash, 'csv', ',')) is not None
+
+
+@pytest.mark.parametrize('sql, message', [
+    ("COPY (SELECT 1) TO 'out.csv'", 'Only SELECT queries'),
+    ("SELECT 1; SELECT 2", 'one SELECT statement at a time'),
+    ("SET enable_external_access=true", 'Only SELECT queries'),
+])
+def test_queries_can_only_read_the_uploads(sql, message):
+    with pytest.raises(ValueError, match=message):
+        run_query(sql, [csv_source('sales', b'city\nPune\n')])
+
+
+def test_queries_cannot_read_other_files():
+    duckdb = pytest.importorskip('duckdb')
+    with pytest.raises(duckdb.PermissionException, match='disabled'):
+        run_query("SELECT * FROM read_csv('/etc/hostname')", [csv_source('sales', b'city\nPune\n')])
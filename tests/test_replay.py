@@ -0,0 +1,82 @@
+import pandas as pd
+import pytest
+
+from loaders import clean_name, unique_names
+from replay import main as replay_main, replay_code, script_inputs
+
+
+def mito_code(frames, df_names, edits):
+    """The code Mito generates for ``edits`` (formula, sheet, new column) on ``frames`` named as the app names them."""
+    test_utils = pytest.importorskip('mitosheet.tests.test_utils')
+    wrapper = test_utils.create_mito_wrapper(*frames, arg_names=df_names)
+    for formula, sheet_index, column in edits:
+        wrapper.set_formula(formula, sheet_index, column, add_column=True)
+    return '\n'.join(wrapper.mito_backend.steps_manager.code())
+
+
+def test_generated_code_replays_on_the_full_frames():
+    names = unique_names([clean_name('sales 2024'), clean_name('2024 targets')])
+    sample = [pd.DataFrame({'A': [1, 2]}), pd.DataFrame({'A': [5]})]
+    code = mito_code(sample, names, [('=A * 2', 0, 'B'), ('=A + 1', 1, 'C')])
+    assert 'df1' not in code
+
+    full = {names[0]: pd.DataFrame({'A': [10, 20, 30]}), names[1]: pd.DataFrame({'A': [0, 1]})}
+    outputs = replay_code(code, full)
+
+    assert list(outputs) == names
+    assert outputs[names[0]]['B'].tolist() == [20, 40, 60]
+    assert outputs[names[1]]['C'].tolist() == [1, 2]
+    # The inputs are left as they were
+    assert list(full[names[0]].columns) == ['A']
+
+
+def test_unique_names_suffixes_repeats():
+    assert unique_names(['sales', 'sales', 'sales_2', 'sales']) == ['sales', 'sales_2', 'sales_2_2', 'sales_3']
+
+
+def test_script_inputs_are_the_frames_read_before_assignment():
+    code = (
+        "from mitosheet.public.v3 import *\n"
+        "import pandas as pd\n"
+        "df1['B'] = SUM(df1['A'])\n"
+        "df3 = pd.merge(df1, df2, how='left')\n"
+        "df2 = df2.dropna()\n"
+        "columns = [column for column in df3.columns if column]\n"
+    )
+    assert script_inputs(code) == ['df1', 'df2']
+
+
+def test_cli_binds_a_bare_path_to_the_one_frame_the_script_reads(tmp_path, capsys):
+    script = tmp_path / 'transform.py'
+    script.write_text("df1['B'] = df1['A'] * 2\n")
+    data = tmp_path / 'jan.csv'
+    pd.DataFrame({'A': [1, 2]}).to_csv(data, index=False)
+    out = tmp_path / 'out.csv'
+
+    assert replay_main([str(script), '--input', str(data), '--out', str(out)]) == 0
+    assert pd.read_csv(out)['B'].tolist() == [2, 4]
+
+
+def test_cli_names_the_frames_it_cannot_bind(tmp_path, capsys):
+    script = tmp_path / 'transform.py'
+    script.write_text("df3 = df1.merge(df2)\n")
+    paths = []
+    for name in ('jan', 'feb'):
+        paths.append(tmp_path / f'{name}.csv')
+        pd.DataFrame({'A': [1]}).to_csv(paths[-1], index=False)
+
+    args = [str(script), '--input', str(paths[0]), '--input', str(paths[1]), '--out-dir', str(tmp_path / 'out')]
+    assert replay_main(args) == 1
+    assert 'reads df1, df2' in capsys.readouterr().err
+
+
+def test_cli_reads_csv_inputs_with_a_comma_as_the_app_does(tmp_path, capsys):
+    script = tmp_path / 'transform.py'
+    script.write_text("df1['n'] = df1['note'].str.len()\n")
+    # A sniffer would take the semicolons for the separator
+    data = tmp_path / 'jan.csv'
+    data.write_text('note\na;b;c\nd;e;f\ng;h;i\n')
+    out = tmp_path / 'out.csv'
+
+    assert replay_main([str(script), '--input', str(data), '--out', str(out)]) == 0
+    assert pd.read_csv(out)['note'].tolist() == ['a;b;c', 'd;e;f', 'g;h;i']
@@ -0,0 +1,55 @@
+import pandas as pd
+import pytest
+
+import store
+
+
+@pytest.fixture(autouse=True)
+def empty_store(tmp_path, monkeypatch):
+    monkeypatch.setattr(store, 'STORE_DIR', str(tmp_path))
+    monkeypatch.setattr(store, 'INDEX_PATH', str(tmp_path / 'index.json'))
+    monkeypatch.setattr(store, '_index', None)
+
+
+def saved(df, owner, key='k1', name='sales'):
+    store.save_dataset(key, df, name, {'changes': {}}, owner).result()
+    return key
+
+
+def test_datasets_are_listed_and_loaded_only_for_their_owner():
+    df = pd.DataFrame({'city': ['Pune', 'Delhi'], 'sales': [10, 20]})
+    key = saved(df, 'alice')
+
+    assert [entry['key'] for entry in store.recent_datasets('alice')] == [key]
+    assert store.recent_datasets('bob') == []
+    assert store.recent_datasets(None) == []
+    assert store.load_dataset(key, 'bob') is None
+
+    loaded, report = store.load_dataset(key, 'alice')
+    # Reopened columns are Arrow-backed, so they stay on the memory map
+    assert all(isinstance(dtype, pd.ArrowDtype) for dtype in loaded.dtypes)
+    pd.testing.assert_frame_equal(loaded.astype(df.dtypes.to_dict()), df)
+    assert report == {'changes': {}}
+
+
+def test_claiming_shares_a_dataset_with_a_second_owner():
+    key = saved(pd.DataFrame({'a': [1, 2, 3]}), 'alice')
+
+    assert store.load_dataset(key, 'bob', claim=True) is not None
+    assert [entry['key'] for entry in store.recent_datasets('bob')] == [key]
+
+    other = saved(pd.DataFrame({'b': [1]}), 'alice', key='k2')
+    store.claim_dataset(other, 'carol')
+    assert [entry['key'] for entry in store.recent_datasets('carol')] == [other]
+
+
+def test_the_index_keeps_owner_hashes_not_tokens(tmp_path):
+    saved(pd.DataFrame({'a': [1]}), 'secret-token')
+    assert 'secret-token' not in (tmp_path / 'index.json').read_text()
+
+
+def test_a_report_json_cannot_hold_leaves_the_index_usable():
+    assert store.save_dataset('bad', pd.DataFrame({'a': [1]}), 'sales', {'at': object()}, 'alice').result() is None
+    key = saved(pd.DataFrame({'a': [1]}), 'alice')
+    assert [entry['key'] for entry in store.recent_datasets('alice')] == [key]
+    assert store.load_dataset(key, 'alice') is not None
@@ -0,0 +1,99 @@
+"""Server-side sort, filter and paging for showing large output frames a page at a time."""
+
+import operator
+import os
+import re
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+from caching import ByteLRU, frame_nbytes
+
+PAGE_SIZES = [50, 100, 500, 1000]
+
+# Row orders for each (frame, sort, filter) combination, so paging never re-sorts
+_positions = ByteLRU(
+    int(float(os.getenv('VIEW_CACHE_MAX_MB', '256')) * 1024 * 1024),
+    sizeof=lambda positions: positions.nbytes,
+)
+# Summaries are tiny; bound them by count
+_summaries = ByteLRU(256, sizeof=lambda summary: 1)
+
+_COMPARISON = re.compile(r'^\s*(>=|<=|!=|==|=|>|<)\s*(.+?)\s*$')
+_OPERATORS = {
+    '>=': operator.ge,
+    '<=': operator.le,
+    '!=': operator.ne,
+    '==': operator.eq,
+    '=': operator.eq,
+    '>': operator.gt,
+    '<': operator.lt,
+}
+
+
+def frame_summary(df, identity):
+    summary = _summaries.get(identity)
+    if summary is None:
+        summary = {
+            'rows': len(df),
+            'columns': len(df.columns),
+            'memory': frame_nbytes(df),
+            'dtypes': Counter(str(dtype) for dtype in df.dtypes).most_common(),
+        }
+        _summaries.put(identity, summary)
+    return summary
+
+
+def _filter_mask(series, text):
+    """Rows of ``series`` matching ``text``: a comparison like ``>= 100`` or a case-insensitive substring."""
+    match = _COMPARISON.match(text)
+    if match:
+        compare = _OPERATORS[match.group(1)]
+        value = match.group(2)
+        if pd.api.types.is_numeric_dtype(series.dtype):
+            value = pd.to_numeric(value, errors='coerce')
+            if pd.isna(value):
+                return np.zeros(len(series), dtype=bool)
+        elif pd.api.types.is_datetime64_any_dtype(series.dtype):
+            value = pd.to_datetime(value, errors='coerce')
+        else:
+            series = series.astype(str)
+        return compare(series, value).fillna(False).to_numpy(dtype=bool)
+    return series.astype(str).str.contains(text, case=False, regex=False, na=False).to_numpy(dtype=bool)
+
+
+def view_positions(df, identity, sort_by=None, ascending=True, filter_column=None, filter_text=''):
+    """Row positions of ``df`` after filtering and sorting, cached per frame identity.
+
+    ``identity`` is any hashable that changes whenever the frame's values do.
+
+    Columns are given by position, so duplicate column names are no problem.
+    """
+    key = (identity, sort_by, ascending, filter_column, filter_text)
+    positions = _positions.get(key)
+    if positions is not None:
+        return positions
+
+    positions = np.arange(len(df))
+    if filter_column is not None and filter_text:
+        if sort_by is not None:
+            # The unsorted filter result is cached on its own, so changing only
+            # the sort order doesn't filter again
+            positions = view_positions(df, identity, None, True, filter_column, filter_text)
+        else:
+            positions = positions[_filter_mask(df.iloc[:, filter_column], filter_text)]
+
+    if sort_by is not None:
+        values = df.iloc[positions, sort_by].reset_index(drop=True)
+        order = values.sort_values(ascending=ascending, kind='stable', na_position='last').index.to_numpy()
+        positions = positions[order]
+
+    _positions.put(key, positions)
+    return positions
+
+
+def page(df, positions, page_number, page_size):
+    """The rows for 1-based ``page_number``, in view order."""
+    start = (page_number - 1) * page_size
+    return df.iloc[positions[start:start + page_size]]
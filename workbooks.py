@@ -0,0 +1,81 @@
+"""Open each uploaded XLSX workbook once and stream its sheets in read-only mode."""
+
+import io
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+from caching import upload_hash
+from ingest import dedupe_columns, read_all
+from metrics import timed_import
+
+MAX_OPEN_WORKBOOKS = 8
+
+_handles = OrderedDict()
+_handles_lock = threading.Lock()
+
+
+class WorkbookHandle:
+    """A read-only openpyxl workbook shared by all reruns for one upload."""
+
+    def __init__(self, source):
+        # openpyxl is only imported once a workbook is uploaded. Read-only mode
+        # only parses workbook.xml here; sheet cells are streamed from the
+        # archive when a sheet is actually read
+        openpyxl = timed_import('openpyxl')
+        self.workbook = openpyxl.load_workbook(source, read_only=True, data_only=True)
+        self.sheet_names = list(self.workbook.sheetnames)
+        self._lock = threading.Lock()
+
+    def read_sheet(self, sheet_name, max_rows=None):
+        """The sheet as a frame with its first row as the header, stopping after ``max_rows`` data rows."""
+        with self._lock:
+            worksheet = self.workbook[sheet_name]
+            # Dimensions written by some producers are wrong; recompute while streaming
+            worksheet.reset_dimensions()
+            rows = []
+            last_row = max_rows + 1 if max_rows is not None else None
+            for row in worksheet.iter_rows(max_row=last_row, values_only=True):
+                # Trim trailing empty cells, as pandas does
+                end = len(row)
+                while end and row[end - 1] is None:
+                    end -= 1
+                rows.append(row[:end])
+
+        while rows and not rows[-1]:
+            rows.pop()
+        if not rows:
+            return pd.DataFrame()
+
+        width = max(len(row) for row in rows)
+        header = list(rows[0]) + [None] * (width - len(rows[0]))
+        body = [row + (None,) * (width - len(row)) for row in rows[1:]]
+        df = pd.DataFrame.from_records(body, columns=dedupe_columns(header))
+        return df.infer_objects()
+
+    def close(self):
+        self.workbook.close()
+
+
+def open_workbook(uploaded_file):
+    """Return the shared ``WorkbookHandle`` for an upload, opening it on first use."""
+    key = upload_hash(uploaded_file)
+    with _handles_lock:
+        handle = _handles.get(key)
+        if handle is not None:
+            _handles.move_to_end(key)
+            return handle
+
+    # A private stream over the upload bytes, so other readers can't move its position
+    handle = WorkbookHandle(io.BytesIO(read_all(uploaded_file)))
+
+    with _handles_lock:
+        if key in _handles:
+            handle.close()
+            return _handles[key]
+        _handles[key] = handle
+        while len(_handles) > MAX_OPEN_WORKBOOKS:
+            _, evicted = _handles.popitem(last=False)
+            evicted.close()
+    return handle